@@ -5,14 +5,38 @@ Commands describe the input the player can do to the game.
 
 """
 
+from django.conf import settings
+from django.db import transaction
 from evennia import Command as BaseCommand
 from evennia import default_cmds
+from evennia import create_script
 from evennia import utils
 from evennia.utils import evmenu
+from evennia.utils import logger
 from world import rules
+from world import landmarks
+from world import fights
+from world import metrics
+from world import history
+from world import ratings
+from world import tournaments
+from world import brackets
+from world import arenas
+from world import matchmaking
 from random import randint
 import math
 
+# How many fights the 'history' command shows at once.
+HISTORY_PAGE_SIZE = 10
+# How many fighters 'rank/top' shows at once.
+LEADERBOARD_PAGE_SIZE = 10
+
+# Set ATOMIC_COMMANDS = False in settings to let atomic commands save as they go, like every other command.
+# It needs a database that locks rows rather than the whole file - on SQLite, a command's transaction and the
+# background writer's (see world/writer.py) can each fail the other with "database is locked" - so it's off there
+# unless turned on.
+ATOMIC_COMMANDS = getattr(settings, "ATOMIC_COMMANDS", "sqlite3" not in settings.DATABASES["default"]["ENGINE"])
+
 
 class Command(BaseCommand):
     """
@@ -130,7 +154,12 @@ class MuxCommand(default_cmds.MuxCommand):
 
     All args and list members are stripped of excess whitespace around the
     strings, but case is preserved.
+
+    Commands that save a lot of things at once can set `atomic = True` to
+    run their func() inside one database transaction, so everything they
+    save is committed together instead of one at a time.
     """
+    atomic = False
 
     def func(self):
         """
@@ -141,9 +170,55 @@ class MuxCommand(default_cmds.MuxCommand):
         # this can be removed in your child class, it's just
         # printing the ingoing variables as a demo.
         super(MuxCommand, self).func()
+    def at_pre_cmd(self):
+        "Called before self.parse()"
+        # Hold back the room's combat messages while the command runs, so they go out as one message.
+        self.broadcast_location = None
+        if rules.begin_broadcast(self.caller.location):
+            self.broadcast_location = self.caller.location
+        # The same command object runs every time the command is used, so only wrap func the first time.
+        if self.atomic and ATOMIC_COMMANDS and not getattr(self.func, "atomic", False):
+            self.func = self.atomic_func(self.func)
+    def atomic_func(self, func):
+        "Returns func wrapped to run in a single database transaction."
+        def run_atomic():
+            objects = self.atomic_objects()
+            turnhandler = self.caller.combat.TurnHandler if getattr(self.caller, "combat", None) else None
+            saved = turnhandler.memory_state() if turnhandler else None
+            try:
+                with transaction.atomic():
+                    return func()
+            except Exception:
+                # Everything saved during the command was rolled back, so forget anything the Attribute caches picked up.
+                for obj in objects:
+                    obj.attributes.reset_cache()
+                    # As well as the stat sheet kept in memory alongside them.
+                    if hasattr(obj, "reset_derived_stats"):
+                        obj.ndb.sheet = None
+                        obj.reset_derived_stats()
+                # Combat state is only in memory, so it has to be put back by hand.
+                if saved:
+                    turnhandler.restore_memory_state(saved)
+                    # Anything already marked to go out to clients is now the restored state, so send all of it.
+                    for fighter in turnhandler.fighters:
+                        for kind in ("stats", "conditions", "incoming", "ranges"):
+                            rules.mark_oob_change(fighter, kind)
+                raise
+        run_atomic.atomic = True
+        return run_atomic
+    def atomic_objects(self):
+        "Returns everything an atomic command might have saved Attributes on - the caller, and everyone in their fight."
+        turnhandler = getattr(self.caller, "combat", None) and self.caller.combat.TurnHandler
+        if turnhandler:
+            return [self.caller] + [fighter for fighter in turnhandler.fighters if fighter != self.caller]
+        return [self.caller]
     def at_post_cmd(self):
         "Called after self.func()"
+        if self.broadcast_location:
+            rules.end_broadcast(self.broadcast_location)
+        # Send the prompt now rather than waiting for the next reactor iteration.
         rules.prompt_update(self.caller)
+        rules.flush_prompt(self.caller)
 
 class CmdLook(MuxCommand):
     """
@@ -191,6 +266,7 @@ class CmdSetStat(MuxCommand):
     """
     key = "setstat"
     help_category = "chargen"
+    atomic = True
 
     def func(self):
         "This performs the actual command"
@@ -223,31 +299,33 @@ class CmdSetStat(MuxCommand):
         # Now, we'll test to see what stat is named, using either the
         # abbreviation or the stat's full name.
         if statname == "atm" or statname == "melee" or statname == "melee attack":
-            self.caller.db.ATM = value
+            self.caller.set_stats({"ATM":value})
             self.caller.msg("Your Melee Attack was set to |555%i|n." % value)
         elif statname == "def" or statname == "defense":
-            self.caller.db.DEF = value
+            self.caller.set_stats({"DEF":value})
             self.caller.msg("Your Defense was set to |555%i|n." % value)
         elif statname == "vit" or statname == "vitality":
-            self.caller.db.VIT = value
+            # set_stats() resets the derived stats, so the new maximum is worked out from the new VIT.
+            self.caller.set_stats({"VIT":value})
+            maxhp = self.caller.derived_stats()["MaxHP"]
             # Also sets your HP to its new maximum.
-            self.caller.db.HP = max(value * 3, 1)
-            self.caller.msg("Your Vitality was set to %i|n and your new HP maximum is |555%i|n." % (value, max(value * 3, 1)))
+            self.caller.db.HP = maxhp
+            self.caller.msg("Your Vitality was set to %i|n and your new HP maximum is |555%i|n." % (value, maxhp))
         elif statname == "atr" or statname == "ranged attack" or statname == "ranged":
-            self.caller.db.ATR = value
+            self.caller.set_stats({"ATR":value})
             self.caller.msg("Your Ranged Attack was set to |555%i|n." % value)
         elif statname == "mob" or statname == "mobility":
-            self.caller.db.MOB = value
+            self.caller.set_stats({"MOB":value})
             self.caller.msg("Your Mobility was set to |555%i|n." % value)
         elif statname == "spe" or statname == "special":
             self.caller.db.SP = value * 2
-            self.caller.db.SPE = value
+            self.caller.set_stats({"SPE":value})
             self.caller.msg("Your Special was set to |555%i|n and your new SP maximum is |555%i|n." % (value, value * 2))
         # If the stat didn't have a valid name, return an error.
         else:
             self.caller.msg("\"" + self.lhs + "\" is not a valid stat name. Stats are Melee Attack (|522ATM|n), Ranged Attack (|525ATR|n), Defense (|225DEF|n), Vitality (|252VIT|n), Mobility (|552MOB|n), and Special (|255SPE|n).")
             return
-        remain = 36 - (self.caller.db.ATM + self.caller.db.DEF + self.caller.db.VIT + self.caller.db.ATR + self.caller.db.MOB + self.caller.db.SPE)
+        remain = 36 - sum(self.caller.derived_stats()["Stats"])
         point = "points"
         if remain == 1 or remain == -1:
             point = "point"
@@ -269,14 +347,14 @@ class CmdResetStats(MuxCommand):
     """
     key = "resetstats"
     help_category = "chargen"
+    atomic = True
 
     def func(self):
         """
         This performs the actual command.
         """
         self.caller.msg("All stats reset to 6.")
-        for stat in ('ATM', 'DEF', 'VIT', 'ATR', 'MOB', 'SPE'):
-            self.caller.attributes.add(stat, 6)
+        self.caller.set_stats(dict.fromkeys(('ATM', 'DEF', 'VIT', 'ATR', 'MOB', 'SPE'), 6))
         self.caller.db.HP = 18
         self.caller.db.SP = 12
 
@@ -547,6 +625,7 @@ class CmdAttack(MuxCommand):
     key = "attack"
     aliases = ["hit", "strike", "atk", "at"]
     help_category = "combat"
+    atomic = True
 
     def func(self):
         """
@@ -564,7 +643,7 @@ class CmdAttack(MuxCommand):
         target = self.caller.search(self.arglist[0])
         # Attack type is ranged if target is farther than range 0, or melee if target is at range 0
         attack_type = "ranged"
-        if self.caller.db.Combat_Range[target] == 0:
+        if self.caller.combat.Range[target] == 0:
             attack_type = "melee"
         # Check the attack type versus the target and give an error message if needed.
         type_check = rules.attack_type_check(self.caller, target, attack_type, [])
@@ -581,8 +660,8 @@ class CmdAttack(MuxCommand):
         # If everything checks out, queue the attack and spend the action.
         
         rules.queue_attack(self.caller, target, attack_message, [], attack_type)
-        self.caller.db.Combat_LastAction = "attack"
-        self.caller.db.Combat_Actions -= 1
+        self.caller.combat.LastAction = "attack"
+        self.caller.combat.Actions -= 1
         
 class CmdSecond(MuxCommand):
     """
@@ -594,12 +673,13 @@ class CmdSecond(MuxCommand):
     key = "second"
     aliases = []
     help_category = "combat"
+    atomic = True
 
     def func(self):
         """
         This performs the actual command.
         """
-        if not self.caller.db.Combat_Second:
+        if not self.caller.combat.Second:
             self.caller.msg("|413You can't make a second attack!|n")
             return
 
@@ -613,10 +693,10 @@ class CmdSecond(MuxCommand):
         # Since the input was tested as valid, set the target here.
         target = self.caller.search(self.arglist[0])
         # The attack type is set to the previous attack type.
-        attack_type = self.caller.db.Combat_Second[0]
+        attack_type = self.caller.combat.Second[0]
         type_check = rules.attack_type_check(self.caller, target, attack_type, [])
         # Also get the effects, if any.
-        effects = self.caller.db.Combat_Second[1]
+        effects = self.caller.combat.Second[1]
         if type_check:
             self.caller.msg(type_check)
             return
@@ -630,8 +710,8 @@ class CmdSecond(MuxCommand):
         # If everything checks out, queue the attack and delete the second attack value.
         
         rules.queue_attack(self.caller, target, attack_message, effects, attack_type)
-        self.caller.db.Combat_LastAction = "attack"
-        del self.caller.db.Combat_Second
+        self.caller.combat.LastAction = "attack"
+        del self.caller.combat.Second
     
 class CmdDefend(MuxCommand):   
     """
@@ -664,12 +744,13 @@ class CmdDefend(MuxCommand):
     key = "defend"
     aliases = ["defense", "def", "block", "guard", "dodge", "df"]
     help_category = "combat"
+    atomic = True
 
     def func(self):
         """
         This performs the actual command.
         """
-        if not self.caller.db.Combat_IncomingAttack:
+        if not self.caller.combat.IncomingAttack:
             # No incoming attacks.
             self.caller.msg("There are no incoming attacks!")
             return
@@ -695,12 +776,13 @@ class CmdEndure(MuxCommand):
     """
     key = "endure"
     help_category = "combat"
+    atomic = True
 
     def func(self):
         """
         This performs the actual command.
         """
-        if not self.caller.db.Combat_IncomingAttack:
+        if not self.caller.combat.IncomingAttack:
             # No incoming attacks.
             self.caller.msg("There are no incoming attacks!")
             return
@@ -717,12 +799,13 @@ class CmdRest(MuxCommand):
     key = "rest"
     aliases = ["recover"]
     help_category = "combat"
+    atomic = True
 
     def func(self):
         """
         This performs the actual command.
         """
-        if self.caller.db.Combat_TurnHandler:
+        if self.caller.combat.TurnHandler:
             # In combat.
             self.caller.msg("You can't rest, you're in a fight!")
             return
@@ -743,11 +826,15 @@ class CmdReturn(MuxCommand):
         """
         This performs the actual command.
         """
-        if self.caller.db.Combat_TurnHandler:
+        if self.caller.combat.TurnHandler:
             # In combat.
             self.caller.msg("You can't return, you're in a fight!")
             return
-        if self.caller.location == self.caller.search("The Institute's Recovery Bay", global_search=True):
+        recoverybay = landmarks.get_landmark("recovery_bay")
+        if not recoverybay:
+            self.caller.msg("|413Could not find the recovery bay! Let the staff know.|n")
+            return
+        if self.caller.location == recoverybay:
             # Already there.
             self.caller.msg("You're already at the recovery bay!")
             return
@@ -756,7 +843,7 @@ class CmdReturn(MuxCommand):
             self.caller.msg("You can't do that until you've entered the game!")
             return
         self.caller.location.msg_contents("With a flash of glowing green light, %s vanishes." % self.caller)
-        self.caller.location = self.caller.search("The Institute's Recovery Bay", global_search=True)
+        self.caller.move_directly(recoverybay)
         self.caller.execute_cmd("look")
         self.caller.location.msg_contents("%s appears in a flash of glowing green light." % self.caller)
 
@@ -844,6 +931,195 @@ class CmdAlly(MuxCommand):
             
             
 
+class CmdSpectate(MuxCommand):
+    """
+    Watch a fight from anywhere.
+
+    Usage:
+    spectate[/switches] <fighter or room>
+
+    Switches:
+    stop - Stop watching.
+
+    Examples:
+    > spectate Champion
+    You start watching Champion's fight.
+
+    > spectate
+    You're watching the fight between Champion, Challenger.
+
+    > spectate/stop
+    You stop watching the fight.
+
+    Follow a fight you aren't in, wherever it is. Rather
+    than every message as it happens, you're sent what
+    happened each turn when the turn ends, no more often
+    than once every few seconds. You can only watch one
+    fight at a time. Fights can be watched from the
+    website's spectate page too.
+    """
+
+    key = "spectate"
+    aliases = ["watch"]
+    help_category = "combat"
+
+    def func(self):
+        "Performs the command."
+        if "stop" in self.switches:
+            if not rules.remove_spectator(self.caller):
+                self.caller.msg("You aren't watching a fight.")
+                return
+            self.caller.msg("You stop watching the fight.")
+            return
+        # If no arguments, say what's being watched.
+        if not self.args:
+            handler = self.caller.ndb.spectating
+            if not handler:
+                self.caller.msg("You aren't watching a fight.")
+                return
+            self.caller.msg("You're watching the fight between %s." % ", ".join(str(fighter) for fighter in handler.fighters))
+            return
+        target = self.caller.search(self.args, global_search=True)
+        if not target:
+            return
+        handler = rules.find_fight(target)
+        if not handler:
+            self.caller.msg("There's no fight going on there.")
+            return
+        if self.caller.combat.TurnHandler == handler:
+            self.caller.msg("You're already in that fight!")
+            return
+        self.caller.msg("You start watching %s's fight." % target)
+        rules.add_spectator(handler, self.caller)
+
+class CmdHistory(MuxCommand):
+    """
+    Look back over your past fights.
+
+    Usage:
+    history[/switches] [character]
+
+    Switches:
+    next - Show the next page of older fights.
+
+    Examples:
+    > history
+    > history Champion
+    > history/next
+
+    Shows your finished fights, or someone else's, newest
+    first and ten at a time - who you fought, how it ended,
+    and how much damage you dealt. Use 'history/next' to
+    keep going further back.
+    """
+
+    key = "history"
+    aliases = ["record"]
+    help_category = "combat"
+
+    def func(self):
+        "Performs the command."
+        if not history.HISTORY_INSTALLED:
+            self.caller.msg("Match history isn't turned on for this game.")
+            return
+        if "next" in self.switches:
+            cursor = self.caller.ndb.history_cursor
+            if not cursor:
+                self.caller.msg("Use 'history' to start looking through fights first.")
+                return
+            fighter_id, name, before = cursor
+        else:
+            target = self.caller
+            if self.args:
+                target = self.caller.search(self.args, global_search=True)
+                if not target:
+                    return
+            fighter_id, name, before = target.id, target.key, None
+        page = history.fight_history(fighter_id, before, HISTORY_PAGE_SIZE)
+        if not page:
+            self.caller.ndb.history_cursor = None
+            if before:
+                self.caller.msg("There are no older fights.")
+            else:
+                self.caller.msg("%s hasn't finished any fights yet." % name)
+            return
+        lines = ["|445%s|n" % '{:-^80}'.format(" %s's fights " % name)]
+        for participant, record, opponents in page:
+            if participant.db_won:
+                result = "|252Won|n"
+            elif record.db_outcome == "victory":
+                result = "|413Lost|n"
+            elif record.db_outcome == "disengage":
+                result = "|222Disengaged|n"
+            else:
+                result = "|222Stopped|n"
+            lines.append("%s %s vs. %s - %i damage dealt, %i specials, %i turns" % (record.db_ended.strftime("%Y-%m-%d %H:%M"), result,
+                         ", ".join(opponents) or "nobody", participant.db_damage_dealt, participant.db_specials_used, record.db_turns))
+        last = page[-1][0]
+        self.caller.ndb.history_cursor = (fighter_id, name, (last.db_ended, last.id))
+        if len(page) == HISTORY_PAGE_SIZE:
+            lines.append("Use 'history/next' to see older fights.")
+        self.caller.msg("\n".join(lines))
+
+class CmdRank(MuxCommand):
+    """
+    See your rating and rank, or the leaderboard.
+
+    Usage:
+    rank[/switches] [character]
+
+    Switches:
+    top - Show the leaderboard, ten places to a page.
+
+    Examples:
+    > rank
+    > rank Champion
+    > rank/top
+    > rank/top 2
+
+    Everyone who has won or lost a fight has a rating,
+    which goes up when you win and down when you lose -
+    by more when the odds were against it. Fights that
+    end with everyone disengaging don't count.
+    """
+
+    key = "rank"
+    aliases = ["rating", "leaderboard"]
+    help_category = "combat"
+
+    def func(self):
+        "Performs the command."
+        if "top" in self.switches or self.cmdstring == "leaderboard":
+            self.show_leaderboard()
+            return
+        target = self.caller
+        if self.args:
+            target = self.caller.search(self.args, global_search=True)
+            if not target:
+                return
+        entry = ratings.rating_entry(target.id)
+        if not entry:
+            self.caller.msg("%s hasn't had a rated fight yet." % target)
+            return
+        self.caller.msg("%s is ranked |455#%i|n of %i, with a rating of |455%i|n from %i rated fights." %
+                        (target, ratings.rank(target.id), ratings.board_size(), entry[0], entry[1]))
+    def show_leaderboard(self):
+        "Shows a page of the leaderboard."
+        page = 1
+        if self.args:
+            if not self.args.isdigit() or int(self.args) < 1:
+                self.caller.msg("Usage: rank/top [page]")
+                return
+            page = int(self.args)
+        entries = ratings.top(LEADERBOARD_PAGE_SIZE, (page - 1) * LEADERBOARD_PAGE_SIZE)
+        if not entries:
+            self.caller.msg("There's nobody on that page of the leaderboard.")
+            return
+        lines = ["|445%s|n" % '{:-^80}'.format(" Leaderboard ")]
+        for place, fighter_id, name, rating, games in entries:
+            lines.append("|455#%i|n %s - %i (%i fights)" % (place, name, rating, games))
+        self.caller.msg("\n".join(lines))
+
 class CmdStats(MuxCommand):
     """
     Displays your stats as well as your current HP and SP.
@@ -908,16 +1184,17 @@ class CmdStats(MuxCommand):
         This performs the actual command.
         """
         name = self.caller
-        attackmelee = self.caller.db.ATM
-        defense = self.caller.db.DEF
-        vitality = self.caller.db.VIT
-        attackrange = self.caller.db.ATR
-        mobility = self.caller.db.MOB
-        special = self.caller.db.SPE
+        sheet = self.caller.sheet
+        attackmelee = sheet.ATM
+        defense = sheet.DEF
+        vitality = sheet.VIT
+        attackrange = sheet.ATR
+        mobility = sheet.MOB
+        special = sheet.SPE
         HP = self.caller.db.HP
         SP = self.caller.db.SP
-        MaxHP = max(self.caller.db.VIT * 3, 1)
-        MaxSP = self.caller.db.SPE * 2
+        MaxHP = self.caller.derived_stats()["MaxHP"]
+        MaxSP = self.caller.derived_stats()["MaxSP"]
         CurrentHP = ("%i/%i" % (HP, MaxHP))
         CurrentSP = ("%i/%i" % (SP, MaxSP))
         self.caller.msg("%s's Stats:|/-------------------------|/   |522ATM: |544%i|n     |525ATR: |545%i|n|/   |225DEF: |445%i|n     |552MOB: |554%i|n|/   |252VIT: |454%i|n     |255SPE: |455%i|n|/-------------------------|/  |252HP:|n %s   |255SP|n: %s" % (name, attackmelee, attackrange, defense, mobility, vitality, special, CurrentHP, CurrentSP))
@@ -925,6 +1202,14 @@ class CmdStats(MuxCommand):
 class CmdFight(MuxCommand):
     """
     Starts a fight with everyone in the current room.
+
+    Usage:
+    fight[/switches]
+
+    Switches:
+    phase - Fight in rounds where everyone declares their
+            actions at once. Much faster for big battles -
+            see 'help declare'.
     """
     key = "fight"
     help_category = "combat"
@@ -934,13 +1219,10 @@ class CmdFight(MuxCommand):
         This performs the actual command.
         """
         here = self.caller.location
-        fighters = []
         if not here.db.CombatAllowed:
             self.caller.msg("You're not allowed to fight here!")
             return
-        for thing in here.contents:
-            if thing.db.HP:
-                fighters.append(thing)
+        fighters = here.fighters_here()
         if len(fighters) <= 1:
             self.caller.msg("There's nobody here to fight!")
             return
@@ -948,9 +1230,470 @@ class CmdFight(MuxCommand):
             here.msg_contents("%s joins the fight!" % self.caller)
             here.db.Combat_TurnHandler.join_fight(self.caller)
             return
+        if "phase" in self.switches:
+            here.msg_contents("%s starts a fight! Everyone declares their actions at once." % self.caller)
+            here.scripts.add("scripts.PhaseTurnHandler")
+            return
         here.msg_contents("%s starts a fight!" % self.caller)
         here.scripts.add("scripts.TurnHandler")
 
+class CmdFights(MuxCommand):
+    """
+    List every fight going on.
+
+    Usage:
+    @fights
+
+    Shows the id, room and fighters of every fight in the
+    game. Use '@fight <id>' for more about one of them.
+    """
+
+    key = "@fights"
+    locks = "cmd:perm(Builders)"
+    help_category = "admin"
+
+    def func(self):
+        "Performs the command."
+        fightlist = fights.all_fights()
+        if not fightlist:
+            self.caller.msg("There are no fights going on.")
+            return
+        lines = ["|445%s|n" % '{:-^80}'.format(" %i fights going on " % len(fightlist))]
+        for handler in fightlist:
+            lines.append("|455#%i|n %s: %s" % (handler.db.fight_id, handler.obj, ", ".join(str(fighter) for fighter in handler.fighters)))
+        self.caller.msg("\n".join(lines))
+
+class CmdFightInfo(MuxCommand):
+    """
+    Show the state of a fight.
+
+    Usage:
+    @fight <id>
+
+    Shows where a fight is, whose turn it is, and the
+    status of everyone in it.
+    """
+
+    key = "@fight"
+    locks = "cmd:perm(Builders)"
+    help_category = "admin"
+
+    def func(self):
+        "Performs the command."
+        handler = self.fight_from_args()
+        if not handler:
+            return
+        fighters = handler.fighters
+        mode = "phase" if handler.phase_mode else "turn"
+        lines = ["|445%s|n" % '{:-^80}'.format(" Fight #%i (%s mode) " % (handler.db.fight_id, mode)),
+                 "Room: %s (%s)" % (handler.obj, handler.obj.dbref),
+                 "Started: %s" % handler.date_created,
+                 "Current turn: %s" % fighters[handler.db.turn]]
+        # Staff looking at a fight they're in see ranges from where they stand, like 'range' shows them.
+        viewer = self.caller if self.caller in fighters else None
+        for fighter in fighters:
+            lines.append(rules.combat_status_line(fighter, viewer))
+        self.caller.msg("\n".join(lines))
+    def fight_from_args(self):
+        "Returns the fight whose id was given, or None after telling the caller why not."
+        fight_id = self.args.lstrip("#")
+        if not fight_id.isdigit():
+            self.caller.msg("Usage: %s <fight id>" % self.key)
+            return None
+        handler = fights.get_fight(int(fight_id))
+        if not handler:
+            self.caller.msg("There's no fight #%s going on." % fight_id)
+        return handler
+
+class CmdEndFight(CmdFightInfo):
+    """
+    Stop a fight.
+
+    Usage:
+    @endfight <id>
+
+    Ends a fight right away, wherever it is. Everyone in it
+    is taken out of combat, same as if it had ended normally.
+    """
+
+    key = "@endfight"
+    locks = "cmd:perm(Builders)"
+    help_category = "admin"
+
+    def func(self):
+        "Performs the command."
+        handler = self.fight_from_args()
+        if not handler:
+            return
+        fight_id = handler.db.fight_id
+        endmessage = '{:-^80}'.format(" The fight has been stopped by staff! ")
+        handler.combat_msg("|445%s|n" % endmessage)
+        handler.stop()
+        self.caller.msg("Fight #%i has been ended." % fight_id)
+
+class CmdMetrics(MuxCommand):
+    """
+    Show server metrics.
+
+    Usage:
+    @metrics
+
+    Shows the counters, gauges and timings the game keeps
+    on its own systems, like the background writer's queue
+    depth and how long its writes take. They start over
+    whenever the server restarts or reloads.
+    """
+
+    key = "@metrics"
+    locks = "cmd:perm(Builders)"
+    help_category = "admin"
+
+    def func(self):
+        "Performs the command."
+        lines = metrics.report()
+        if not lines:
+            self.caller.msg("Nothing has been measured yet.")
+            return
+        self.caller.msg("\n".join(["|445%s|n" % '{:-^80}'.format(" Metrics ")] + lines))
+
+class CmdRerank(MuxCommand):
+    """
+    Rebuild every rating from the match history.
+
+    Usage:
+    @rerank
+
+    Throws out every rating and replays every finished
+    fight, oldest first, to work them out again. Use this
+    after changing the rating settings, or if the ratings
+    and the match history have come apart.
+    """
+
+    key = "@rerank"
+    locks = "cmd:perm(Builders)"
+    help_category = "admin"
+
+    def func(self):
+        "Performs the command."
+        replayed = ratings.rebuild_ratings()
+        self.caller.msg("Ratings rebuilt from %i fights. %i fighters are on the leaderboard." % (replayed, ratings.board_size()))
+
+class CmdTournament(MuxCommand):
+    """
+    See how a tournament is going.
+
+    Usage:
+    tournament [id]
+
+    Shows the standings of a tournament - yours if you're
+    in one, or the one with the given id. With no id and
+    no tournament of your own, lists every tournament
+    going on. Your matches start on their own, as soon as
+    you have an opponent and there's an arena free.
+    """
+
+    key = "tournament"
+    aliases = ["tournaments"]
+    help_category = "combat"
+
+    def func(self):
+        "Performs the command."
+        if self.args:
+            tournament_id = self.args.lstrip("#")
+            tournament = tournaments.get_tournament(int(tournament_id)) if tournament_id.isdigit() else None
+            if not tournament:
+                self.caller.msg("There's no tournament #%s going on." % tournament_id)
+                return
+        else:
+            tournament = tournaments.entrant_tournament(self.caller)
+        if not tournament:
+            tournamentlist = tournaments.all_tournaments()
+            if not tournamentlist:
+                self.caller.msg("There are no tournaments going on.")
+                return
+            lines = ["|445%s|n" % '{:-^80}'.format(" %i tournaments going on " % len(tournamentlist))]
+            for tournament in tournamentlist:
+                state = tournament.ndb.state
+                lines.append("|455#%i|n %s, %i entrants, %i matches going on" % (tournament.id, tournament.format_name(), len(state["players"]), len(state["matches"])))
+            self.caller.msg("\n".join(lines))
+            return
+        header = '{:-^80}'.format(" Tournament #%i: %s " % (tournament.id, tournament.format_name()))
+        self.caller.msg("\n".join(["|445%s|n" % header] + brackets.standings_lines(tournament.ndb.state)))
+
+class CmdQueue(MuxCommand):
+    """
+    Queue for a quick duel.
+
+    Usage:
+    queue[/switches]
+
+    Switches:
+    leave - Leave the queue.
+
+    Puts you in line for a one-on-one fight against someone
+    with a similar rating and similar stats. The longer you
+    wait, the wider the range of ratings you'll be matched
+    against. When a match is found, you're both healed and
+    taken to an arena to fight. Use 'queue' again to see
+    how long you've been waiting.
+    """
+
+    key = "queue"
+    aliases = ["matchmaking"]
+    help_category = "combat"
+
+    def func(self):
+        "Performs the command."
+        if "leave" in self.switches:
+            if matchmaking.leave_queue(self.caller.id):
+                self.caller.msg("You leave the queue.")
+            else:
+                self.caller.msg("You're not in the queue.")
+            return
+        if matchmaking.is_matched(self.caller):
+            self.caller.msg("You've been matched, and your fight will start as soon as there's an arena free. Use 'queue/leave' to call it off.")
+            return
+        if matchmaking.is_queued(self.caller):
+            waited, window, queued = matchmaking.queue_status(self.caller)
+            self.caller.msg("You've been in the queue for %i seconds, with %i fighters waiting. You'll take opponents within %i rating of you. Use 'queue/leave' to stop waiting." % (waited, queued, window))
+            return
+        reason = matchmaking.can_queue(self.caller)
+        if reason:
+            self.caller.msg(reason)
+            return
+        self.caller.msg("You join the queue for a duel. Use 'queue/leave' to stop waiting.")
+        matchmaking.join_queue(self.caller)
+
+class CmdStartTournament(MuxCommand):
+    """
+    Start a tournament.
+
+    Usage:
+    @tournament[/switches] <character>, <character>, ... [= <rounds>]
+
+    Switches:
+    double - Double elimination - two losses and you're out.
+    swiss - Everyone plays a set number of rounds, and the
+            best score wins. Give the number of rounds after
+            an equals sign, or leave it out for just enough
+            rounds to find a clear winner.
+
+    Examples:
+    > @tournament Protagonist, Antagonist, Deuteragonist
+    > @tournament/swiss Protagonist, Antagonist, Deuteragonist = 2
+
+    Without a switch, it's single elimination. Entrants are
+    seeded by rating. Matches are fought in arenas from the
+    arena pool (see '@arenas'), and start on their own as
+    entrants become due to fight.
+    """
+
+    key = "@tournament"
+    locks = "cmd:perm(Builders)"
+    help_category = "admin"
+
+    def func(self):
+        "Performs the command."
+        tournament_format = "single"
+        if "double" in self.switches:
+            tournament_format = "double"
+        elif "swiss" in self.switches:
+            tournament_format = "swiss"
+        names = [name.strip() for name in (self.lhs or "").split(",") if name.strip()]
+        if len(names) < 2:
+            self.caller.msg("Usage: @tournament[/double or /swiss] <character>, <character>, ... [= <rounds>]")
+            return
+        if len(names) > tournaments.TOURNAMENT_MAX_ENTRANTS:
+            self.caller.msg("A tournament can't have more than %i entrants." % tournaments.TOURNAMENT_MAX_ENTRANTS)
+            return
+        entrants = []
+        for name in names:
+            entrant = self.caller.search(name, global_search=True)
+            if not entrant:
+                return
+            if not rules.is_fighter(entrant):
+                self.caller.msg("%s can't fight!" % entrant)
+                return
+            if not entrant.has_player:
+                self.caller.msg("%s isn't connected." % entrant)
+                return
+            if tournaments.entrant_tournament(entrant):
+                self.caller.msg("%s is already in a tournament." % entrant)
+                return
+            if entrant not in entrants:
+                entrants.append(entrant)
+        if len(entrants) < 2:
+            self.caller.msg("A tournament needs at least two different entrants.")
+            return
+        rounds = 0
+        if tournament_format == "swiss":
+            if self.rhs and (not self.rhs.isdigit() or int(self.rhs) < 1):
+                self.caller.msg("The number of rounds has to be a whole number.")
+                return
+            rounds = int(self.rhs) if self.rhs else int(math.ceil(math.log(len(entrants), 2)))
+        if not arenas.free_count():
+            self.caller.msg("|413There are no free arenas, so matches will wait until one is free.|n")
+        # The best rated get the best seeds.
+        entrants.sort(key=lambda entrant: -ratings.rating(entrant.id))
+        tournament = create_script("scripts.Tournament")
+        tournament.begin(tournament_format, entrants, rounds)
+        self.caller.msg("Tournament #%i has begun." % tournament.id)
+
+class CmdEndTournament(MuxCommand):
+    """
+    Stop a tournament.
+
+    Usage:
+    @endtournament <id>
+
+    Ends a tournament right away. Any of its matches still
+    going on are stopped, and nobody wins.
+    """
+
+    key = "@endtournament"
+    locks = "cmd:perm(Builders)"
+    help_category = "admin"
+
+    def func(self):
+        "Performs the command."
+        tournament_id = self.args.lstrip("#")
+        if not tournament_id.isdigit():
+            self.caller.msg("Usage: @endtournament <tournament id>")
+            return
+        tournament = tournaments.get_tournament(int(tournament_id))
+        if not tournament:
+            self.caller.msg("There's no tournament #%s going on." % tournament_id)
+            return
+        tournament.announce("|413Tournament #%s has been stopped by staff.|n" % tournament_id)
+        tournament.stop()
+        self.caller.msg("Tournament #%s has been ended." % tournament_id)
+
+class CmdArenas(MuxCommand):
+    """
+    Show or add to the arena pool.
+
+    Usage:
+    @arenas[/switches] [<count> [= <size>]]
+
+    Switches:
+    create - Make more arenas, of the given size or the
+             default size.
+
+    Examples:
+    > @arenas
+    > @arenas/create 4 = 8
+
+    Arenas are rooms kept aside for tournament matches and
+    matchmaking duels, reset and reused after every fight.
+    Shows how many there are of each size, and how many
+    are free.
+    """
+
+    key = "@arenas"
+    locks = "cmd:perm(Builders)"
+    help_category = "admin"
+
+    def func(self):
+        "Performs the command."
+        if "create" in self.switches:
+            size = arenas.ARENA_DEFAULT_SIZE
+            if not self.lhs.isdigit() or (self.rhs and not self.rhs.isdigit()):
+                self.caller.msg("Usage: @arenas/create <count> [= <size>]")
+                return
+            if self.rhs:
+                size = int(self.rhs)
+            if size > 10:
+                self.caller.msg("Arena size has to be between 0 and 10.")
+                return
+            rooms = arenas.create_arenas(int(self.lhs), size)
+            self.caller.msg("Made %i arenas of size %i (%s)." % (len(rooms), size, rules.size_name(size)))
+            return
+        sizes = arenas.pool_sizes()
+        if not sizes:
+            self.caller.msg("There are no arenas. Use '@arenas/create <count>' to make some.")
+            return
+        lines = ["|445%s|n" % '{:-^80}'.format(" Arenas ")]
+        for size, free, total in sizes:
+            lines.append("Size %i (%s): %i of %i free" % (size, rules.size_name(size), free, total))
+        self.caller.msg("\n".join(lines))
+
+class CmdDeclare(MuxCommand):
+    """
+    Declare your actions for the round in a phase mode fight.
+
+    Usage:
+    declare[/switches] <command>
+
+    Switches:
+    clear - Take back everything you've declared this round.
+    defend - Defend against attacks. (default)
+    endure - Endure attacks instead of defending.
+
+    Examples:
+    > declare approach Antagonist
+    > declare attack Antagonist
+    You declare: approach Antagonist, attack Antagonist
+
+    > declare/endure
+    You'll endure attacks made against you.
+
+    In a phase mode fight (started with 'fight/phase'), everyone
+    declares their actions at the same time, and they're carried
+    out in initiative order once everyone has declared or time
+    runs out. Declare each command you want to use, in order,
+    just as you'd type it on your turn - attack, second,
+    special, approach, withdraw, dash, charge, pass or
+    disengage. Attacks made against
+    you are answered right away with the stance you declared.
+    If you don't declare anything, you disengage.
+    """
+
+    key = "declare"
+    aliases = ["dec"]
+    help_category = "combat"
+
+    def func(self):
+        "Performs the command."
+        cmd_check = rules.cmd_check(self.caller, self.args, "declare actions", ['InCombat', 'HasHP'])
+        if cmd_check:
+            self.caller.msg(cmd_check)
+            return
+        turnhandler = self.caller.combat.TurnHandler
+        if not turnhandler.phase_mode:
+            self.caller.msg("|413You can only declare actions in a phase mode fight!|n")
+            return
+        if turnhandler.ndb.resolving:
+            self.caller.msg("|413The round is already being resolved!|n")
+            return
+        if "clear" in self.switches:
+            self.caller.combat.Declared = []
+            self.caller.msg("You take back everything you declared this round.")
+            return
+        if "defend" in self.switches or "endure" in self.switches:
+            if "endure" in self.switches:
+                self.caller.combat.Stance = "endure"
+                self.caller.msg("You'll endure attacks made against you.")
+                return
+            self.caller.combat.Stance = "defend"
+            self.caller.msg("You'll defend against attacks made against you.")
+            return
+        declared = list(self.caller.combat.Declared or [])
+        if self.args:
+            words = self.args.split(None, 1)
+            command = declarable_command(words[0])
+            if not command:
+                self.caller.msg("|413You can only declare combat actions: %s.|n" % ", ".join(declarable.key for declarable in DECLARABLE_COMMANDS))
+                return
+            if len(declared) >= 5:
+                self.caller.msg("|413You can't declare more than 5 commands in a round!|n")
+                return
+            declared.append([command.key, words[1] if len(words) > 1 else ""])
+            self.caller.combat.Declared = declared
+        if not declared:
+            self.caller.msg("You haven't declared anything this round.")
+            return
+        self.caller.msg("You declare: %s" % ", ".join(" ".join(word for word in action if word) for action in declared))
+
 class CmdPass(MuxCommand):
     """
     Passes on your turn.
@@ -976,12 +1719,12 @@ class CmdPass(MuxCommand):
             else:
                 replaced = self.args.replace("<self>", str(self.caller))
                 message = ("%s |222[Pass]|n" % replaced)
-        self.caller.location.msg_contents(message)
-        self.caller.db.Combat_LastAction = "pass"
-        self.caller.db.Combat_Actions = 0
-        self.caller.db.Combat_Moves = 0
-        if self.caller.db.Combat_Second:
-            del self.caller.db.Combat_Second
+        rules.room_msg(self.caller.location, message)
+        self.caller.combat.LastAction = "pass"
+        self.caller.combat.Actions = 0
+        self.caller.combat.Moves = 0
+        if self.caller.combat.Second:
+            del self.caller.combat.Second
 
 class CmdDisengage(MuxCommand):
     """
@@ -1008,12 +1751,12 @@ class CmdDisengage(MuxCommand):
             else:
                 replaced = self.args.replace("<self>", str(self.caller))
                 message = ("%s |222[Disengage]|n" % replaced)
-        self.caller.location.msg_contents(message)
-        self.caller.db.Combat_LastAction = "disengage"
-        self.caller.db.Combat_Actions = 0
-        self.caller.db.Combat_Moves = 0
-        if self.caller.db.Combat_Second:
-            del self.caller.db.Combat_Second
+        rules.room_msg(self.caller.location, message)
+        self.caller.combat.LastAction = "disengage"
+        self.caller.combat.Actions = 0
+        self.caller.combat.Moves = 0
+        if self.caller.combat.Second:
+            del self.caller.combat.Second
 
             
 
@@ -1062,7 +1805,7 @@ class CmdWithdraw(MuxCommand):
             self.caller.msg(cmd_check)
             return
         # If everything checks out, check to see if an argument is given.
-        distance = self.caller.db.Combat_Moves
+        distance = self.caller.combat.Moves
         if len(self.arglist) > 0:
             who = self.arglist[0] 
         if len(self.arglist) > 1:
@@ -1070,14 +1813,14 @@ class CmdWithdraw(MuxCommand):
             try: # Set distance to integer given or max movement if arg isn't integer
                 distance = max(1, int(distance)) 
             except (TypeError, ValueError):
-                distance = self.caller.db.Combat_Moves
+                distance = self.caller.combat.Moves
         target = self.caller.search(who)
         # Let's also make sure they aren't too far away.
-        if self.caller.db.Combat_Range[target] >= self.caller.location.db.RoomSize:
+        if self.caller.combat.Range[target] >= self.caller.location.db.RoomSize:
             self.caller.msg("You can't move away any farther!")
             return
         # Let's make sure they don't try to move farther than they can.
-        if distance > self.caller.db.Combat_Moves:
+        if distance > self.caller.combat.Moves:
             self.caller.msg("You don't have enough movement to move that many steps!")
             return
         # If everything checks out, queue the withdraw and spend the movement.
@@ -1130,7 +1873,7 @@ class CmdApproach(MuxCommand):
             self.caller.msg(cmd_check)
             return
         # If everything checks out, check to see if an argument is given.
-        distance = self.caller.db.Combat_Moves
+        distance = self.caller.combat.Moves
         if len(self.arglist) > 0:
             who = self.arglist[0] 
         if len(self.arglist) > 1:
@@ -1138,10 +1881,10 @@ class CmdApproach(MuxCommand):
             try:
                 distance = max(1, int(distance))
             except (TypeError, ValueError):
-                distance = self.caller.db.Combat_Moves
+                distance = self.caller.combat.Moves
         target = self.caller.search(who)
         # Let's make sure they don't try to move farther than they can.
-        if distance > self.caller.db.Combat_Moves:
+        if distance > self.caller.combat.Moves:
             self.caller.msg("You don't have enough movement to move that many steps!")
             return
         # Calls the multi-step function, which also takes care of spending the movement.
@@ -1184,17 +1927,17 @@ class CmdDash(MuxCommand):
             self.caller.msg(cmd_check)
             return
         # Check for immobilization.
-        if 'Immobilization' in self.caller.db.Combat_Conditions:
+        if 'Immobilization' in self.caller.combat.Conditions:
             self.caller.msg("You're immobilized! You can't move!")
             return
         if not self.args:
             message = ("%s dashes for extra movement!" % self.caller)
         else:
             message = ("%s %s" % (self.caller, self.args))
-        self.caller.db.Combat_Actions -= 1
-        self.caller.db.Combat_LastAction = "dash"
-        self.caller.db.Combat_Moves += int(math.ceil(float(self.caller.db.MOB) / 2))
-        self.caller.location.msg_contents("%s |552[|554+%i|552 Movement]|n" % (message, int(math.ceil(float(self.caller.db.MOB) / 2))))
+        self.caller.combat.Actions -= 1
+        self.caller.combat.LastAction = "dash"
+        self.caller.combat.Moves += int(math.ceil(float(self.caller.sheet.MOB) / 2))
+        rules.room_msg(self.caller.location, "%s |552[|554+%i|552 Movement]|n" % (message, int(math.ceil(float(self.caller.sheet.MOB) / 2))))
         
 class CmdCharge(MuxCommand):
     """
@@ -1213,8 +1956,8 @@ class CmdCharge(MuxCommand):
         if cmd_check:
             self.caller.msg(cmd_check)
             return
-        if not self.caller.db.Combat_Charged:
-            self.caller.db.Combat_Charged = []
+        if not self.caller.combat.Charged:
+            self.caller.combat.Charged = []
         if len(self.arglist) == 0:
             self.caller.msg("|413You need to specify a special move name!")
             return
@@ -1230,7 +1973,7 @@ class CmdCharge(MuxCommand):
             if "Charge Move" not in self.caller.db.Special_Moves[matchedspecial][1]:
                 self.caller.msg("|413You don't need to charge that move!")
                 return
-            if matchedspecial in self.caller.db.Combat_Charged:
+            if matchedspecial in self.caller.combat.Charged:
                 self.caller.msg("|413That move is already charged!")
                 return
         if len(self.arglist) > 1:
@@ -1240,10 +1983,10 @@ class CmdCharge(MuxCommand):
                 message = "<self> " + message
             message = message.replace("<self>", str(self.caller))
         # If everything checks out, add the special to the charged list.
-        self.caller.db.Combat_Charged.append(matchedspecial)
-        self.caller.db.Combat_Actions -= 1
-        self.caller.db.Combat_LastAction = "charge"
-        self.caller.location.msg_contents("%s |255[Charge: |455%s|255]|n" % (message, matchedspecial))
+        self.caller.combat.Charged.append(matchedspecial)
+        self.caller.combat.Actions -= 1
+        self.caller.combat.LastAction = "charge"
+        rules.room_msg(self.caller.location, "%s |255[Charge: |455%s|255]|n" % (message, matchedspecial))
 
 class CmdRange(MuxCommand):
     """
@@ -1294,20 +2037,20 @@ class CmdRange(MuxCommand):
         """
         This performs the actual command.
         """
-        if not self.caller.db.Combat_TurnHandler:
+        if not self.caller.combat.TurnHandler:
             self.caller.msg("You can only use this command in combat!")
             return
         target = self.caller.search(self.args, quiet=True)
         if target:
             target = target[0]
-            targetrange = self.caller.db.Combat_Range[target]
+            targetrange = self.caller.combat.Range[target]
             self.caller.msg("|525%s: |545%i|525 steps away (%s)" % (target, targetrange, rules.range_name(targetrange)))
             return
         else:
-            rangelist = self.caller.db.Combat_Range
+            rangelist = self.caller.combat.Range
             accountedfor = []
             for key in rangelist:
-                targetrange = self.caller.db.Combat_Range[key]
+                targetrange = self.caller.combat.Range[key]
                 if key != self.caller and key not in accountedfor:
                     engage_group = rules.get_engage_group(key)
                     if self.caller in engage_group:
@@ -1380,6 +2123,7 @@ class CmdSpecial(MuxCommand):
     key = "special"
     aliases = ["spe", "sp"]
     help_category = "combat"
+    atomic = True
     
     def func(self):
         # If no arguments, list the special moves.
@@ -1388,7 +2132,7 @@ class CmdSpecial(MuxCommand):
                 self.caller.msg(rules.pretty_special(self.caller, special) + "\n\n")
             return
         # If already used a special this turn (after gaining a bonus action), return.
-        if self.caller.db.Combat_UsedSpecial:
+        if self.caller.combat.UsedSpecial:
             self.caller.msg("You already used a special move this turn!")
             return
         # First, let's try to match the first argument to a special move name.
@@ -1404,27 +2148,33 @@ class CmdSpecial(MuxCommand):
                 special_message = "default"
                 # If there's a 'Desperation Move' or 'Vital Move' effect, check the user's HP first.
                 if "Desperation Move" in self.caller.db.Special_Moves[specialname][1]:
-                    if self.caller.db.HP > self.caller.db.VIT:
+                    if self.caller.db.HP > self.caller.sheet.VIT:
                         self.caller.msg("|413You have too much HP to use %s!" % specialname)
                         return
                 if "Vital Move" in self.caller.db.Special_Moves[specialname][1]:
-                    if self.caller.db.HP < self.caller.db.VIT * 2:
+                    if self.caller.db.HP < self.caller.sheet.VIT * 2:
                         self.caller.msg("|413You don't have enough HP to use %s!" % specialname)
                         return
                 # If there's a 'Charge Move' effect, check to see if it's charged.
                 if "Charge Move" in self.caller.db.Special_Moves[specialname][1]:
-                    if not self.caller.db.Combat_Charged or specialname not in self.caller.db.Combat_Charged:
+                    if not self.caller.combat.Charged or specialname not in self.caller.combat.Charged:
                         self.caller.msg("|413You need to spend an action to charge this move first! Use the 'charge' command!|n")
                         return
                     # Remove the special from the charged list.
-                    if specialname in self.caller.db.Combat_Charged:
-                        self.caller.db.Combat_Charged.remove(specialname)
+                    if specialname in self.caller.combat.Charged:
+                        self.caller.combat.Charged.remove(specialname)
                 # If there's an 'Opening Gambit' effect, check to see if the last action was null.
-                if "Opening Gambit" in self.caller.db.Special_Moves[specialname][1] and self.caller.db.Combat_LastAction != "null":
+                if "Opening Gambit" in self.caller.db.Special_Moves[specialname][1] and self.caller.combat.LastAction != "null":
                     self.caller.msg("|413You can only use %s on your first turn in combat!|n" % specialname)
                     return
                 # If the special type is a Special Melee Attack:
                 if self.caller.db.Special_Moves[specialname][0] == "Special Melee Attack":
+                    # Area attacks pick their own targets, so everything after the name is the message.
+                    if rules.is_area_special(self.caller.db.Special_Moves[specialname][1]):
+                        if len(self.arglist) > 1:
+                            special_message = self.args.split(None, 1)[1]
+                        self.area_attack(self.caller, matched, self.caller.db.Special_Moves[specialname][1], special_message, "melee")
+                        return
                     if len(self.arglist) < 2:
                         self.caller.msg("|413You need to specify a target!")
                         return
@@ -1434,6 +2184,11 @@ class CmdSpecial(MuxCommand):
                     self.special_attack(self.caller, matched, self.caller.db.Special_Moves[specialname][1], self.arglist[1], special_message, "melee")
                 # If the special type is a Special Ranged Attack:
                 if self.caller.db.Special_Moves[specialname][0] == "Special Ranged Attack":
+                    if rules.is_area_special(self.caller.db.Special_Moves[specialname][1]):
+                        if len(self.arglist) > 1:
+                            special_message = self.args.split(None, 1)[1]
+                        self.area_attack(self.caller, matched, self.caller.db.Special_Moves[specialname][1], special_message, "ranged")
+                        return
                     if len(self.arglist) < 2:
                         self.caller.msg("|413You need to specify a target!")
                         return
@@ -1473,17 +2228,25 @@ class CmdSpecial(MuxCommand):
                     self.special_defense(self.caller, matched, self.caller.db.Special_Moves[specialname][1], special_message)
                 return
         self.caller.msg("|413You don't have that special move!")
-    def special_attack(self, user, name, effects, target, special_message, attack_type):
-        # Check for pre-set special messages if none was given via the command:
+    def pick_message(self, user, name, special_message, default):
+        """
+        Returns the message for a special move. If none was given with the
+        command, one of the move's pre-set messages is picked, or the default
+        if it has none. The message always starts with <self> if it
+        doesn't include it.
+        """
         if special_message == "default":
+            special_message = default
             try:
-                special_message = "<self> uses a special attack on <target>!"
                 if len(user.db.Special_Messages[name]) > 0:
                     special_message = user.db.Special_Messages[name][randint(0, len(user.db.Special_Messages[name]) - 1)]
             except (KeyError, TypeError):
-                special_message = "<self> uses a special attack on <target>!"
+                pass
         if "<self>" not in special_message:
             special_message = "<self> " + special_message
+        return special_message
+    def special_attack(self, user, name, effects, target, special_message, attack_type):
+        special_message = self.pick_message(user, name, special_message, "<self> uses a special attack on <target>!")
         # If the special move type is "Special Attack", run this code!
         
         cmd_check = rules.cmd_check(user, target, "special attack", ['InCombat', 'IsTurn', 'HasHP',
@@ -1501,7 +2264,7 @@ class CmdSpecial(MuxCommand):
             return
         
         # If everything checks out, spend the SP, queue the special attack and spend the action.
-        user.db.SP -= rules.special_cost(effects)
+        rules.spend_special(user, effects)
         target = user.search(target, quiet=True)[0]
         message = "|255[Special: |455%s|255 (|455%i|255 SP)]|n %s" % (name, rules.special_cost(effects), special_message)
         # If there's a lunge attack effect, move the user forward two spaces.
@@ -1518,19 +2281,36 @@ class CmdSpecial(MuxCommand):
         # Handle drawback conditions here.
         rules.special_drawback(user, user, effects)
 
-        user.db.Combat_LastAction = "special"
-        user.db.Combat_Actions -= 1
+        user.combat.LastAction = "special"
+        user.combat.Actions -= 1
+    def area_attack(self, user, name, effects, special_message, attack_type):
+        special_message = self.pick_message(user, name, special_message, "<self> uses a special attack on <target>!")
+        # If the special move is an area attack, run this code!
+        cmd_check = rules.cmd_check(user, "", "special attack", ['InCombat', 'IsTurn', 'HasHP',
+                                                                   'HasAction', 'AttacksResolved'])
+        if cmd_check:
+            self.caller.msg(cmd_check)
+            return
+        # The same rules as any attack of its type - whether the user can make one at all, then who's at a range it can hit.
+        type_check = rules.attacker_type_check(user, attack_type, effects)
+        if type_check:
+            self.caller.msg(type_check)
+            return
+        targets = [target for target in rules.area_targets(user, effects)
+                   if not rules.target_type_check(user, target, attack_type, effects)]
+        if not targets:
+            self.caller.msg("|413There are no enemies in reach of %s!|n" % name)
+            return
+        # If everything checks out, spend the SP, queue the attack on every target and spend the action.
+        rules.spend_special(user, effects)
+        message = "|255[Special: |455%s|255 (|455%i|255 SP)]|n %s" % (name, rules.special_cost(effects), special_message)
+        rules.queue_area_attack(user, targets, message, effects, attack_type)
+        # Handle drawback conditions here.
+        rules.special_drawback(user, user, effects)
+        user.combat.LastAction = "special"
+        user.combat.Actions -= 1
     def support_self(self, user, name, effects, special_message):
-        # Check for pre-set special messages if none was given via the command:
-        if special_message == "default":
-            try:
-                special_message = "<self> uses a special move!"
-                if len(user.db.Special_Messages[name]) > 0:
-                    special_message = user.db.Special_Messages[name][randint(0, len(user.db.Special_Messages[name]) - 1)]
-            except (KeyError, TypeError):
-                special_message = "<self> uses a special move!"
-        if "<self>" not in special_message:
-            special_message = "<self> " + special_message
+        special_message = self.pick_message(user, name, special_message, "<self> uses a special move!")
         # If the special move type is "Support Self", run this code!
         cmd_check = rules.cmd_check(user, "", "use a special move", ['InCombat', 'IsTurn', 'HasHP',
                                                                        'HasAction', 'AttacksResolved'])
@@ -1538,33 +2318,24 @@ class CmdSpecial(MuxCommand):
             self.caller.msg(cmd_check)
             return
         # If everything checks out, spend the SP, queue the special move and spend the action.
-        user.db.SP -= rules.special_cost(effects)
+        rules.spend_special(user, effects)
         special_message = special_message.replace("<self>", str(user))
         message = "|255[Special: |455%s|255 (|455%i|255 SP)]|n %s" % (name, rules.special_cost(effects), special_message)
         if effects:
             effectstring = utils.list_to_string(effects, endsep="|255and|455", addquote=False)
             message += " |255[|455%s|255]|n" % effectstring
-        self.caller.location.msg_contents(message)
+        rules.room_msg(self.caller.location, message)
         rules.special_support(user, user, effects)
-        self.caller.db.Combat_LastAction = "special"
-        self.caller.db.Combat_Actions -= 1
+        self.caller.combat.LastAction = "special"
+        self.caller.combat.Actions -= 1
         # Handle drawback conditions here.
         rules.special_drawback(user, user, effects)
         # If there's a bonus action, give the user's action back.
         if 'Bonus Action' in effects:
-            self.caller.db.Combat_Actions += 1
-            self.caller.db.Combat_UsedSpecial = True
+            self.caller.combat.Actions += 1
+            self.caller.combat.UsedSpecial = True
     def support_other(self, user, name, effects, target, special_message):
-        # Check for pre-set special messages if none was given via the command:
-        if special_message == "default":
-            try:
-                special_message = "<self> uses a special move on <target>!"
-                if len(user.db.Special_Messages[name]) > 0:
-                    special_message = user.db.Special_Messages[name][randint(0, len(user.db.Special_Messages[name]) - 1)]
-            except (KeyError, TypeError):
-                special_message = "<self> uses a special move on <target>!"
-        if "<self>" not in special_message:
-            special_message = "<self> " + special_message
+        special_message = self.pick_message(user, name, special_message, "<self> uses a special move on <target>!")
         # If the special move type is "Support Other", run this code!
             
         cmd_check = rules.cmd_check(user, target, "special support", ['InCombat', 'IsTurn', 'HasHP',
@@ -1578,11 +2349,11 @@ class CmdSpecial(MuxCommand):
         target = user.search(target, quiet=True)[0]
         # If there's 'Touch Effect', it can only be used on engaged targets.
         if "Touch Effect" in effects:
-            if user.db.Combat_Range[target] != 0:
+            if user.combat.Range[target] != 0:
                 user.msg("|413You can only use this special move on engaged targets (at range 0)!|n")
                 return
         # If everything checks out, spend the SP, queue the special move and spend the action.
-        user.db.SP -= rules.special_cost(effects)
+        rules.spend_special(user, effects)
         
         special_message = special_message.replace("<self>", str(user))
         special_message = special_message.replace("<target>", str(target))
@@ -1590,27 +2361,18 @@ class CmdSpecial(MuxCommand):
         if effects:
             effectstring = utils.list_to_string(effects, endsep="|255and|455", addquote=False)
             message += " |255[|455%s|255]|n" % effectstring
-        self.caller.location.msg_contents(message)
+        rules.room_msg(self.caller.location, message)
         rules.special_support(target, self.caller, effects)
-        self.caller.db.Combat_LastAction = "special"
-        self.caller.db.Combat_Actions -= 1
+        self.caller.combat.LastAction = "special"
+        self.caller.combat.Actions -= 1
         # Handle drawback conditions here.
         rules.special_drawback(user, user, effects)
         # If there's a bonus action, give the user's action back.
         if 'Bonus Action' in effects:
-            self.caller.db.Combat_Actions += 1
-            self.caller.db.Combat_UsedSpecial = True
+            self.caller.combat.Actions += 1
+            self.caller.combat.UsedSpecial = True
     def hinder_other(self, user, name, effects, target, special_message):
-        # Check for pre-set special messages if none was given via the command:
-        if special_message == "default":
-            try:
-                special_message = "<self> uses a special move on <target>!"
-                if len(user.db.Special_Messages[name]) > 0:
-                    special_message = user.db.Special_Messages[name][randint(0, len(user.db.Special_Messages[name]) - 1)]
-            except (KeyError, TypeError):
-                special_message = "<self> uses a special move on <target>!"
-        if "<self>" not in special_message:
-            special_message = "<self> " + special_message
+        special_message = self.pick_message(user, name, special_message, "<self> uses a special move on <target>!")
         # If the special move type is "Hinder Other", run this code!
             
         cmd_check = rules.cmd_check(user, target, "special support", ['InCombat', 'IsTurn', 'HasHP',
@@ -1624,42 +2386,34 @@ class CmdSpecial(MuxCommand):
         target = user.search(target, quiet=True)[0]
         # If there's 'Touch Effect', it can only be used on engaged targets.
         if "Touch Effect" in effects:
-            if user.db.Combat_Range[target] != 0:
+            if user.combat.Range[target] != 0:
                 user.msg("|413You can only use this special move on engaged targets (at range 0)!|n")
                 return
         # If everything checks out, spend the SP, queue the special move and spend the action.
-        user.db.SP -= rules.special_cost(effects)
+        rules.spend_special(user, effects)
         special_message = special_message.replace("<self>", str(user))
         special_message = special_message.replace("<target>", str(target))
         message = "|255[Special: |455%s|255 (|455%i|255 SP)]|n %s" % (name, rules.special_cost(effects), special_message)
         if effects:
             effectstring = utils.list_to_string(effects, endsep="|255and|455", addquote=False)
             message += " |255[|455%s|255]|n" % effectstring
-        self.caller.location.msg_contents(message)
+        rules.room_msg(self.caller.location, message)
         rules.special_hinder(target, self.caller, effects)
-        self.caller.db.Combat_LastAction = "special"
-        self.caller.db.Combat_Actions -= 1
+        self.caller.combat.LastAction = "special"
+        self.caller.combat.Actions -= 1
         # Handle drawback conditions here.
         rules.special_drawback(user, user, effects)
         # If there's a bonus action, give the user's action back.
         if 'Bonus Action' in effects:
-            self.caller.db.Combat_Actions += 1
-            self.caller.db.Combat_UsedSpecial = True
+            self.caller.combat.Actions += 1
+            self.caller.combat.UsedSpecial = True
     def special_defense(self, user, name, effects, special_message):
-        if not user.db.Combat_IncomingAttack:
+        if not user.combat.IncomingAttack:
             # No incoming attacks.
             user.msg("|413There are no incoming attacks!")
             return
-        attack_type = user.db.Combat_IncomingAttack[3]
-        if special_message == "default":
-            try:
-                special_message = "<self> uses a special move!"
-                if len(user.db.Special_Messages[name]) > 0:
-                    special_message = user.db.Special_Messages[name][randint(0, len(user.db.Special_Messages[name]) - 1)]
-            except (KeyError, TypeError):
-                special_message = "<self> uses a special move!"
-        if "<self>" not in special_message:
-            special_message = "<self> " + special_message
+        attack_type = user.combat.IncomingAttack[3]
+        special_message = self.pick_message(user, name, special_message, "<self> uses a special move!")
        
        # If the special move type is "Special Defense", run this code!
         #Test for melee-only and ranged-only defense
@@ -1674,24 +2428,24 @@ class CmdSpecial(MuxCommand):
         if "Counterattack" in effects:
             # Attack type is ranged if target is farther than range 0, or melee if target is at range 0
             counterattack_type = "ranged"
-            if user.db.Combat_Range[user.db.Combat_IncomingAttack[1]] == 0:
+            if user.combat.Range[user.combat.IncomingAttack[1]] == 0:
                 counterattack_type = "melee"
             # Check the attack type versus the target and give an error message if needed.
-            type_check = rules.attack_type_check(user, user.db.Combat_IncomingAttack[1], counterattack_type, [])
+            type_check = rules.attack_type_check(user, user.combat.IncomingAttack[1], counterattack_type, [])
             if type_check:
                 user.msg(type_check)
                 return
             
         # If everything checks out, spend the SP and execute the special defense.
-        user.db.SP -= rules.special_cost(effects)
+        rules.spend_special(user, effects)
         special_message = special_message.replace("<self>", str(user))
         message = "|255[Special: |455%s|255 (|455%i|255 SP)]|n %s" % (name, rules.special_cost(effects), special_message)
         effectstring = utils.list_to_string(effects, endsep="|255and|455", addquote=False)
         message += " |255[|455%s|255]|n" % effectstring
-        self.caller.location.msg_contents(message)
+        rules.room_msg(self.caller.location, message)
         rules.defend_queue(user, "defend", effects)
         # Handle drawback conditions here. Target is given as the character whose turn it is in combat.
-        rules.special_drawback(user.db.Combat_TurnHandler.db.fighters[user.db.Combat_TurnHandler.db.turn], user, effects)
+        rules.special_drawback(user.combat.TurnHandler.fighters[user.combat.TurnHandler.db.turn], user, effects)
             
 class CmdRemoveSpecial(MuxCommand):
     """
@@ -1766,7 +2520,7 @@ class CmdEnterGame(MuxCommand):
     def func(self):
         "Checks everything first!"
         char = self.caller
-        statstotal = char.db.ATM + char.db.DEF + char.db.VIT + char.db.ATR + char.db.MOB + char.db.SPE
+        statstotal = sum(char.sheet.stats())
         # Check for stats are too high.
         if statstotal > 36:
             char.msg("Your stats are %i points too high. You need to set some of your stats lower to enter the game." % (statstotal - 36))
@@ -1800,7 +2554,42 @@ class CmdEnterGame(MuxCommand):
                 char.msg("You can still enter the game by typing 'enter game anyway', but your character will be weaker than others. You've been warned!")
                 return
         # If it's all good, enter the grid!
+        centralhub = landmarks.get_landmark("central_hub")
+        if not centralhub:
+            char.msg("|413Could not find the Central Hub! Let the staff know.|n")
+            return
         char.msg("Welcome to the World of Cool Battles!")
-        char.location = char.search("The Institute of Battle's Central Hub", global_search=True)
+        char.move_directly(centralhub)
         char.execute_cmd("look")
-        
\ No newline at end of file
+        
+# The commands that can be declared in a phase mode fight.
+DECLARABLE_COMMANDS = (CmdAttack, CmdSecond, CmdSpecial, CmdApproach, CmdWithdraw, CmdDash, CmdCharge, CmdPass, CmdDisengage)
+
+def declarable_command(name):
+    "Returns the declarable command with the given key or alias, or None."
+    name = name.lower()
+    for command in DECLARABLE_COMMANDS:
+        if name == command.key or name in command.aliases:
+            return command
+    return None
+
+def run_declared(fighter, key, args):
+    """
+    Carries out an action a fighter declared in a phase mode fight. The
+    command's class is run directly rather than the action being typed in
+    for them, so only the commands above can ever be run this way.
+    """
+    command = declarable_command(key)()
+    command.caller = command.obj = fighter
+    command.cmdstring = command.cmdname = key
+    command.args = " " + args if args else ""
+    command.raw_string = key + command.args
+    command.session = None
+    try:
+        command.at_pre_cmd()
+        command.parse()
+        command.func()
+        command.at_post_cmd()
+    except Exception:
+        logger.log_trace()
+        fighter.msg("|413Something went wrong carrying out '%s'.|n" % command.raw_string)
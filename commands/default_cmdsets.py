@@ -58,6 +58,20 @@ class CharacterCmdSet(default_cmds.CharacterCmdSet):
         self.add(command.CmdAlly())
         self.add(slow_exit.CmdStop())
         self.add(command.CmdApproach())
+        self.add(command.CmdSpectate())
+        self.add(command.CmdHistory())
+        self.add(command.CmdRank())
+        self.add(command.CmdTournament())
+        self.add(command.CmdQueue())
+        self.add(command.CmdDeclare())
+        self.add(command.CmdFights())
+        self.add(command.CmdFightInfo())
+        self.add(command.CmdEndFight())
+        self.add(command.CmdMetrics())
+        self.add(command.CmdRerank())
+        self.add(command.CmdStartTournament())
+        self.add(command.CmdEndTournament())
+        self.add(command.CmdArenas())
 
 class PlayerCmdSet(default_cmds.PlayerCmdSet):
     """
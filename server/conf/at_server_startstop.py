@@ -15,6 +15,14 @@ at_server_cold_start()
 at_server_cold_stop()
 
 """
+from world import landmarks
+from world import fights
+from world import writer
+from world import ratings
+from world import arenas
+from world import tournaments
+from world import matchmaking
+from typeclasses import characters
 
 
 def at_server_start():
@@ -22,7 +30,16 @@ def at_server_start():
     This is called every time the server starts up, regardless of
     how it was shut down.
     """
-    pass
+    # Look up the landmark rooms so commands don't have to search for them.
+    landmarks.refresh_landmarks()
+    # Put every fight that was going on back the way it was at the end of its last turn.
+    fights.restore_fights()
+    # Load the ratings and build the leaderboard.
+    ratings.load_ratings()
+    # Find the arenas, then carry on with any tournaments that were going on, and hook up matchmaking.
+    arenas.load_arenas()
+    tournaments.start_tournaments()
+    matchmaking.start_matchmaking()
 
 
 def at_server_stop():
@@ -30,7 +47,8 @@ def at_server_stop():
     This is called just before the server is shut down, regardless
     of it is for a reload, reset or shutdown.
     """
-    pass
+    # Save anything still waiting on the background writer.
+    writer.flush_now()
 
 
 def at_server_reload_start():
@@ -52,7 +70,8 @@ def at_server_cold_start():
     This is called only when the server starts "cold", i.e. after a
     shutdown or a reset.
     """
-    pass
+    # Move any characters still on per-stat Attributes onto character sheets.
+    characters.migrate_sheets()
 
 
 def at_server_cold_stop():
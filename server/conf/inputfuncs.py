@@ -29,6 +29,27 @@ as argument.
 # import the contents of the default inputhandler_func module
 #from evennia.server.inputfuncs import *
 
+from world import rules
+
+
+def combat_state(session, *args, **kwargs):
+    """
+    Sends the full state of the fight the session's character is in:
+    every fighter's HP, SP, conditions and pending attack, the range
+    matrix and whose turn it is. Clients call this when they connect
+    or think they've missed a combat_delta, and otherwise just apply
+    the deltas.
+
+    Args:
+        session (Session): The Session asking for the state.
+
+    """
+    character = session.puppet
+    if not character or not rules.is_fighter(character):
+        session.msg(combat_state=((), {"fight":None}))
+        return
+    session.msg(combat_state=((), rules.combat_snapshot(character)))
+
 
 # def oob_echo(session, *args, **kwargs):
 #     """
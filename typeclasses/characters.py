@@ -7,7 +7,77 @@ is setup to be the "default" character type created by the default
 creation commands.
 
 """
-from evennia import DefaultCharacter
+from django.conf import settings
+from evennia import DefaultCharacter, ObjectDB
+from evennia.typeclasses.attributes import Attribute
+from evennia.utils import logger
+from evennia.utils.utils import lazy_property
+import math
+
+# The base stats, in the order they're stored on the character sheet.
+STAT_NAMES = ('ATM', 'DEF', 'VIT', 'ATR', 'MOB', 'SPE')
+# Bump this whenever the layout of the stored sheet record changes.
+SHEET_VERSION = 1
+# Set COMPACT_CHARACTER_SHEET = False in settings to keep one Attribute per stat instead.
+COMPACT_SHEET = getattr(settings, "COMPACT_CHARACTER_SHEET", True)
+
+class CharacterSheet(object):
+    """
+    A character's base stats. This is only ever kept in memory - on the
+    character it's stored as a single 'Sheet' Attribute holding a flat
+    list of the sheet version followed by each stat in STAT_NAMES order.
+    """
+    __slots__ = ('version',) + STAT_NAMES
+    def __init__(self, record=None):
+        if not record:
+            record = [SHEET_VERSION] + [6] * len(STAT_NAMES)
+        self.version = record[0]
+        for name, value in zip(STAT_NAMES, record[1:]):
+            setattr(self, name, value)
+    def stats(self):
+        "Returns the stats as a tuple, in STAT_NAMES order."
+        return tuple(getattr(self, name) for name in STAT_NAMES)
+    def to_record(self):
+        "Returns the flat list the sheet is stored as."
+        return [SHEET_VERSION] + list(self.stats())
+
+class CombatHandler(object):
+    """
+    Gives attribute-style access to a fighter's combat state, the same way
+    'ndb' does - character.combat.Range, or None for anything not set. It's
+    only kept in memory, since it changes constantly while a fight goes on.
+    The fight's TurnHandler saves all of it in one compact snapshot at the
+    end of every turn and puts it back after a reload (see world/fights.py).
+    Dicts and lists are copied as they're set, so two fighters never end up
+    sharing one.
+    """
+    def __init__(self, obj):
+        object.__setattr__(self, "obj", obj)
+    def __getattr__(self, key):
+        state = self.obj.ndb.combat_state
+        if not state:
+            return None
+        return state.get(key)
+    def __setattr__(self, key, value):
+        if isinstance(value, dict):
+            value = dict(value)
+        elif isinstance(value, list):
+            value = list(value)
+        state = self.obj.ndb.combat_state
+        if state is None:
+            state = {}
+            self.obj.ndb.combat_state = state
+        state[key] = value
+    def __delattr__(self, key):
+        state = self.obj.ndb.combat_state
+        if state:
+            state.pop(key, None)
+    def all(self):
+        "Returns the whole combat state as a dictionary."
+        return dict(self.obj.ndb.combat_state or {})
+    def clear(self):
+        "Forgets the whole combat state, once the fight is over."
+        self.obj.ndb.combat_state = None
 
 class Character(DefaultCharacter):
     """
@@ -29,10 +99,15 @@ class Character(DefaultCharacter):
     at_post_puppet - Echoes "PlayerName has entered the game" to the room.
 
     """
+    # Checked by rules.is_fighter - only characters have stats to fight with.
+    fighter = True
+    @lazy_property
+    def combat(self):
+        "Handler for the character's combat state - see CombatHandler."
+        return CombatHandler(self)
     def at_object_creation(self):
         "This is called when object is first created, only."
-        for stat in ('ATM', 'DEF', 'VIT', 'ATR', 'MOB', 'SPE'):
-            self.attributes.add(stat, 6)
+        self.save_sheet(CharacterSheet())
         self.db.HP = 18
         self.db.SP = 12
         self.db.Special_Moves = {}
@@ -40,8 +115,107 @@ class Character(DefaultCharacter):
         self.db.Melee_Messages = []
         self.db.Allies = []
         self.db.shortdesc = "A fighter!"
+    @property
+    def sheet(self):
+        "The character's base stats, loaded from the database once and kept in memory."
+        sheet = self.ndb.sheet
+        if sheet is None:
+            sheet = self.load_sheet()
+            self.ndb.sheet = sheet
+        return sheet
+    def load_sheet(self, remove_legacy=True):
+        "Reads the character sheet from the database, moving old per-stat Attributes onto it if needed. Without remove_legacy, the old rows are left for the caller to delete."
+        if COMPACT_SHEET:
+            record = self.attributes.get("Sheet")
+            if record:
+                return CharacterSheet(record)
+        # Get every per-stat Attribute in one pass over the (cached) Attribute list.
+        legacyattrs = [attr for attr in self.attributes.all() if attr.key in STAT_NAMES]
+        legacy = dict((attr.key, attr.value) for attr in legacyattrs)
+        missing = [name for name in STAT_NAMES if name not in legacy]
+        if missing:
+            logger.log_warn("Character %s (#%i) has no %s stat - set to 0 on their sheet." % (self.key, self.id, "/".join(missing)))
+        sheet = CharacterSheet([SHEET_VERSION] + [legacy.get(name, 0) for name in STAT_NAMES])
+        if COMPACT_SHEET:
+            # Characters made before the sheet existed - migrate them over and drop the old rows.
+            self.save_sheet(sheet)
+            if remove_legacy and legacyattrs:
+                Attribute.objects.filter(id__in=[attr.id for attr in legacyattrs]).delete()
+                self.attributes.reset_cache()
+        return sheet
+    def save_sheet(self, sheet):
+        "Stores the given character sheet and makes it the character's current one."
+        if COMPACT_SHEET:
+            self.attributes.add("Sheet", sheet.to_record())
+        else:
+            for name in STAT_NAMES:
+                self.attributes.add(name, getattr(sheet, name))
+        self.ndb.sheet = sheet
+        self.reset_derived_stats()
+    def set_stats(self, stats):
+        "Sets one or more base stats from a dictionary of stat names and values, then saves the sheet."
+        sheet = self.sheet
+        for name in stats:
+            setattr(sheet, name, stats[name])
+        self.save_sheet(sheet)
+    def derived_stats(self):
+        """
+        Returns the stats derived from the character's base stats: max HP,
+        max SP, moves per turn and the stat list checked by special move
+        requirements. They're worked out once and kept in memory until
+        reset_derived_stats() is called, which set_stats() does for you.
+        """
+        derived = self.ndb.derived_stats
+        if not derived:
+            stats = self.sheet.stats()
+            derived = {"MaxHP":max(stats[2] * 3, 1),
+                       "MaxSP":stats[5] * 2,
+                       "Moves":int(math.floor(stats[4] / 2)),
+                       "Stats":stats}
+            self.ndb.derived_stats = derived
+        return derived
+    def reset_derived_stats(self):
+        "Clears the derived stats so they're worked out again. Call this whenever a base stat changes."
+        self.ndb.derived_stats = None
+    def move_directly(self, destination):
+        """
+        Moves the character by setting their location directly. This skips
+        at_before_move, so defeated characters can still be sent off to
+        recover, but still calls the rooms' leave and receive hooks so
+        their fighter rosters and cached descriptions stay current.
+        """
+        source = self.location
+        if source:
+            source.at_object_leave(self, destination)
+        self.location = destination
+        if destination:
+            destination.at_object_receive(self, source)
+    def msg(self, text=None, *args, **kwargs):
+        """
+        Sends a message to the character. Combat messages the room is
+        holding back until the end of a command are sent first, so
+        anything sent straight to the character - an incoming attack, a
+        defeat - arrives after the room messages that led up to it.
+        """
+        location = self.location
+        if location and location.ndb.broadcast_buffer and hasattr(location, "flush_broadcast"):
+            location.flush_broadcast()
+        super(Character, self).msg(text, *args, **kwargs)
+    def at_pre_puppet(self, player, session=None):
+        "Lets the room know the character is back on the grid."
+        super(Character, self).at_pre_puppet(player, session=session)
+        # The default hook sets the location directly, which skips the room's receive hook.
+        if self.location:
+            self.location.at_object_receive(self, None)
+    def at_post_unpuppet(self, player, session=None):
+        "Lets the room know the character has been taken off the grid."
+        location = self.location
+        super(Character, self).at_post_unpuppet(player, session=session)
+        # As above, the default hook moves the character to a None-location without the leave hook.
+        if location and not self.location:
+            location.at_object_leave(self, None)
     def at_before_move(self, destination):
-        if self.db.Combat_TurnHandler:
+        if self.combat.TurnHandler:
             self.caller.msg("You can't exit a room while in combat!")
             return False
         if self.db.HP <= 0:
@@ -58,3 +232,28 @@ class Character(DefaultCharacter):
             self.msg("%s arrives at %s." % (self, self.location))
     pass
 
+
+def migrate_sheets():
+    """
+    Moves every character still on the old per-stat Attributes onto a
+    character sheet in one go, rather than leaving each to be moved the
+    first time its sheet is loaded. Called when the server starts cold.
+    Returns how many were moved.
+    """
+    if not COMPACT_SHEET:
+        return 0
+    characters = []
+    for obj in ObjectDB.objects.filter(db_attributes__db_key__in=STAT_NAMES).distinct():
+        if not isinstance(obj, Character):
+            # Only Characters have a sheet, so these no longer count as fighters - see rules.is_fighter().
+            logger.log_warn("%s (#%i, %s) has stat Attributes but isn't a Character, so it can't fight. Make it a Character to fix this." % (obj.key, obj.id, obj.typeclass_path))
+            continue
+        obj.ndb.sheet = obj.load_sheet(remove_legacy=False)
+        characters.append(obj)
+    if characters:
+        # Every old row goes in one statement, rather than one per stat per character.
+        Attribute.objects.filter(objectdb__in=characters, db_key__in=STAT_NAMES).delete()
+        for character in characters:
+            character.attributes.reset_cache()
+        logger.log_info("Moved %i characters onto character sheets." % len(characters))
+    return len(characters)
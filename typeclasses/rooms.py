@@ -24,6 +24,67 @@ class Room(DefaultRoom):
         # This is called only at creation.
         self.db.RoomSize = 5
         self.db.CombatAllowed = True
+    def at_object_receive(self, moved_obj, source_location):
+        "Called after an object arrives - adds fighters to the roster."
+        super(Room, self).at_object_receive(moved_obj, source_location)
+        self.update_fighter(moved_obj)
+        self.reset_appearance()
+    def at_object_leave(self, moved_obj, target_location):
+        "Called just before an object leaves - drops fighters from the roster."
+        super(Room, self).at_object_leave(moved_obj, target_location)
+        self.fighter_roster().discard(moved_obj)
+        self.reset_appearance()
+    def fighter_roster(self):
+        """
+        Returns the room's fighter roster: the set of fighters here. It's
+        built from the room's contents the first time it's needed, and after
+        that it's kept current by the move hooks instead of scanning the
+        contents again. It only says who's here - their HP and short
+        description are always read from them, so changing those any way
+        at all, even with @set, can't leave it out of date.
+        """
+        roster = self.ndb.fighter_roster
+        if roster is None:
+            roster = set()
+            self.ndb.fighter_roster = roster
+            for con in self.contents:
+                self.update_fighter(con)
+        return roster
+    def update_fighter(self, fighter):
+        "Adds an object to the roster if it's a fighter."
+        if rules.is_fighter(fighter):
+            self.fighter_roster().add(fighter)
+    def fighters_here(self):
+        "Returns every fighter in the room who hasn't been defeated."
+        roster = self.fighter_roster()
+        # Characters moved by setting their location directly skip the leave hook, so check they're still here.
+        return [fighter for fighter in roster if fighter.db.HP and fighter.location == self]
+    def flush_broadcast(self):
+        "Sends any combat messages being held back in the room. See Character.msg()."
+        rules.flush_broadcast(self)
+    def reset_appearance(self):
+        "Throws away the cached room description so it's rendered again on the next look."
+        self.ndb.appearance_cache = None
+    def cached_appearance(self):
+        """
+        Returns the parts of the room's description that are the same for
+        everyone - the area size readout and what's in the room. They're
+        kept until something arrives or leaves, or the room's desc or
+        RoomSize changes, so most looks don't go through the contents at
+        all. Names are rendered for each looker in return_appearance(),
+        since what they show can depend on who's looking and objects can
+        be renamed at any time.
+        """
+        desc = self.db.desc
+        roomsize = self.db.RoomSize
+        appearance = self.ndb.appearance_cache
+        if appearance and appearance["desc"] == desc and appearance["size"] == roomsize:
+            return appearance
+        contents = list(self.contents)
+        sizestring = "|525[Area size: |545%i|525 (%s)]|n" % (roomsize, rules.size_name(roomsize))
+        appearance = {"desc":desc, "size":roomsize, "sizestring":sizestring, "contents":contents}
+        self.ndb.appearance_cache = appearance
+        return appearance
     def return_appearance(self, looker):
         """
         This formats a description. It is the hook a 'look' command
@@ -34,11 +95,12 @@ class Room(DefaultRoom):
         """
         if not looker:
             return
-        # get and identify all objects
-        visible = (con for con in self.contents if con != looker and
-                                                    con.access(looker, "view"))
+        appearance = self.cached_appearance()
+        # Sort what's here for this looker, leaving out anything they can't see.
         exits, users, things = [], [], []
-        for con in visible:
+        for con in appearance["contents"]:
+            if con == looker or not con.access(looker, "view"):
+                continue
             key = con.get_display_name(looker)
             if con.destination:
                 exits.append("|lc" + str(con) + "|lt" + key + "|le")
@@ -48,15 +110,14 @@ class Room(DefaultRoom):
                 things.append(key)
         # get description, build string
         roomname = self.get_display_name(looker)
-        roomsize = "|525[Area size: |545%i|525 (%s)]|n" % (self.db.RoomSize, rules.size_name(self.db.RoomSize))
+        sizestring = appearance["sizestring"]
         namelength = len(roomname)
-        sizelength = len(roomsize) - 12
+        sizelength = len(sizestring) - 12
         paddinglength = 80 - namelength - sizelength
         padding = ('{:-^%i}' % paddinglength).format('')
-        string = "|555%s|n |222%s|n %s\n" % (roomname, padding, roomsize)
-        desc = self.db.desc
-        if desc:
-            string += "%s" % desc
+        string = "|555%s|n |222%s|n %s\n" % (roomname, padding, sizestring)
+        if appearance["desc"]:
+            string += "%s" % appearance["desc"]
         if exits:
             string += "\n\n{wExits:{n " + ", ".join(exits)
         if not users or things:
@@ -12,7 +12,8 @@ just overloads its hooks to have it perform its function.
 
 """
 
-from evennia import DefaultScript
+from evennia import DefaultScript, ObjectDB
+from evennia import utils
 from random import randint
 
 
@@ -92,10 +93,30 @@ class Script(DefaultScript):
     pass
 
 from world import rules
+from world import fights
+from world import writer
+from world import history
+from world import ratings
+from world import tournaments
+from world import brackets
+from world import arenas
+from world import metrics
 from random import randint
+from django.conf import settings
+from evennia.utils import logger
+from evennia.utils.dbserialize import to_pickle
+import time
+
+# How many seconds fighters get to declare their actions each round of a phase mode fight.
+PHASE_WINDOW = getattr(settings, "PHASE_DECLARE_WINDOW", 30)
 
 class DefenseTimeout(DefaultScript):
-    "Automatically makes a character defend after a 30 second delay."
+    """
+    Automatically makes a character defend after a 30 second delay.
+    No longer created - attacks carry their own deadline, which the
+    TurnHandler checks - but kept so any left over from before that
+    still load and finish.
+    """
     def at_script_creation(self):
         "Called once, during initial creation"
         self.key = ("%s_def_timeout" % self.obj)
@@ -106,12 +127,12 @@ class DefenseTimeout(DefaultScript):
         self.obj.msg("|530----- |540Incoming Attack! |530-----|n")
     def at_repeat(self):
         "Called every self.interval seconds"
-        if not self.obj.db.Combat_IncomingAttack:
+        if not self.obj.combat.IncomingAttack:
             self.stop()
             return
         self.db.TimeRemaining -= 1
         if self.db.TimeRemaining == 10:
-            self.obj.msg("|420Respond to %s's attack! Timing out soon!|n" % self.obj.db.Combat_IncomingAttack[1])
+            self.obj.msg("|420Respond to %s's attack! Timing out soon!|n" % self.obj.combat.IncomingAttack[1])
         elif self.db.TimeRemaining <= 0:
             self.obj.msg("|420Timed out - defending automatically|n")
             rules.defend_queue(self.obj, "defend", [])
@@ -119,133 +140,519 @@ class DefenseTimeout(DefaultScript):
 
 class TurnHandler(DefaultScript):
     "Created when a fight starts and handles turn taking."
+    phase_mode = False
+    # The fight's own state that's only kept in memory.
+    MEMORY_STATE = ("fighters", "timer", "turns", "pending_defenses", "defense_warned", "outcome")
+    @property
+    def fighters(self):
+        "Everyone in the fight, in turn order. Only kept in memory - the snapshot saves them as dbrefs."
+        return self.ndb.fighters
     def at_script_creation(self):
-        self.key = ("%i_turn_handler" % randint(1,10000))
+        self.db.fight_id = fights.allocate_fight_id()
+        self.key = ("fight_%i" % self.db.fight_id)
         self.desc = "Turn order handler."
         self.interval = 2 # every 2 seconds
         self.persistent = True
         # Add a DB object to the room with the script for testing.
         self.obj.db.Combat_TurnHandler = self
         # Add every character who can fight to the turn order.
-        self.db.fighters = []
-        for thing in self.obj.contents:
-            if thing.db.HP:
-                self.db.fighters.append(thing)
-        for fighter in self.db.fighters:
-            fighter.db.Combat_TurnHandler = self
-            fighter.db.Combat_LastAction = "null"
-            fighter.db.Combat_Conditions = {}
+        self.ndb.fighters = self.obj.fighters_here()
+        for fighter in self.fighters:
+            fighter.combat.TurnHandler = self
+            fighter.combat.LastAction = "null"
+            fighter.combat.Conditions = {}
         # Roll initiative for each fighter in the list and sort them.
-        ordered_by_roll = sorted(self.db.fighters, key=rules.roll_init, reverse=True)
+        ordered_by_roll = sorted(self.fighters, key=rules.roll_init, reverse=True)
         turnorderstring = '{:-^80}'.format(" Turn order is: %s " % ", ".join(obj.key for obj in ordered_by_roll))
         self.combat_msg("|445%s|n" % turnorderstring)
-        self.db.fighters = ordered_by_roll
+        self.ndb.fighters = ordered_by_roll
         # Set up the current turn and turn timeout delay.
         self.db.turn = 0
-        self.db.timer = 60 # 2 minutes
-        rules.start_turn(self.db.fighters[0])
+        self.ndb.timer = 60 # 2 minutes
+        # Everything's already in memory, so there's nothing to restore.
+        self.ndb.restored = True
         # Set up ranges.
-        for fighter in self.db.fighters:
-            rules.init_range(fighter, self.db.fighters)
+        for fighter in self.fighters:
+            rules.init_range(fighter, self.fighters)
+        self.begin_fight()
+    def at_start(self):
+        "Called every time the script starts, including after a reload."
+        # Fights started before fight ids existed get one now.
+        if not self.db.fight_id:
+            self.db.fight_id = fights.allocate_fight_id()
+        # After a reload, combat state has to be put back from the last snapshot.
+        if not self.ndb.restored:
+            self.restore()
+        if self.ndb.restore_failed:
+            # A script can't be stopped from inside its own start hook, so end the fight once starting up is done.
+            utils.delay(0, callback=self.end_unrestored)
+            return
+        fights.register_fight(self)
+    def restore(self):
+        "Puts the fight's combat state back in memory from its last snapshot. Returns False, and marks the fight to be ended, if it can't be."
+        self.ndb.restored = True
+        if fights.restore_fight(self):
+            return True
+        self.ndb.restore_failed = True
+        return False
+    def end_unrestored(self):
+        "Ends a fight that couldn't be restored after the server restarted."
+        # Fights from before snapshots kept their fighters in an Attribute - they're needed to clean up.
+        self.ndb.fighters = list(self.attributes.get("fighters") or [])
+        self.combat_msg("|413This fight couldn't be picked back up after the server restarted, so it has ended.|n")
+        self.stop()
+    def memory_state(self):
+        "Returns a copy of everything about the fight that's only kept in memory, fighters' combat state included, for restore_memory_state()."
+        handlerstate = dict((key, fights.plain(getattr(self.ndb, key))) for key in self.MEMORY_STATE)
+        fighterstates = [(fighter, fights.plain(fighter.combat.all())) for fighter in self.fighters]
+        return handlerstate, fighterstates
+    def restore_memory_state(self, saved):
+        "Puts the fight's in-memory state back the way memory_state() found it. Used when a command's database changes are rolled back."
+        handlerstate, fighterstates = saved
+        for key, value in handlerstate.items():
+            setattr(self.ndb, key, value)
+        for fighter, state in fighterstates:
+            fighter.combat.clear()
+            for key, value in state.items():
+                setattr(fighter.combat, key, value)
+    def save_snapshot(self):
+        "Saves the whole fight in one Attribute, to be restored from after a reload. It's always written in the background."
+        attribute = self.attributes.get("snapshot", return_obj=True)
+        if not attribute:
+            # Only the empty row is made here, so there's one id for every write to go to.
+            self.attributes.add("snapshot", None)
+            attribute = self.attributes.get("snapshot", return_obj=True)
+        # Serialized the way Evennia stores any Attribute, then put in the cache too, since the write skips it.
+        value = to_pickle(fights.snapshot_fight(self))
+        attribute.db_value = value
+        writer.enqueue(fights.write_snapshot, (attribute.id, value), key=("snapshot", attribute.id))
+    def begin_fight(self):
+        "Starts the first character's turn."
+        rules.start_turn(self.fighters[0])
         # Prompt the first character's turn.
-        rules.turn_prompt(self.db.fighters[0])
+        rules.turn_prompt(self.fighters[0])
+        rules.mark_oob_change(self.fighters[0], "turn")
+        self.save_snapshot()
     def at_repeat(self):
         "Called every self.interval seconds"
-        currentchar = self.db.fighters[self.db.turn]
-        self.db.timer -= 1
-        if currentchar.db.Combat_Actions == 0 and currentchar.db.Combat_Moves == 0 and not currentchar.db.Combat_Second:
+        self.check_defense_deadlines()
+        currentchar = self.fighters[self.db.turn]
+        self.ndb.timer -= 1
+        if currentchar.combat.Actions == 0 and currentchar.combat.Moves == 0 and not currentchar.combat.Second:
             # Advance the turn when current character has no actions, moves, or second attack, but only if there are no outstanding attacks
             if not self.attack_check():
                 self.next_turn()
-        if self.db.timer == 10:
+        if self.ndb.timer == 10:
             # Give a timeout warning, but only if there are no outstanding attacks
             if not self.attack_check():
                 currentchar.msg("|420WARNING: About to time out!|n")
-        if self.db.timer <= 0:
+        if self.ndb.timer <= 0:
             # Advance the turn when the timer runs out, but only if there are no outstanding attacks
             if not self.attack_check():
-                currentchar.db.Combat_LastAction = "disengage"
+                currentchar.combat.LastAction = "disengage"
                 self.combat_msg("%s's turn timed out! |222[Disengage]|n" % currentchar)
                 self.next_turn()
     def combat_msg(self, message):
         # Sends a message to all characters in combat, even in different rooms.
-        for fighter in self.db.fighters:
+        for fighter in self.fighters:
             fighter.msg(message)
+        rules.feed_spectators(self, message)
+    def is_turn(self, character):
+        # Checks to see if it's a character's turn.
+        return character == self.fighters[self.db.turn]
+    def await_defense(self, defender):
+        # Gives a fighter time to respond to an attack - check_defense_deadlines defends for them if they run out.
+        defender.msg("|530----- |540Incoming Attack! |530-----|n")
+    def await_area_defense(self, attacker, defenders):
+        # Gives everyone hit by an area attack time to respond. They all share the attack's deadline.
+        for defender in defenders:
+            self.await_defense(defender)
+    def check_defense_deadlines(self):
+        # Warns fighters about to run out of time to respond to an attack, and defends automatically for those who have.
+        now = time.time()
+        warned = self.ndb.defense_warned
+        if warned is None:
+            warned = set()
+            self.ndb.defense_warned = warned
+        timedout = []
+        for fighter in self.fighters:
+            incoming = fighter.combat.IncomingAttack
+            if not incoming:
+                warned.discard(fighter)
+                continue
+            # Attacks saved without a deadline have had plenty of time by now.
+            deadline = now
+            if len(incoming) > 5:
+                deadline = incoming[5]
+            if now >= deadline:
+                timedout.append(fighter)
+            elif deadline - now <= 10 and fighter not in warned:
+                fighter.msg("|420Respond to %s's attack! Timing out soon!|n" % incoming[1])
+                warned.add(fighter)
+        for fighter in timedout:
+            warned.discard(fighter)
+            fighter.msg("|420Timed out - defending automatically|n")
+            rules.defend_queue(fighter, "defend", [])
     def attack_check(self):
         # Checks to see if there are any unresolved attacks.
-        for fighter in self.db.fighters:
-            if fighter.db.Combat_IncomingAttack:
+        for fighter in self.fighters:
+            if fighter.combat.IncomingAttack:
                 return True
         return False
     def next_turn(self):
+        if self.check_end():
+            return
+        # Cycles to the next turn.
+        currentchar = self.fighters[self.db.turn]
+        self.ndb.turns = (self.ndb.turns or 0) + 1
+        # Ticks down the condition timers on each character.
+        for fighter in self.fighters:
+            rules.condition_tickdown(fighter, currentchar)
+        rules.pass_turn(currentchar)
+        self.db.turn += 1
+        if self.db.turn > len(self.fighters) - 1:
+            self.db.turn = 0
+        newchar = self.fighters[self.db.turn]
+        self.ndb.timer = 60
+        turnmessage = '{:-^80}'.format(" %s's turn ends - %s's turn begins! " % (currentchar, newchar))
+        self.combat_msg("|445%s|n" % turnmessage)
+        rules.end_spectator_turn(self)
+        rules.turn_prompt(newchar)
+        rules.start_turn(newchar)
+        rules.mark_oob_change(newchar, "turn")
+        self.save_snapshot()
+    def check_end(self):
+        # Ends combat and returns True if everyone has disengaged or only one fighter is left standing.
         # Checks to see if every character passed as their last action. If so, end combat.
         DisengageCheck = True
-        for fighter in self.db.fighters:
-            if fighter.db.Combat_LastAction != "disengage":
+        for fighter in self.fighters:
+            if fighter.combat.LastAction != "disengage":
                 DisengageCheck = False
         if DisengageCheck == True:
             endmessage = '{:-^80}'.format(" All fighters have disengaged! Combat is over! ")
             self.combat_msg("|445%s|n" % endmessage)
+            self.ndb.outcome = ("disengage", None)
             self.stop()
-            return
+            return True
         # Checks to see if only one character is left standing. If so, end combat.
         DefeatedCharacters = 0
-        for fighter in self.db.fighters:
+        for fighter in self.fighters:
             if fighter.db.HP == 0:
                 DefeatedCharacters += 1
-        if DefeatedCharacters == (len(self.db.fighters) - 1):
-            for fighter in self.db.fighters:
+        if DefeatedCharacters == (len(self.fighters) - 1):
+            for fighter in self.fighters:
                 if fighter.db.HP != 0:
                     LastStanding = fighter
             endmessage = '{:-^80}'.format(" Only %s remains! Combat is over! " % LastStanding)
             self.combat_msg("|445%s|n" % endmessage)
+            self.ndb.outcome = ("victory", LastStanding)
             self.stop()
-            return
-        # Cycles to the next turn.
-        currentchar = self.db.fighters[self.db.turn]
-        # Ticks down the condition timers on each character.
-        for fighter in self.db.fighters:
-            rules.condition_tickdown(fighter, currentchar)
-        rules.pass_turn(currentchar)
-        self.db.turn += 1
-        if self.db.turn > len(self.db.fighters) - 1:
-            self.db.turn = 0
-        newchar = self.db.fighters[self.db.turn]
-        self.db.timer = 60
-        turnmessage = '{:-^80}'.format(" %s's turn ends - %s's turn begins! " % (currentchar, newchar))
-        self.combat_msg("|445%s|n" % turnmessage)
-        rules.turn_prompt(newchar)
-        rules.start_turn(newchar)
+            return True
+        return False
     def at_stop(self):
         "Called at script termination."
-        for fighter in self.db.fighters:
+        for fighter in self.fighters:
             fighter.cmdset.delete("commands.default_cmdsets.CombatCmdset")
-            rules.combat_cleanup(fighter)
+        history.record_fight(self)
+        ratings.rate_fight(self)
+        rules.combat_cleanup(self.fighters)
+        rules.end_spectating(self)
+        fights.unregister_fight(self)
+        del self.obj.db.Combat_TurnHandler
+        # Last, so anything that starts a new fight in this room from a callback can.
+        fights.fight_ended(self)
     def join_fight(self, character):
         "Adds a new character to the fight."
         # Pick a random fighter already in the fight, for later.
-        randfighter = self.db.fighters[randint(0, (len(self.db.fighters)-1))]
+        randfighter = self.fighters[randint(0, (len(self.fighters)-1))]
         # Inserts the fighter to the turn order behind whoever's turn it currently is.
-        self.db.fighters.insert(self.db.turn, character)
+        self.fighters.insert(self.db.turn, character)
         # Tick the turn counter forward one to compensate.
         self.db.turn += 1
         # Initialize the character like you do at the start.
-        character.db.Combat_TurnHandler = self
-        character.db.Combat_LastAction = "null"
-        character.db.Combat_Conditions = {}
+        character.combat.TurnHandler = self
+        fights.register_fighter(self, character)
+        character.combat.LastAction = "null"
+        character.combat.Conditions = {}
         # Copy the range from another character.
-        character.db.Combat_Range = randfighter.db.Combat_Range
+        character.combat.Range = randfighter.combat.Range
         # Add the new character to everyone else's ranges.
-        for fighter in self.db.fighters:
+        for fighter in self.fighters:
             new_fighters_range = character.location.db.RoomSize
-            fighter.db.Combat_Range.update({character:new_fighters_range})
+            fighter.combat.Range.update({character:new_fighters_range})
         # Set the range to room's maximum for everyone on the new fighter's range.
-        for fighter in self.db.fighters:
-            character.db.Combat_Range.update({fighter:character.location.db.RoomSize})
+        for fighter in self.fighters:
+            character.combat.Range.update({fighter:character.location.db.RoomSize})
         # Set the new fighter range to themself to 0.
-        character.db.Combat_Range.update({character:0})
+        character.combat.Range.update({character:0})
+        self.save_snapshot()
         # Hopefully, the new fighter is now as far away from every other fighter as possible but themself.
-        
-        
-            
-                    
+
+class PhaseTurnHandler(TurnHandler):
+    """
+    Runs a fight in rounds instead of one turn at a time, for big battles.
+    Every fighter declares their actions at once with the 'declare' command,
+    then when everyone has declared or the window runs out, the round is
+    resolved all in one go - each fighter's declared commands are run in
+    initiative order, and attacks are defended right away using the stance
+    each defender declared, instead of waiting on them.
+    """
+    phase_mode = True
+    def begin_fight(self):
+        "Starts the first round."
+        self.ndb.resolving = False
+        self.db.round = 0
+        self.start_round()
+    def start_round(self):
+        "Opens the window for fighters to declare their actions."
+        self.db.round += 1
+        self.ndb.timer = max(1, PHASE_WINDOW / self.interval)
+        for fighter in self.fighters:
+            fighter.combat.Declared = []
+        roundmessage = '{:-^80}'.format(" Round %i - declare your actions! " % self.db.round)
+        self.combat_msg("|445%s|n" % roundmessage)
+        for fighter in self.fighters:
+            if fighter.db.HP:
+                rules.turn_prompt(fighter, "Declare your actions!")
+        rules.mark_oob_change(self.fighters[self.db.turn], "turn")
+        self.save_snapshot()
+    def at_repeat(self):
+        "Called every self.interval seconds"
+        # The round resolves all at once, so there's nothing to do while it does.
+        if self.ndb.resolving:
+            return
+        self.check_defense_deadlines()
+        self.ndb.timer -= 1
+        if self.ndb.timer == max(1, 10 / self.interval):
+            for fighter in self.undeclared():
+                fighter.msg("|420WARNING: About to time out! Declare your actions!|n")
+        if self.ndb.timer <= 0 or not self.undeclared():
+            self.resolve_round()
+    def undeclared(self):
+        "Returns the fighters still standing who haven't declared anything this round."
+        return [fighter for fighter in self.fighters if fighter.db.HP and not fighter.combat.Declared]
+    def is_turn(self, character):
+        "Only the fighter whose actions are being resolved can act, and only while the round resolves."
+        return bool(self.ndb.resolving) and character == self.fighters[self.db.turn]
+    def await_defense(self, defender):
+        "Attacks are defended as soon as the command making them finishes."
+        if not self.ndb.resolving:
+            super(PhaseTurnHandler, self).await_defense(defender)
+            return
+        self.ndb.pending_defenses.append(defender)
+    def await_area_defense(self, attacker, defenders):
+        "Everyone hit by an area attack defends right away, and the results are summed up."
+        if not self.ndb.resolving:
+            super(PhaseTurnHandler, self).await_area_defense(attacker, defenders)
+            return
+        self.ndb.pending_defenses.extend(defenders)
+        self.resolve_defenses()
+    def resolve_defenses(self):
+        "Defends every attack made so far, in the order they were made, with each defender's declared stance."
+        pending = self.ndb.pending_defenses
+        while pending:
+            defender = pending.pop(0)
+            if defender.combat.IncomingAttack:
+                rules.defend_queue(defender, defender.combat.Stance or "defend", [])
+    def resolve_round(self):
+        "Runs everyone's declared actions in initiative order, then checks for the end of the fight."
+        # Imported here so typeclasses don't depend on the commands when they load.
+        from commands.command import run_declared
+        self.ndb.resolving = True
+        self.ndb.pending_defenses = []
+        self.ndb.turns = (self.ndb.turns or 0) + 1
+        resolvemessage = '{:-^80}'.format(" Round %i resolves! " % self.db.round)
+        self.combat_msg("|445%s|n" % resolvemessage)
+        # Send the whole round to the room as one message.
+        started_broadcast = rules.begin_broadcast(self.obj)
+        try:
+            for turn, fighter in enumerate(self.fighters):
+                if not fighter.db.HP:
+                    continue
+                self.db.turn = turn
+                rules.start_turn(fighter)
+                # Fighters who don't declare anything disengage, like when a turn times out.
+                for key, args in fighter.combat.Declared or [["disengage", ""]]:
+                    run_declared(fighter, key, args)
+                    self.resolve_defenses()
+                for other in self.fighters:
+                    rules.condition_tickdown(other, fighter)
+                rules.pass_turn(fighter)
+        finally:
+            self.ndb.resolving = False
+            self.db.turn = 0
+            if started_broadcast:
+                rules.end_broadcast(self.obj)
+        rules.end_spectator_turn(self)
+        if self.check_end():
+            return
+        self.start_round()
+
+class Tournament(DefaultScript):
+    """
+    Runs a tournament - pairs the entrants, starts their matches in
+    arenas, and moves everyone on as soon as each match ends. The
+    formats and pairing rules are in world/brackets.py. The state is
+    kept in memory and saved as a whole whenever it changes.
+    """
+    def at_script_creation(self):
+        "Called once, during initial creation."
+        self.key = "tournament"
+        self.desc = "Tournament runner."
+        self.persistent = True
+    def at_start(self):
+        "Called every time the script starts, including after a reload."
+        self.load_state()
+    def load_state(self):
+        "Puts the tournament's state back in memory after a reload, and adds it to the registry. Does nothing before it's begun."
+        if self.ndb.state is None:
+            state = self.attributes.get("state")
+            if not state:
+                return
+            self.ndb.state = fights.plain(state)
+        tournaments.register_tournament(self)
+    def save_state(self):
+        "Saves the tournament's state."
+        self.db.state = self.ndb.state
+    def begin(self, tournament_format, entrants, rounds=0):
+        "Starts the tournament. Entrants are seeded in the order given."
+        self.key = "tournament_%i" % self.id
+        self.ndb.state = brackets.new_state(tournament_format, [(entrant.id, entrant.key) for entrant in entrants], rounds)
+        tournaments.register_tournament(self)
+        startmessage = '{:-^80}'.format(" Tournament #%i begins! " % self.id)
+        self.announce("|445%s|n\n%s tournament: %s" % (startmessage, self.format_name(), ", ".join(str(entrant) for entrant in entrants)))
+        self.schedule()
+    def format_name(self):
+        "Returns the tournament's format, for display."
+        state = self.ndb.state
+        if state["format"] == "swiss":
+            return "%i round Swiss" % state["rounds"]
+        return {"single":"Single elimination", "double":"Double elimination"}[state["format"]]
+    def is_entrant(self, character):
+        "Returns whether a character is in this tournament and still has matches to play."
+        state = self.ndb.state
+        return character.id in state["players"] and character.id in brackets.alive(state)
+    def announce(self, message):
+        "Sends a message to every entrant."
+        for entrant in fights.resolve_fighters(list(self.ndb.state["players"])):
+            if entrant:
+                entrant.msg(message)
+    def schedule(self):
+        "Pairs everyone who's due a match, starts as many as there are arenas for, and ends the tournament if it's over."
+        if self.ndb.stopping:
+            return
+        state = self.ndb.state
+        pairs, byes = brackets.pair_ready(state, time.time())
+        for pid in byes:
+            self.announce("%s gets a bye this round." % state["players"][pid]["name"])
+        self.start_waiting()
+        if brackets.is_finished(state):
+            self.finish()
+            return
+        self.save_state()
+    def start_waiting(self):
+        """
+        Starts every waiting match there's an arena for, unless one of its
+        entrants is busy in another fight. An entrant who's been deleted or
+        isn't connected forfeits the match - if neither is there, it counts
+        as a loss for both.
+        """
+        if self.ndb.stopping:
+            return
+        state = self.ndb.state
+        changed, forfeits = False, False
+        for match in list(state["waiting"]):
+            first, second = fights.resolve_fighters(match[:2])
+            present = [entrant for entrant in (first, second) if entrant and entrant.has_player]
+            if len(present) < 2:
+                state["waiting"].remove(match)
+                winner = present[0] if present else None
+                brackets.record_result(state, match[0], match[1], winner.id if winner else None)
+                names = (state["players"][match[0]]["name"], state["players"][match[1]]["name"])
+                if winner:
+                    self.announce("%s wins by forfeit against %s in tournament #%i." % (winner.key, names[1] if winner.id == match[0] else names[0], self.id))
+                else:
+                    self.announce("Neither %s nor %s is here for their tournament match - it counts as a loss for both." % names)
+                changed, forfeits = True, True
+                continue
+            if first.combat.TurnHandler or second.combat.TurnHandler:
+                continue
+            arena = arenas.check_out()
+            if not arena:
+                break
+            state["waiting"].remove(match)
+            self.start_match(first, second, arena, match[2])
+            changed = True
+        if forfeits:
+            self.schedule()
+        elif changed:
+            self.save_state()
+    def start_match(self, first, second, arena, queued):
+        "Starts a match between two entrants in an arena. If the fight can't be started, the arena goes back to the pool and the match waits again."
+        handler = arenas.start_match(arena, (first, second))
+        if not handler:
+            logger.log_err("Tournament #%i: couldn't start %s vs %s in %s." % (self.id, first, second, arena))
+            arenas.check_in(arena)
+            self.ndb.state["waiting"].append([first.id, second.id, queued])
+            return
+        first.msg("|445Your tournament match against %s is starting!|n" % second)
+        second.msg("|445Your tournament match against %s is starting!|n" % first)
+        self.ndb.state["matches"][handler.db.fight_id] = [first.id, second.id, arena.id, time.time()]
+        tournaments.register_match(self, handler.db.fight_id)
+        metrics.timing("tournament.match_wait", time.time() - queued)
+        metrics.gauge("tournament.matches_running", sum(len(tournament.ndb.state["matches"]) for tournament in tournaments.all_tournaments()))
+    def match_ended(self, handler):
+        "Records the result of a match that's just ended, sends its entrants back to the recovery bay and frees its arena."
+        state = self.ndb.state
+        match = state["matches"].pop(handler.db.fight_id, None)
+        if not match:
+            return
+        first_id, second_id, arena_id, started = match
+        outcome, winner = handler.ndb.outcome or ("stopped", None)
+        winner_id = winner.id if winner and winner.id in (first_id, second_id) else None
+        brackets.record_result(state, first_id, second_id, winner_id)
+        metrics.incr("tournament.matches_completed")
+        metrics.timing("tournament.match_length", time.time() - started)
+        names = (state["players"][first_id]["name"], state["players"][second_id]["name"])
+        if winner_id:
+            self.announce("%s defeats %s in tournament #%i." % (state["players"][winner_id]["name"], names[1] if winner_id == first_id else names[0], self.id))
+        else:
+            self.announce("%s and %s's tournament match ends with no winner - it counts as a loss for both." % names)
+        arena = ObjectDB.objects.get_id(arena_id)
+        if arena:
+            arenas.check_in(arena)
+        self.schedule()
+    def resume(self):
+        "Called when the server starts. Matches whose fight didn't survive the restart are played again."
+        state = self.ndb.state
+        for fight_id, match in list(state["matches"].items()):
+            arena = ObjectDB.objects.get_id(match[2])
+            handler = arena.db.Combat_TurnHandler if arena else None
+            if handler and handler.db.fight_id == fight_id:
+                continue
+            del state["matches"][fight_id]
+            state["waiting"].append([match[0], match[1], time.time()])
+            if arena:
+                arenas.check_in(arena)
+        self.schedule()
+    def finish(self):
+        "Announces the final standings and ends the tournament."
+        state = self.ndb.state
+        standings = brackets.standings(state)
+        endmessage = '{:-^80}'.format(" Tournament #%i is over! " % self.id)
+        lines = ["|445%s|n" % endmessage]
+        if state["format"] != "swiss" and not brackets.alive(state):
+            lines.append("Nobody is left standing.")
+        else:
+            lines.append("|552%s|n wins the tournament!" % state["players"][standings[0]]["name"])
+        self.announce("\n".join(lines + brackets.standings_lines(state)[:8]))
+        self.save_state()
+        self.stop()
+    def at_stop(self):
+        "Called at script termination. Any matches still going are stopped."
+        self.ndb.stopping = True
+        for fight_id in list(self.ndb.state["matches"] if self.ndb.state else []):
+            handler = fights.get_fight(fight_id)
+            if handler:
+                handler.stop()
+        tournaments.unregister_tournament(self)
@@ -53,7 +53,8 @@ class SlowExit(DefaultExit):
         move_delay = max(traversing_object.location.db.RoomSize / 2, 1)
         
         # Keep players from moving in combat or with 0 HP.
-        if traversing_object.db.Combat_TurnHandler:
+        combat = getattr(traversing_object, "combat", None)
+        if combat and combat.TurnHandler:
             traversing_object.msg("You can't move, you're in combat!")
             return
             
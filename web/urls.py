@@ -6,12 +6,18 @@ help.
 """
 from django.conf.urls import url, include
 
+from web import views
+
 # default evennia patterns
 from evennia.web.urls import urlpatterns
 
 # eventual custom patterns
 custom_patterns = [
     # url(r'/desired/url/', view, name='example'),
+    url(r'^leaderboard/$', views.leaderboard, name='leaderboard'),
+    url(r'^spectate/$', views.spectate_list, name='spectate_list'),
+    url(r'^spectate/(?P<fight_id>\d+)/$', views.spectate_fight, name='spectate_fight'),
+    url(r'^spectate/(?P<fight_id>\d+)/feed/$', views.spectate_feed, name='spectate_feed'),
 ]
 
 # this is required by Django.
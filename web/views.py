@@ -0,0 +1,85 @@
+"""
+Views for the game's own web pages. Wired up in web/urls.py.
+
+The views run in the webserver's threads, while everything they show
+is kept in memory and changed on the reactor thread. So they never
+read game state themselves - they ask the reactor for a copy with
+blockingCallFromThread() and only use that.
+
+"""
+from django.http import Http404, JsonResponse
+from django.shortcuts import render
+from evennia.utils.ansi import strip_ansi
+from twisted.internet import reactor
+from twisted.internet.threads import blockingCallFromThread
+
+from world import ratings
+from world import spectate
+
+# How many fighters are shown on each page of the leaderboard.
+LEADERBOARD_PAGE_SIZE = 50
+
+
+def leaderboard(request):
+    """
+    Shows a page of the leaderboard, straight from the in-memory
+    ratings, so the database isn't asked to sort every player.
+    """
+    page = request.GET.get("page", "1")
+    page = int(page) if page.isdigit() and int(page) > 0 else 1
+    total, page, entries = blockingCallFromThread(reactor, leaderboard_page, page)
+    pages = max(1, (total + LEADERBOARD_PAGE_SIZE - 1) // LEADERBOARD_PAGE_SIZE)
+    context = {"entries": entries,
+               "page": page,
+               "pages": pages,
+               "total": total,
+               "previous_page": page - 1 if page > 1 else None,
+               "next_page": page + 1 if page < pages else None}
+    return render(request, "leaderboard.html", context)
+
+
+def leaderboard_page(page):
+    """
+    Returns the number of ranked fighters, the page asked for (or the
+    last one, if there aren't that many) and its entries. Run on the
+    reactor thread, so the board can't change while it's read.
+    """
+    total = ratings.board_size()
+    pages = max(1, (total + LEADERBOARD_PAGE_SIZE - 1) // LEADERBOARD_PAGE_SIZE)
+    page = min(page, pages)
+    return total, page, ratings.top(LEADERBOARD_PAGE_SIZE, (page - 1) * LEADERBOARD_PAGE_SIZE)
+
+
+def spectate_list(request):
+    "Lists every fight going on, to pick one to watch."
+    entries = blockingCallFromThread(reactor, spectate.web_fight_list)
+    return render(request, "spectate_list.html", {"entries": entries})
+
+
+def spectate_fight(request, fight_id):
+    "Shows the page that follows a fight. Its script fetches the feed from spectate_feed()."
+    location = blockingCallFromThread(reactor, spectate.web_fight, int(fight_id))
+    if location is None:
+        raise Http404("There's no fight going on with that number.")
+    context = {"fight_id": int(fight_id),
+               "location": location,
+               "interval": spectate.SPECTATE_INTERVAL}
+    return render(request, "spectate.html", context)
+
+
+def spectate_feed(request, fight_id):
+    """
+    Returns a fight's state and the turn blocks after the 'since' one
+    as JSON, for the spectate page to poll. The fight is over once
+    'over' is true.
+    """
+    since = request.GET.get("since", "0")
+    since = int(since) if since.isdigit() else 0
+    feed = blockingCallFromThread(reactor, spectate.web_feed, int(fight_id), since)
+    if not feed:
+        return JsonResponse({"over": True})
+    state, blocks, latest = feed
+    return JsonResponse({"over": False,
+                         "state": state,
+                         "blocks": [strip_ansi(block) for block in blocks],
+                         "latest": latest})
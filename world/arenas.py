@@ -0,0 +1,159 @@
+"""
+Arenas
+
+Rooms set aside for organized fights - tournament matches and
+matchmaking duels - so they don't happen in front of everyone in a
+shared room. Arenas are ordinary rooms with no exits, kept in a pool
+and reused: one is checked out when a match starts, and reset and
+checked back in when it ends. None are ever made or deleted for a
+single fight.
+
+The pool is filled up when the server starts, to the number of arenas
+of each RoomSize in ARENA_POOL, and more can be made with '@arenas'.
+Any other room can be added to the pool by tagging it:
+
+    @tag <room> = arena:arena
+
+Every arena is looked up when the server starts and the free ones kept
+in memory by size, so checking one out doesn't search the database. An
+arena that's checked out has an ArenaInUse Attribute, so it stays taken
+across reloads until it's checked back in.
+
+"""
+
+import metrics
+import landmarks
+import rules
+from collections import deque
+from django.conf import settings
+from evennia import ObjectDB, search_tag, create_object
+
+# Tag, and tag category, that mark a room as an arena.
+ARENA_TAG = "arena"
+ARENA_CATEGORY = "arena"
+# RoomSize to how many arenas of that size to keep. Never shrinks the pool.
+ARENA_POOL = getattr(settings, "ARENA_POOL", {5:8})
+# Size of arena to use when a match doesn't ask for one.
+ARENA_DEFAULT_SIZE = getattr(settings, "ARENA_DEFAULT_SIZE", 5)
+ARENA_DESC = "A bare, walled-off fighting floor, kept clear for organized matches. Use 'return' to leave."
+
+# RoomSize to the dbrefs of the free arenas of that size, in the order they'll be handed out.
+_free = {}
+# RoomSize to how many arenas of that size there are, free or not.
+_counts = {}
+
+def arena_size(room):
+    "Returns the RoomSize an arena is reset to."
+    return room.db.ArenaSize or room.db.RoomSize
+
+def load_arenas():
+    "Finds every arena, notes which are free, and tops the pool up to ARENA_POOL. Called every time the server starts or reloads."
+    _free.clear()
+    _counts.clear()
+    for room in search_tag(ARENA_TAG, category=ARENA_CATEGORY):
+        size = arena_size(room)
+        _counts[size] = _counts.get(size, 0) + 1
+        if not room.db.ArenaInUse:
+            _free.setdefault(size, deque()).append(room.id)
+    for size, count in ARENA_POOL.items():
+        if _counts.get(size, 0) < count:
+            create_arenas(count - _counts.get(size, 0), size)
+    update_gauges()
+
+def create_arenas(count, size):
+    "Makes more arenas of a RoomSize and adds them to the pool. Returns the new rooms."
+    rooms = []
+    for number in range(count):
+        total = sum(_counts.values()) + 1
+        room = create_object("rooms.Room", key="Arena %i" % total)
+        room.db.RoomSize = size
+        room.db.ArenaSize = size
+        room.db.desc = ARENA_DESC
+        room.tags.add(ARENA_TAG, category=ARENA_CATEGORY)
+        _counts[size] = _counts.get(size, 0) + 1
+        _free.setdefault(size, deque()).append(room.id)
+        rooms.append(room)
+    metrics.incr("arenas.created", count)
+    update_gauges()
+    return rooms
+
+def check_out(size=None, purpose=True):
+    """
+    Returns a free arena, now marked as in use, or None if there isn't
+    one. With a size, only an arena of that RoomSize will do. Without,
+    it's one of ARENA_DEFAULT_SIZE if any are free, or else one of
+    whichever size has the most free. Purpose is kept in the arena's
+    ArenaInUse Attribute, so whatever checked it out can tell it's
+    theirs, even after a reload.
+    """
+    if size is None:
+        sizes = [ARENA_DEFAULT_SIZE] + sorted(_free, key=lambda free_size: -len(_free[free_size]))
+    else:
+        sizes = [size]
+    for free_size in sizes:
+        free = _free.get(free_size)
+        while free:
+            room = ObjectDB.objects.get_id(free.popleft())
+            # Skip arenas that have been deleted, or that someone started a fight in by hand.
+            if room and not room.db.ArenaInUse and not room.db.Combat_TurnHandler:
+                room.db.ArenaInUse = purpose
+                metrics.incr("arenas.checked_out")
+                update_gauges()
+                return room
+    metrics.incr("arenas.none_free")
+    return None
+
+def check_in(room):
+    "Resets an arena once its fight is over and hands it back to the pool."
+    reset_arena(room)
+    del room.db.ArenaInUse
+    free = _free.setdefault(arena_size(room), deque())
+    if room.id not in free:
+        free.append(room.id)
+    update_gauges()
+
+def start_match(room, fighters):
+    "Heals the fighters, moves them into an arena and starts their fight. Returns the fight's TurnHandler, or None if any of them couldn't be moved in."
+    for fighter in fighters:
+        rules.recover(fighter)
+        fighter.move_directly(room)
+        fighter.execute_cmd("look")
+    if any(fighter.location != room for fighter in fighters):
+        return None
+    room.scripts.add("scripts.TurnHandler")
+    return room.db.Combat_TurnHandler
+
+def release_abandoned(purpose):
+    "Checks in every arena checked out for a purpose that has no fight going on in it. Called when the server starts, for arenas whose fight didn't survive the restart."
+    for room in search_tag(ARENA_TAG, category=ARENA_CATEGORY):
+        if room.db.ArenaInUse == purpose and not room.db.Combat_TurnHandler:
+            check_in(room)
+
+def reset_arena(room):
+    "Clears an arena out for the next match - everyone and everything left in it goes to the recovery bay, and its RoomSize goes back to what it should be."
+    recoverybay = landmarks.get_landmark("recovery_bay")
+    for con in room.contents:
+        if con.destination or not recoverybay:
+            continue
+        if hasattr(con, "move_directly"):
+            con.move_directly(recoverybay)
+        else:
+            con.move_to(recoverybay, quiet=True)
+    if room.db.RoomSize != arena_size(room):
+        room.db.RoomSize = arena_size(room)
+    room.ndb.fighter_roster = None
+    room.reset_appearance()
+
+def free_count(size=None):
+    "Returns how many arenas are free, of one RoomSize or all of them."
+    if size is not None:
+        return len(_free.get(size, ()))
+    return sum(len(free) for free in _free.values())
+
+def pool_sizes():
+    "Returns (RoomSize, free arenas, all arenas) for each size of arena, smallest first."
+    return [(size, free_count(size), _counts[size]) for size in sorted(_counts)]
+
+def update_gauges():
+    "Updates the free arena gauge."
+    metrics.gauge("arenas.free", free_count())
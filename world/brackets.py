@@ -0,0 +1,192 @@
+"""
+Brackets
+
+The pairing rules for tournaments (see world/tournaments.py), worked
+out on a tournament's state - a plain dictionary, saved by the
+Tournament script - with no database or game objects involved.
+
+Elimination entrants are due to fight when they've played as many
+matches and have as many losses as each other. Someone left over with
+no one who could ever catch up to them is paired with the nearest other
+entrant in the same spot - which is how byes and the final between the
+winners' and losers' sides of a double elimination come about. Swiss
+entrants are paired by score within the same round as soon as two with
+the same score are ready, and the rest of a round is paired once nobody
+else can join it.
+
+"""
+
+# How many losses put an entrant out of each elimination format.
+MAX_LOSSES = {"single":1, "double":2}
+TOURNAMENT_FORMATS = ("single", "double", "swiss")
+
+def new_state(tournament_format, entrants, rounds):
+    "Returns the starting state of a tournament. Entrants are (dbref, name) pairs, seeded in the order given."
+    players = {}
+    for seed, (pid, name) in enumerate(entrants):
+        players[pid] = {"name":name, "seed":seed, "losses":0, "played":0,
+                        "score":0, "opponents":[], "bye":False, "busy":False}
+    return {"format":tournament_format, "rounds":rounds, "players":players,
+            "matches":{}, "waiting":[], "results":[]}
+
+def alive(state):
+    "Returns the ids of the entrants who still have matches to play."
+    players = state["players"]
+    if state["format"] == "swiss":
+        return [pid for pid in players if players[pid]["played"] < state["rounds"]]
+    max_losses = MAX_LOSSES[state["format"]]
+    return [pid for pid in players if players[pid]["losses"] < max_losses]
+
+def is_finished(state):
+    "Returns whether a tournament has no more matches to play."
+    if state["matches"] or state["waiting"]:
+        return False
+    if state["format"] == "swiss":
+        return not alive(state)
+    return len(alive(state)) <= 1
+
+def next_pairings(state):
+    "Returns a list of (entrant id, entrant id) matches that are due now, and a list of entrants given a bye. Neither is applied to the state."
+    if state["format"] == "swiss":
+        return swiss_pairings(state)
+    return elimination_pairings(state), []
+
+def pair_ready(state, now):
+    """
+    Pairs everyone who's due a match and hands out any byes, applying
+    both to the state - new matches join the waiting list and their
+    entrants are marked busy. Returns the new (entrant id, entrant id)
+    matches and the ids of the entrants given a bye.
+    """
+    matches, byes = [], []
+    while True:
+        pairs, newbyes = next_pairings(state)
+        if not pairs and not newbyes:
+            return matches, byes
+        for pid in newbyes:
+            record_bye(state, pid)
+        for first, second in pairs:
+            state["players"][first]["busy"] = True
+            state["players"][second]["busy"] = True
+            state["waiting"].append([first, second, now])
+        matches.extend(pairs)
+        byes.extend(newbyes)
+
+def elimination_pairings(state):
+    "Pairs the ready entrants of an elimination tournament."
+    players = state["players"]
+    remaining = alive(state)
+    if len(remaining) < 2:
+        return []
+    ready = sorted((pid for pid in remaining if not players[pid]["busy"]), key=lambda pid: players[pid]["seed"])
+    groups = {}
+    for pid in ready:
+        groups.setdefault((players[pid]["losses"], players[pid]["played"]), []).append(pid)
+    pairs, lone = [], []
+    for spot in sorted(groups):
+        group = groups[spot]
+        # Best seed left against worst seed left.
+        while len(group) >= 2:
+            pairs.append((group.pop(0), group.pop()))
+        lone.extend(group)
+    # Entrants nobody could ever catch up to - nobody with no more losses than them has fewer matches played.
+    def reachable(pid):
+        entrant = players[pid]
+        return any(players[other]["losses"] <= entrant["losses"] and players[other]["played"] < entrant["played"]
+                   for other in remaining if other != pid)
+    stuck = [pid for pid in lone if not reachable(pid)]
+    while len(stuck) >= 2:
+        first, second = stuck.pop(0), stuck.pop(0)
+        pairs.append((first, second))
+        lone.remove(first)
+        lone.remove(second)
+    # If nothing at all is going on, the two furthest behind fight rather than everyone waiting forever.
+    busy = any(players[pid]["busy"] for pid in remaining)
+    if not pairs and not busy and len(lone) >= 2:
+        pairs.append((lone[0], lone[1]))
+    return pairs
+
+def swiss_pairings(state):
+    "Pairs the ready entrants of a Swiss tournament, and hands out byes to anyone left over at the end of a round."
+    players = state["players"]
+    remaining = alive(state)
+    ready = sorted((pid for pid in remaining if not players[pid]["busy"]),
+                   key=lambda pid: (-players[pid]["score"], players[pid]["seed"]))
+    groups = {}
+    for pid in ready:
+        groups.setdefault(players[pid]["played"], []).append(pid)
+    pairs, byes = [], []
+    for played in sorted(groups):
+        group = groups[played]
+        # The round is closed once nobody else can still arrive in it.
+        closed = not any(players[other]["played"] < played for other in remaining if other not in group)
+        if closed and len(group) % 2:
+            # Odd one out gets a bye - the lowest ranked who hasn't had one yet.
+            bye = ([pid for pid in group if not players[pid]["bye"]] or group)[-1]
+            group.remove(bye)
+            byes.append(bye)
+        while group:
+            pid = group.pop(0)
+            opponent = None
+            for other in group:
+                if other in players[pid]["opponents"]:
+                    continue
+                if closed or players[other]["score"] == players[pid]["score"]:
+                    opponent = other
+                    break
+            if opponent is None and closed and group:
+                # Everyone left has been fought already - a rematch beats sitting out.
+                opponent = group[0]
+            if opponent is not None:
+                group.remove(opponent)
+                pairs.append((pid, opponent))
+    return pairs, byes
+
+def record_result(state, first, second, winner_id):
+    "Records the result of a match. A match with no winner - everyone disengaged, or staff stopped it - counts as a loss for both."
+    players = state["players"]
+    for pid, other in ((first, second), (second, first)):
+        entrant = players[pid]
+        entrant["played"] += 1
+        entrant["busy"] = False
+        entrant["opponents"].append(other)
+        if pid == winner_id:
+            entrant["score"] += 1
+        else:
+            entrant["losses"] += 1
+    state["results"].append([first, second, winner_id])
+
+def record_bye(state, pid):
+    "Gives a Swiss entrant a bye - a win without a match."
+    entrant = state["players"][pid]
+    entrant["played"] += 1
+    entrant["score"] += 1
+    entrant["bye"] = True
+
+def standings(state):
+    "Returns the entrants' ids, best first. Swiss ties are broken by the total score of everyone each entrant fought."
+    players = state["players"]
+    if state["format"] == "swiss":
+        def tiebreak(pid):
+            return sum(players[other]["score"] for other in players[pid]["opponents"])
+        return sorted(players, key=lambda pid: (-players[pid]["score"], -tiebreak(pid), players[pid]["seed"]))
+    # Entrants still in come first, then whoever lasted longest.
+    return sorted(players, key=lambda pid: (players[pid]["losses"], -players[pid]["played"], players[pid]["seed"]))
+
+def standings_lines(state):
+    "Returns the standings as lines of text, best first."
+    players = state["players"]
+    lines = []
+    for place, pid in enumerate(standings(state)):
+        entrant = players[pid]
+        record = "%i-%i" % (entrant["score"], entrant["played"] - entrant["score"])
+        if state["format"] == "swiss":
+            status = "%i of %i rounds played" % (entrant["played"], state["rounds"])
+        elif entrant["losses"] >= MAX_LOSSES[state["format"]]:
+            status = "out"
+        elif entrant["busy"]:
+            status = "fighting" if any(pid in match[:2] for match in state["matches"].values()) else "waiting for a match"
+        else:
+            status = "still in"
+        lines.append("%i. %s - %s (%s)" % (place + 1, entrant["name"], record, status))
+    return lines
@@ -1,17 +1,90 @@
 import rules
+from collections import OrderedDict
+from functools import wraps
 from evennia import ansi
 from evennia import utils
 
-def turn_prompt(character):
+# Health bar colors from empty to full.
+HEALTH_BAR_GRADIENT = ("|[300", "|[300", "|[310", "|[320", "|[330", "|[230", "|[130", "|[030", "|[030")
+
+def memoize(maxsize):
+    "Decorator that keeps a function's results in a least-recently-used cache of the given size, keyed on its arguments."
+    def decorator(func):
+        cache = OrderedDict()
+        @wraps(func)
+        def memoized(*args):
+            if args in cache:
+                # Move it to the most recently used end.
+                result = cache.pop(args)
+            else:
+                result = func(*args)
+                if len(cache) >= maxsize:
+                    cache.popitem(last=False)
+            cache[args] = result
+            return result
+        memoized.cache = cache
+        return memoized
+    return decorator
+
+def turn_prompt(character, header="It's your turn!"):
     "Gives a player combat information when their turn comes up."
-    turn_handler = character.db.Combat_TurnHandler
-    fighterlist = turn_handler.db.fighters
-    promptline = '{:-^88}'.format(" |540It's your turn!|530 ")
-    character.msg("|530%s|n" % promptline)
+    turn_handler = character.combat.TurnHandler
+    fighterlist = turn_handler.fighters
+    promptline = '{:-^88}'.format(" |540%s|530 " % header)
+    # Build the whole readout and send it as one message instead of one per line.
+    lines = ["|530%s|n" % promptline]
     for fighter in fighterlist:
-        character.msg(combat_status_line(fighter, character))
-    character.msg("|530--------------------------------------------------------------------------------|n")
+        lines.append(combat_status_line(fighter, character))
+    lines.append("|530--------------------------------------------------------------------------------|n")
+    # Clients with OOB support (webclient, GMCP) also get it as data. Others just ignore it.
+    character.msg(text="\n".join(lines), combat_turn=((), turn_prompt_data(character)))
+
+def turn_prompt_data(character):
+    "Returns the information shown in a turn prompt as a dictionary, for clients that display it themselves."
+    fighters = []
+    for fighter in character.combat.TurnHandler.fighters:
+        derived = fighter.derived_stats()
+        fighters.append({"id":fighter.id, "name":str(fighter),
+                         "hp":fighter.db.HP, "maxhp":derived["MaxHP"],
+                         "sp":fighter.db.SP, "maxsp":derived["MaxSP"],
+                         "range":character.combat.Range[fighter]})
+    return {"turn":character.id, "fighters":fighters}
     
+def room_msg(location, message):
+    "Sends a combat message to everyone in a room - held back and sent with the others if a command is running there."
+    rules.feed_room_spectators(location, message)
+    buffer = location.ndb.broadcast_buffer
+    if buffer is None:
+        location.msg_contents(message)
+        return
+    if not location.ndb.broadcast_flush_scheduled:
+        # If the command errors out before end_broadcast, send everything on the next reactor iteration anyway.
+        location.ndb.broadcast_flush_scheduled = True
+        utils.delay(0, callback=lambda: end_broadcast(location))
+    buffer.append(message)
+
+def begin_broadcast(location):
+    "Starts holding back room_msg messages in the location. Returns True if this call started it, False if it was already going."
+    if not location or location.ndb.broadcast_buffer is not None:
+        return False
+    location.ndb.broadcast_buffer = []
+    return True
+
+def flush_broadcast(location):
+    "Sends the messages held back in the location so far, and carries on holding back the rest. Called before a message goes straight to someone there, so it arrives after the room messages that led up to it."
+    buffer = location.ndb.broadcast_buffer
+    if buffer:
+        location.ndb.broadcast_buffer = []
+        location.msg_contents("\n".join(buffer))
+
+def end_broadcast(location):
+    "Sends every message held back in the location to the room as one message, in the order they were sent."
+    buffer = location.ndb.broadcast_buffer
+    location.ndb.broadcast_buffer = None
+    location.ndb.broadcast_flush_scheduled = False
+    if buffer:
+        location.msg_contents("\n".join(buffer))
+
 def range_name(value):
     "Converts a range value to a name."
     rangedict = {0:"Engaged", 1:"Very Close", 2:"Close", 3:"Medium-Close", 4:"Medium", 5:"Medium-Far", 6:"Far", 7:"Very Far", 8:"Distant", 9:"Very Distant", 10:"Remote"}
@@ -26,9 +99,10 @@ def size_name(value):
         return "Unknown"
     return sizedict[value]
     
+@memoize(1024)
 def health_bar(value, maximum, length):
-    "Returns a health bar of given length. Fancy!"
-    gradientlist = ["|[300", "|[300", "|[310", "|[320", "|[330", "|[230", "|[130", "|[030", "|[030"]
+    "Returns a health bar of given length. Fancy! Bars are cached, so each one is only built once."
+    gradientlist = HEALTH_BAR_GRADIENT
     # First, we convert the values to floats so we can do fine division on them.
     value = float(value)
     maximum = float(maximum)
@@ -47,46 +121,74 @@ def health_bar(value, maximum, length):
     # For some reason, sometimes the health bar is one character too long, so I fixed it here. Whatever.
     return barstring[:int(length) + 15] + "|n"
 
-def combat_status_line(fighter, caller):
-    "Prints out a one-line readout with a character's name, health bar, and range to the caller."
-    hbar = health_bar(fighter.db.HP, max(fighter.db.VIT * 3, 1), 20)
-    pluralstep = "steps"
-    if caller.db.Combat_Range[fighter] == 1:
-        pluralstep = "step"
-    spreadout = ("|255SP: |455%i|255/|455%i|n" % (fighter.db.SP, (fighter.db.SPE * 2)))
-    rangereadout = ("- |525%s (|545%i|525 %s)" % (range_name(caller.db.Combat_Range[fighter]), caller.db.Combat_Range[fighter], pluralstep))
-    # Let's color the range readout red if they're engaged.
-    if caller.db.Combat_Range[fighter] == 0:
-        rangereadout = ("- |522%s (|544%i|522 %s)" % (range_name(caller.db.Combat_Range[fighter]), caller.db.Combat_Range[fighter], pluralstep))
-    beforeformat_name = str(fighter)
-    if fighter == caller:
-        beforeformat_name = "> " + str(fighter)
+def combat_status_line(fighter, caller=None):
+    "Prints out a one-line readout with a character's name, health bar, and range to the caller. With no caller - someone watching - the range is left out, and nobody's line is marked as their own."
+    derived = fighter.derived_stats()
+    # The caller's own line doesn't show a range.
+    rangevalue = None
+    if caller and fighter != caller:
+        rangevalue = caller.combat.Range[fighter]
+    return render_status_line(str(fighter), fighter.db.HP, derived["MaxHP"], fighter.db.SP, derived["MaxSP"], rangevalue, fighter == caller)
+
+@memoize(1024)
+def render_status_line(fightername, hp, maxhp, sp, maxsp, rangevalue, own_line):
+    "Builds a status line from its values - see combat_status_line. Lines are cached, so each one is only built once."
+    hbar = health_bar(hp, maxhp, 20)
+    spreadout = ("|255SP: |455%i|255/|455%i|n" % (sp, maxsp))
+    if own_line:
+        beforeformat_name = "> " + fightername
+        rangereadout = ""
+    elif rangevalue is None:
+        beforeformat_name = fightername
         rangereadout = ""
+    else:
+        beforeformat_name = fightername
+        pluralstep = "steps"
+        if rangevalue == 1:
+            pluralstep = "step"
+        rangereadout = ("- |525%s (|545%i|525 %s)" % (range_name(rangevalue), rangevalue, pluralstep))
+        # Let's color the range readout red if they're engaged.
+        if rangevalue == 0:
+            rangereadout = ("- |522%s (|544%i|522 %s)" % (range_name(rangevalue), rangevalue, pluralstep))
     name = "{:>20}".format(beforeformat_name + ":")
     return (name + " " + hbar + " " + spreadout + " " + rangereadout)
     
 def prompt_update(character):
-    "Updates the given character's prompt. Called at the end of every command or when the character takes/heals damage."
+    "Marks the given character's prompt as changed. Called at the end of every command or when the character takes/heals damage."
     if not rules.is_fighter(character):
         return
-    hbar = health_bar(character.db.HP, max(character.db.VIT * 3, 1), 20)
+    # Anything that changes the prompt may have changed HP or SP too.
+    rules.mark_oob_change(character, "stats")
+    if character.ndb.prompt_dirty:
+        return
+    character.ndb.prompt_dirty = True
+    # Send it on the next reactor iteration, so every change made by one command or tick ends up in a single prompt.
+    utils.delay(0, callback=lambda: flush_prompt(character))
+
+def flush_prompt(character):
+    "Sends the character's prompt if it's been marked as changed since it was last sent."
+    if not character.ndb.prompt_dirty:
+        return
+    character.ndb.prompt_dirty = False
+    derived = character.derived_stats()
+    hbar = health_bar(character.db.HP, derived["MaxHP"], 20)
     action = ""
     moves = ""
-    sptotal = "|255SP: |455%i |255/|455 %i|n" % (character.db.SP, character.db.SPE * 2)
+    sptotal = "|255SP: |455%i |255/|455 %i|n" % (character.db.SP, derived["MaxSP"])
     engaged = False
     # Checks to see if there are any fighters engaged with character:
-    if character.db.Combat_TurnHandler and character.db.Combat_Range and character.db.Combat_TurnHandler.db.fighters:
-        for fighter in character.db.Combat_TurnHandler.db.fighters:
-            if fighter != character and character.db.Combat_Range[fighter] == 0:
+    if character.combat.TurnHandler and character.combat.Range and character.combat.TurnHandler.fighters:
+        for fighter in character.combat.TurnHandler.fighters:
+            if fighter != character and character.combat.Range[fighter] == 0:
                 engaged = True
-    if character.db.Combat_Actions:
+    if character.combat.Actions:
         action = "|525[Action Ready]|n "
         if engaged:
         # Colors the 'Action Ready' text red if engaged with anyone.
             action = "|522[Action Ready]|n "
-    if character.db.Combat_Moves:
-        moves = "|552[Moves: |554%i|552]|n" % character.db.Combat_Moves
-    if character.db.Combat_Second:
+    if character.combat.Moves:
+        moves = "|552[Moves: |554%i|552]|n" % character.combat.Moves
+    if character.combat.Second:
         action = "|255[Second Attack Ready] |n"
     promptline = ("%s: %s %s %s%s" % (str(character), hbar, sptotal, action, moves))
     character.msg(prompt=promptline)
@@ -0,0 +1,192 @@
+"""
+Fights
+
+Every fight going on, by id. Each fight gets the next id from a counter
+kept in ServerConfig, so ids are never reused, even across restarts.
+Fights register themselves here whenever their TurnHandler starts - which
+includes after every reload, since persistent scripts are started again -
+so they can be looked up by id, room or fighter without searching the
+Scripts table. Systems that need to know when fights end, like
+tournaments, add a callback with add_end_callback() instead of checking.
+
+Fighters' combat state is only kept in memory (see CombatHandler). At the
+end of every turn, the TurnHandler saves the whole fight as one compact
+snapshot Attribute - fighters by dbref, everything else by their place in
+the fighter list - and restore_fights() puts every fight back from its
+snapshot when the server starts.
+
+"""
+
+from evennia import ObjectDB, ScriptDB
+from evennia.server.models import ServerConfig
+from evennia.typeclasses.attributes import Attribute
+from evennia.utils import logger
+
+# Bump this whenever the layout of fight snapshots changes.
+SNAPSHOT_VERSION = 1
+
+# Fight id to TurnHandler.
+_fights = {}
+# Room dbref to fight id.
+_room_fights = {}
+# Fighter dbref to fight id.
+_fighter_fights = {}
+# Functions to call with the TurnHandler of every fight that ends.
+_end_callbacks = []
+
+def allocate_fight_id():
+    "Returns a new fight id, one higher than the last one handed out."
+    fight_id = (ServerConfig.objects.conf("last_fight_id") or 0) + 1
+    ServerConfig.objects.conf("last_fight_id", fight_id)
+    return fight_id
+
+def register_fight(handler):
+    "Adds a fight and everyone in it to the registry."
+    fight_id = handler.db.fight_id
+    _fights[fight_id] = handler
+    _room_fights[handler.obj.id] = fight_id
+    for fighter in handler.fighters:
+        _fighter_fights[fighter.id] = fight_id
+
+def register_fighter(handler, fighter):
+    "Adds someone who joined a fight partway through to the registry."
+    _fighter_fights[fighter.id] = handler.db.fight_id
+
+def unregister_fight(handler):
+    "Removes a fight that's over from the registry."
+    fight_id = handler.db.fight_id
+    _fights.pop(fight_id, None)
+    if _room_fights.get(handler.obj.id) == fight_id:
+        del _room_fights[handler.obj.id]
+    for fighter in handler.fighters:
+        if _fighter_fights.get(fighter.id) == fight_id:
+            del _fighter_fights[fighter.id]
+
+def add_end_callback(callback):
+    "Has callback(handler) called as soon as any fight ends, with its outcome in handler.ndb.outcome. Adding the same callback twice does nothing."
+    if callback not in _end_callbacks:
+        _end_callbacks.append(callback)
+
+def fight_ended(handler):
+    "Calls every end-of-fight callback. Called once a fight has been cleaned up. A callback that fails is logged, and doesn't stop the rest."
+    for callback in list(_end_callbacks):
+        try:
+            callback(handler)
+        except Exception:
+            logger.log_trace()
+
+def get_fight(fight_id):
+    "Returns the TurnHandler of the fight with the given id, or None."
+    return _fights.get(fight_id)
+
+def room_fight(room):
+    "Returns the TurnHandler of the fight going on in a room, or None."
+    return _fights.get(_room_fights.get(room.id))
+
+def fighter_fight(fighter):
+    "Returns the TurnHandler of the fight a fighter is in, or None."
+    return _fights.get(_fighter_fights.get(fighter.id))
+
+def all_fights():
+    "Returns the TurnHandlers of every fight going on, oldest first."
+    return [_fights[fight_id] for fight_id in sorted(_fights)]
+
+def write_snapshot(attribute_id, snapshot):
+    "Saves a snapshot, already serialized with to_pickle(), straight to its Attribute row, skipping the Attribute cache - TurnHandler.save_snapshot() keeps that up to date itself. Run on the background writer's thread."
+    Attribute.objects.filter(id=attribute_id).update(db_value=snapshot)
+
+def snapshot_fight(handler):
+    "Returns a compact snapshot of a fight, with fighters as dbrefs and every reference to one as their place in the fighter list."
+    fighters = handler.fighters
+    slots = dict((fighter, slot) for slot, fighter in enumerate(fighters))
+    ranges = []
+    states = []
+    for fighter in fighters:
+        fighterrange = fighter.combat.Range or {}
+        ranges.append([fighterrange.get(other) for other in fighters])
+        state = fighter.combat.all()
+        # The turn handler and ranges are filled back in separately.
+        state.pop("TurnHandler", None)
+        state.pop("Range", None)
+        states.append(dict((key, pack_state(key, value, slots)) for key, value in state.items()))
+    return {"version":SNAPSHOT_VERSION,
+            "fighters":[fighter.id for fighter in fighters],
+            "turn":handler.db.turn,
+            "timer":handler.ndb.timer,
+            "turns":handler.ndb.turns or 0,
+            "ranges":ranges,
+            "states":states}
+
+def pack_state(key, value, slots):
+    "Swaps the fighters in a piece of combat state for their place in the fighter list."
+    if key == "Conditions":
+        return dict((condition, [value[condition][0], slots.get(value[condition][1])]) for condition in value)
+    if key == "IncomingAttack":
+        return (value[0], slots.get(value[1])) + tuple(value[2:])
+    if key == "AreaTargets":
+        return dict((slots.get(target), value[target]) for target in value)
+    return value
+
+def unpack_state(key, value, fighters):
+    "Swaps places in the fighter list back for the fighters themselves."
+    if key == "Conditions":
+        return dict((condition, [value[condition][0], fighters[value[condition][1]]]) for condition in value)
+    if key == "IncomingAttack":
+        return (value[0], fighters[value[1]]) + tuple(value[2:])
+    if key == "AreaTargets":
+        return dict((fighters[slot], value[slot]) for slot in value)
+    return value
+
+def plain(value):
+    "Turns the auto-saving dicts and lists an Attribute hands back into ordinary ones, so changing them doesn't write to the database."
+    if hasattr(value, "items"):
+        return dict((plain(key), plain(item)) for key, item in value.items())
+    if isinstance(value, tuple):
+        return tuple(plain(item) for item in value)
+    if hasattr(value, "__iter__") and not isinstance(value, basestring):
+        return [plain(item) for item in value]
+    return value
+
+def resolve_fighters(dbrefs):
+    "Turns a list of dbrefs back into fighters. Any already in memory come from the cache, and the rest are fetched in one query."
+    fighters = [ObjectDB.get_cached_instance(dbref) for dbref in dbrefs]
+    missing = [dbref for dbref, fighter in zip(dbrefs, fighters) if fighter is None]
+    if missing:
+        fetched = dict((obj.id, obj) for obj in ObjectDB.objects.filter(id__in=missing))
+        fighters = [fighter or fetched.get(dbref) for dbref, fighter in zip(dbrefs, fighters)]
+    return fighters
+
+def restore_fight(handler):
+    "Puts a fight's combat state back in memory from its snapshot. Returns False if there's no snapshot it can use."
+    snapshot = plain(handler.attributes.get("snapshot"))
+    if not snapshot or snapshot.get("version") != SNAPSHOT_VERSION:
+        return False
+    fighters = resolve_fighters(snapshot["fighters"])
+    if None in fighters:
+        return False
+    handler.ndb.fighters = fighters
+    for fighter, ranges, state in zip(fighters, snapshot["ranges"], snapshot["states"]):
+        fighter.combat.clear()
+        fighter.combat.TurnHandler = handler
+        fighter.combat.Range = dict((other, distance) for other, distance in zip(fighters, ranges) if distance is not None)
+        for key, value in state.items():
+            setattr(fighter.combat, key, unpack_state(key, value, fighters))
+    if handler.db.turn != snapshot["turn"]:
+        handler.db.turn = snapshot["turn"]
+    handler.ndb.timer = snapshot["timer"]
+    handler.ndb.turns = snapshot.get("turns", 0)
+    return True
+
+def restore_fights():
+    "Puts every fight back from its snapshot in one pass. Called every time the server starts or reloads."
+    handlers = list(ScriptDB.objects.filter(db_typeclass_path__endswith="TurnHandler"))
+    # Fetch every fighter in every fight with one query, so the restores below find them all in the cache.
+    dbrefs = set()
+    for handler in handlers:
+        snapshot = handler.attributes.get("snapshot")
+        if snapshot:
+            dbrefs.update(snapshot["fighters"])
+    list(ObjectDB.objects.filter(id__in=dbrefs))
+    for handler in handlers:
+        if not handler.ndb.restored:
+            handler.restore()
@@ -0,0 +1,82 @@
+"""
+Match history
+
+Every finished fight is saved to the FightRecord and FightParticipant
+tables (see world/models.py) - who fought, who won, how long it took,
+and how much damage and how many special moves each fighter dealt out.
+The whole fight is saved at once by the background writer when it ends.
+The tables belong to the world app, so "world" has to be in
+INSTALLED_APPS, and 'evennia migrate' run, for anything to be recorded.
+Until then, fights just aren't saved.
+
+A fighter's history is read a page at a time, newest first, using the
+(ended, id) of the last row on the previous page as the starting point
+for the next, so every page is a short index range scan no matter how
+far back it goes.
+
+"""
+
+import metrics
+import writer
+from django.apps import apps
+from django.db.models import Q
+from django.utils import timezone
+
+# Whether the world app, with the match history tables, is installed.
+HISTORY_INSTALLED = apps.is_installed("world")
+if HISTORY_INSTALLED:
+    from world.models import FightRecord, FightParticipant
+
+def record_fight(handler):
+    "Queues a finished fight to be saved to the match history. Called as the fight ends, before its combat state is cleared."
+    fighters = handler.fighters
+    if not fighters or not HISTORY_INSTALLED:
+        return
+    outcome, winner = handler.ndb.outcome or ("stopped", None)
+    fight = {"fight_id":handler.db.fight_id,
+             "room":str(handler.obj),
+             "started":handler.date_created,
+             "ended":timezone.now(),
+             "turns":handler.ndb.turns or 0,
+             "outcome":outcome,
+             "winner_id":winner.id if winner else None}
+    participants = []
+    for fighter in fighters:
+        participants.append({"fighter_id":fighter.id,
+                             "name":fighter.key,
+                             "won":fighter == winner,
+                             "defeated":not fighter.db.HP,
+                             "damage_dealt":fighter.combat.DamageDealt or 0,
+                             "specials_used":fighter.combat.SpecialsUsed or 0})
+    writer.enqueue(save_fight, (fight, participants))
+    metrics.incr("history.fights_recorded")
+
+def save_fight(fight, participants):
+    "Saves a fight and everyone in it, with one insert for the fight and one for all the participants. Run on the background writer's thread."
+    record = FightRecord.objects.create(**dict(("db_" + key, value) for key, value in fight.items()))
+    rows = []
+    for participant in participants:
+        fields = dict(("db_" + key, value) for key, value in participant.items())
+        rows.append(FightParticipant(db_record=record, db_ended=record.db_ended, **fields))
+    FightParticipant.objects.bulk_create(rows)
+
+def fight_history(fighter_id, before=None, limit=10):
+    """
+    Returns a page of a fighter's fights, newest first, as a list of
+    (participant, record, opponent names) tuples. Before is the
+    (ended, id) of the last participant on the previous page, or None
+    for the first page.
+    """
+    if not HISTORY_INSTALLED:
+        return []
+    rows = FightParticipant.objects.filter(db_fighter_id=fighter_id)
+    if before:
+        ended, row_id = before
+        rows = rows.filter(Q(db_ended__lt=ended) | Q(db_ended=ended, id__lt=row_id))
+    rows = list(rows.select_related("db_record").order_by("-db_ended", "-id")[:limit])
+    # Get everyone else in those fights in one query.
+    opponents = {}
+    others = FightParticipant.objects.filter(db_record__in=[row.db_record_id for row in rows]).exclude(db_fighter_id=fighter_id)
+    for record_id, name in others.values_list("db_record_id", "db_name"):
+        opponents.setdefault(record_id, []).append(name)
+    return [(row, row.db_record, opponents.get(row.db_record_id, [])) for row in rows]
@@ -0,0 +1,57 @@
+"""
+Landmarks
+
+Well-known rooms that commands send characters to, like the recovery
+bay. Each landmark room is tagged with its landmark name, looked up when
+the server starts and its dbref kept in memory, so commands can get the
+room straight away instead of searching every object by name. A
+landmark that couldn't be found is remembered as missing until the
+next reload, rather than searched for again every time it's asked for.
+
+"""
+
+from evennia import ObjectDB, search_object, search_tag
+
+# Landmark names and the keys of the rooms they refer to.
+LANDMARKS = {"recovery_bay":"The Institute's Recovery Bay",
+             "central_hub":"The Institute of Battle's Central Hub"}
+# Tag category the landmark tags are stored under.
+LANDMARK_CATEGORY = "landmark"
+
+# Landmark name to room dbref, or _MISSING if there's no such room, filled in by refresh_landmarks().
+_landmark_dbrefs = {}
+# Stands in for the dbref of a landmark that was searched for and not found.
+_MISSING = -1
+
+def refresh_landmarks():
+    "Looks up every landmark room and caches its dbref. Called every time the server starts or reloads."
+    _landmark_dbrefs.clear()
+    for name in LANDMARKS:
+        room = find_landmark(name)
+        _landmark_dbrefs[name] = room.id if room else _MISSING
+
+def find_landmark(name):
+    "Searches the database for a landmark room. Rooms found by their key are tagged so the next search is by tag."
+    rooms = search_tag(name, category=LANDMARK_CATEGORY)
+    if rooms:
+        return rooms[0]
+    rooms = search_object(LANDMARKS[name], exact=True)
+    if rooms:
+        rooms[0].tags.add(name, category=LANDMARK_CATEGORY)
+        return rooms[0]
+    return None
+
+def get_landmark(name):
+    "Returns the landmark room with the given name, or None if there isn't one."
+    dbref = _landmark_dbrefs.get(name)
+    if dbref == _MISSING:
+        return None
+    if dbref is not None:
+        # Looking an object up by id is answered from the idmapper cache.
+        room = ObjectDB.objects.get_id(dbref)
+        if room:
+            return room
+    # Never looked up, or the room has since been deleted - look again, once.
+    room = find_landmark(name)
+    _landmark_dbrefs[name] = room.id if room else _MISSING
+    return room
@@ -0,0 +1,267 @@
+"""
+Matchmaking
+
+The 'queue' command puts a fighter in line for a quick duel against
+someone close to them in both rating and stats. Fighters are sorted
+into buckets by stat tier - how far their build leans towards attack
+(ATM + ATR) or towards lasting (DEF + VIT), in bands of MATCH_STAT_BAND.
+Stat totals are capped, so nearly every finished character has the
+same total, but how they've spent it varies a lot. Each bucket is a list of (rating, dbref) kept
+sorted as fighters join and leave, so the nearest rated fighter in the
+same tier is always right next to you in it, and finding them is a
+binary search.
+
+Each fighter accepts opponents within a rating window that starts at
+MATCH_WINDOW_START and widens by MATCH_WINDOW_GROWTH every second they
+wait, up to MATCH_WINDOW_MAX. Two fighters are matched if they're within
+the window of whichever of them has waited longest. A fighter is matched
+straight away on joining if someone suitable is already waiting, and the
+whole queue is swept every MATCH_INTERVAL seconds for pairs whose
+windows have since widened enough. Once a fighter's window is as wide as
+it gets, the next stat tier up or down is checked as well.
+
+Matched pairs are moved into an arena from the arena pool and their
+fight started. If no arena is free, they wait for the next fight to end.
+A fighter who leaves while they're waiting calls the match off, and
+their opponent goes back in the queue. The queue is only kept in
+memory, so it empties when the server reloads.
+
+"""
+
+import time
+import metrics
+import arenas
+import fights
+import ratings
+import tournaments
+from bisect import bisect_left, insort
+from collections import deque
+from django.conf import settings
+from evennia import utils, ObjectDB
+from evennia.utils import logger
+
+# Rating difference accepted as soon as a fighter joins the queue.
+MATCH_WINDOW_START = getattr(settings, "MATCH_WINDOW_START", 50)
+# How much the rating window widens for every second spent waiting.
+MATCH_WINDOW_GROWTH = getattr(settings, "MATCH_WINDOW_GROWTH", 5)
+# The widest the rating window gets.
+MATCH_WINDOW_MAX = getattr(settings, "MATCH_WINDOW_MAX", 400)
+# Width of each stat tier, in points of attack stats over defense stats.
+MATCH_STAT_BAND = getattr(settings, "MATCH_STAT_BAND", 3)
+# Seconds between sweeps of the queue, while anyone's in it.
+MATCH_INTERVAL = getattr(settings, "MATCH_INTERVAL", 2)
+# What matchmaking marks the arenas it checks out with.
+ARENA_PURPOSE = "duel"
+
+# Fighter dbref to (stat tier, rating, time they joined).
+_queued = {}
+# Stat tier to a sorted list of (rating, fighter dbref).
+_buckets = {}
+# Matched pairs waiting for an arena, as (first dbref, second dbref, time matched).
+_pending = deque()
+# Dbrefs of every fighter in a pair in _pending.
+_matched = set()
+# Whether a sweep is scheduled.
+_state = {"scheduled":False}
+
+def start_matchmaking():
+    "Hooks matchmaking up to the end of every fight, and frees any duel arenas whose fight didn't survive a restart. Called every time the server starts or reloads, after fights are restored."
+    fights.add_end_callback(fight_ended)
+    arenas.release_abandoned(ARENA_PURPOSE)
+
+def stat_tier(character):
+    "Returns which stat tier a fighter is in - their attack stats less their defense stats, in bands. Neighbouring tiers are the most alike."
+    sheet = character.sheet
+    return (sheet.ATM + sheet.ATR - sheet.DEF - sheet.VIT) // MATCH_STAT_BAND
+
+def window(fighter_id, now):
+    "Returns the rating difference a queued fighter will currently accept."
+    waited = now - _queued[fighter_id][2]
+    return min(MATCH_WINDOW_MAX, MATCH_WINDOW_START + MATCH_WINDOW_GROWTH * waited)
+
+def is_queued(character):
+    "Returns whether a fighter is in the queue, or has been matched and is waiting for an arena."
+    return character.id in _queued or character.id in _matched
+
+def is_matched(character):
+    "Returns whether a fighter has been matched and is waiting for an arena."
+    return character.id in _matched
+
+def queue_status(character):
+    "Returns (seconds waited, rating window, fighters in the queue) for a queued fighter."
+    now = time.time()
+    return now - _queued[character.id][2], window(character.id, now), len(_queued)
+
+def can_queue(character):
+    "Returns None if a fighter can join the queue, or the reason they can't."
+    if is_queued(character):
+        return "You're already in the queue!"
+    return unavailable(character)
+
+def unavailable(character):
+    "Returns None if a fighter is free to start a duel, or the reason they aren't."
+    if character.combat.TurnHandler:
+        return "You can't queue for a match while you're in a fight!"
+    if tournaments.entrant_tournament(character):
+        return "You can't queue for a match while you're in a tournament!"
+    if character.location and character.location.is_typeclass("rooms.ChargenRoom"):
+        return "You can't do that until you've entered the game!"
+    return None
+
+def join_queue(character):
+    "Adds a fighter to the queue, and matches them right away if there's someone suitable."
+    tier, rating = stat_tier(character), ratings.rating(character.id)
+    _queued[character.id] = (tier, rating, time.time())
+    insort(_buckets.setdefault(tier, []), (rating, character.id))
+    metrics.gauge("matchmaking.queued", len(_queued))
+    opponent = nearest_opponent(character.id, tier, time.time())
+    if opponent is not None:
+        make_match(character.id, opponent)
+        start_pending()
+    schedule_sweep()
+
+def leave_queue(character_id):
+    "Takes a fighter out of the queue, calling off their match if they've been matched. Returns whether they were in it."
+    if character_id in _matched:
+        cancel_match(character_id)
+        return True
+    return remove_from_queue(character_id)
+
+def remove_from_queue(character_id):
+    "Takes a fighter out of the queue's buckets. Returns whether they were in them."
+    entry = _queued.pop(character_id, None)
+    if not entry:
+        return False
+    bucket = _buckets[entry[0]]
+    del bucket[bisect_left(bucket, (entry[1], character_id))]
+    if not bucket:
+        del _buckets[entry[0]]
+    metrics.gauge("matchmaking.queued", len(_queued))
+    return True
+
+def acceptable(first, second, now):
+    "Returns whether two queued fighters are close enough in rating to be matched."
+    difference = abs(_queued[first][1] - _queued[second][1])
+    return difference <= max(window(first, now), window(second, now))
+
+def nearest_opponent(fighter_id, tier, now):
+    "Returns the dbref of the closest rated fighter in a stat tier who'd be an acceptable match for a queued fighter, or None."
+    bucket = _buckets.get(tier)
+    if not bucket:
+        return None
+    rating = _queued[fighter_id][1]
+    position = bisect_left(bucket, (rating, fighter_id))
+    best = None
+    # The closest ratings either side are the only ones worth looking at.
+    for index in (position - 1, position, position + 1):
+        if index < 0 or index >= len(bucket) or bucket[index][1] == fighter_id:
+            continue
+        other = bucket[index][1]
+        if acceptable(fighter_id, other, now) and (best is None or abs(bucket[index][0] - rating) < abs(_queued[best][1] - rating)):
+            best = other
+    return best
+
+def schedule_sweep():
+    "Sweeps the queue shortly, unless a sweep's already on its way or nobody's waiting."
+    if _state["scheduled"] or len(_queued) < 2:
+        return
+    _state["scheduled"] = True
+    utils.delay(MATCH_INTERVAL, callback=sweep)
+
+def sweep():
+    "Matches everyone in the queue whose rating windows have widened enough to take each other."
+    _state["scheduled"] = False
+    start = time.time()
+    now = start
+    for tier in sorted(_buckets):
+        bucket = _buckets.get(tier, [])
+        # Neighbours in a bucket are the closest ratings, so only they need comparing.
+        pairs, index = [], 0
+        while index < len(bucket) - 1:
+            first, second = bucket[index][1], bucket[index + 1][1]
+            if acceptable(first, second, now):
+                pairs.append((first, second))
+                index += 2
+            else:
+                index += 1
+        for first, second in pairs:
+            make_match(first, second)
+    # Anyone who's waited long enough to take any rating is tried against the tiers either side of theirs.
+    for fighter_id in [pid for pid in _queued if window(pid, now) >= MATCH_WINDOW_MAX]:
+        if fighter_id not in _queued:
+            continue
+        tier = _queued[fighter_id][0]
+        for other_tier in (tier - 1, tier + 1):
+            opponent = nearest_opponent(fighter_id, other_tier, now)
+            if opponent is not None:
+                make_match(fighter_id, opponent)
+                break
+    metrics.timing("matchmaking.sweep", time.time() - start)
+    start_pending()
+    schedule_sweep()
+
+def make_match(first, second):
+    "Takes a matched pair out of the queue, to start their fight as soon as there's an arena."
+    now = time.time()
+    for fighter_id in (first, second):
+        metrics.timing("matchmaking.queue_wait", now - _queued[fighter_id][2])
+        remove_from_queue(fighter_id)
+    _pending.append((first, second, now))
+    _matched.update((first, second))
+    metrics.incr("matchmaking.matches")
+    metrics.gauge("matchmaking.pending", len(_pending))
+
+def pop_pending(pair):
+    "Takes a matched pair off the list waiting for an arena."
+    _pending.remove(pair)
+    _matched.difference_update(pair[:2])
+    metrics.gauge("matchmaking.pending", len(_pending))
+
+def cancel_match(character_id):
+    "Calls off the match of a fighter who's waiting for an arena, and puts their opponent back in the queue."
+    pair = next(pair for pair in _pending if character_id in pair[:2])
+    pop_pending(pair)
+    partner = ObjectDB.objects.get_id(pair[1] if pair[0] == character_id else pair[0])
+    if partner and partner.has_player and not unavailable(partner):
+        partner.msg("Your opponent has left the queue. You're back in it.")
+        join_queue(partner)
+
+def start_pending():
+    "Starts the fights of matched pairs, for as long as there are arenas free."
+    requeue = []
+    while _pending:
+        pair = _pending[0]
+        fighters = [ObjectDB.objects.get_id(pair[0]), ObjectDB.objects.get_id(pair[1])]
+        # Anyone who's logged off, or gotten into another fight, since they were matched is dropped.
+        ready = [fighter for fighter in fighters if fighter and fighter.has_player and not unavailable(fighter)]
+        if len(ready) < 2:
+            pop_pending(pair)
+            requeue.extend(ready)
+            continue
+        arena = arenas.check_out(purpose=ARENA_PURPOSE)
+        if not arena:
+            break
+        pop_pending(pair)
+        first, second = ready
+        first.msg("|445Match found! You're fighting %s.|n" % second)
+        second.msg("|445Match found! You're fighting %s.|n" % first)
+        if not arenas.start_match(arena, ready):
+            # Not put back in the queue, or they'd only be matched with each other again.
+            logger.log_err("Matchmaking: couldn't start %s vs %s in %s." % (first, second, arena))
+            arenas.check_in(arena)
+            for fighter in ready:
+                fighter.msg("Your match couldn't be started after all. Use 'queue' to try again.")
+            continue
+        metrics.timing("matchmaking.match_latency", time.time() - pair[2])
+    # Back in the queue only once the pairs above are dealt with, since joining can start more matches.
+    for fighter in requeue:
+        fighter.msg("Your opponent is no longer available. You're back in the queue.")
+        join_queue(fighter)
+
+def fight_ended(handler):
+    "Called by the fights registry as soon as any fight ends. Duel arenas are handed back, and matched pairs waiting for one are started."
+    room = handler.obj
+    if room.db.ArenaInUse == ARENA_PURPOSE:
+        arenas.check_in(room)
+    if _pending:
+        start_pending()
@@ -0,0 +1,45 @@
+"""
+Metrics
+
+Simple in-memory counters, gauges and timings for keeping an eye on how
+the game's systems are doing, shown with the '@metrics' command. Nothing
+is saved - they all start over whenever the server does.
+
+"""
+
+# Counter name to count.
+_counters = {}
+# Gauge name to latest value.
+_gauges = {}
+# Timing name to [count, total seconds, longest seconds].
+_timings = {}
+
+def incr(name, amount=1):
+    "Adds to a counter."
+    _counters[name] = _counters.get(name, 0) + amount
+
+def gauge(name, value):
+    "Sets a gauge to its current value."
+    _gauges[name] = value
+
+def timing(name, seconds):
+    "Records how long something took, keeping the count, total and longest time."
+    timing = _timings.get(name)
+    if timing is None:
+        _timings[name] = [1, seconds, seconds]
+        return
+    timing[0] += 1
+    timing[1] += seconds
+    timing[2] = max(timing[2], seconds)
+
+def report():
+    "Returns every metric as a list of lines, sorted by name."
+    lines = []
+    for name in sorted(_counters):
+        lines.append("%s: %i" % (name, _counters[name]))
+    for name in sorted(_gauges):
+        lines.append("%s: %s" % (name, _gauges[name]))
+    for name in sorted(_timings):
+        count, total, longest = _timings[name]
+        lines.append("%s: %i, avg %.1fms, max %.1fms" % (name, count, total / count * 1000, longest * 1000))
+    return lines
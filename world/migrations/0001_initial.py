@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FightRecord',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('db_fight_id', models.PositiveIntegerField(unique=True)),
+                ('db_room', models.CharField(max_length=255)),
+                ('db_started', models.DateTimeField()),
+                ('db_ended', models.DateTimeField(db_index=True)),
+                ('db_turns', models.PositiveIntegerField(default=0)),
+                ('db_outcome', models.CharField(max_length=16)),
+                ('db_winner_id', models.IntegerField(null=True, blank=True)),
+            ],
+            options={
+                'verbose_name': 'Fight Record',
+            },
+        ),
+        migrations.CreateModel(
+            name='FightParticipant',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('db_fighter_id', models.IntegerField()),
+                ('db_name', models.CharField(max_length=255)),
+                ('db_ended', models.DateTimeField()),
+                ('db_won', models.BooleanField(default=False)),
+                ('db_defeated', models.BooleanField(default=False)),
+                ('db_damage_dealt', models.PositiveIntegerField(default=0)),
+                ('db_specials_used', models.PositiveIntegerField(default=0)),
+                ('db_record', models.ForeignKey(related_name='participants', to='world.FightRecord', on_delete=django.db.models.deletion.CASCADE)),
+            ],
+            options={
+                'verbose_name': 'Fight Participant',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='fightparticipant',
+            index_together=set([('db_fighter_id', 'db_ended', 'id')]),
+        ),
+    ]
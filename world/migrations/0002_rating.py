@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('world', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Rating',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('db_fighter_id', models.IntegerField(unique=True)),
+                ('db_name', models.CharField(max_length=255)),
+                ('db_rating', models.FloatField()),
+                ('db_games', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Rating',
+            },
+        ),
+    ]
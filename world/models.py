@@ -0,0 +1,66 @@
+"""
+Models
+
+Database tables for the game's own data. For these to be created,
+"world" has to be in INSTALLED_APPS in server/conf/settings.py, and
+'evennia migrate' has to be run after adding it.
+
+"""
+
+from django.db import models
+
+
+class FightRecord(models.Model):
+    """
+    The result of one finished fight. Who was in it, and how each of
+    them did, is in FightParticipant.
+    """
+    # The fight's id from world/fights.py.
+    db_fight_id = models.PositiveIntegerField(unique=True)
+    db_room = models.CharField(max_length=255)
+    db_started = models.DateTimeField()
+    db_ended = models.DateTimeField(db_index=True)
+    db_turns = models.PositiveIntegerField(default=0)
+    # How the fight ended - "victory", "disengage" or "stopped".
+    db_outcome = models.CharField(max_length=16)
+    db_winner_id = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Fight Record"
+
+
+class FightParticipant(models.Model):
+    """
+    One fighter's part in a finished fight. The fight's end time is
+    copied here so a fighter's history can be paged through, newest
+    first, straight off the (fighter, ended, id) index.
+    """
+    db_record = models.ForeignKey(FightRecord, related_name="participants", on_delete=models.CASCADE)
+    # Fighters are kept by dbref and name, so their history outlives them.
+    db_fighter_id = models.IntegerField()
+    db_name = models.CharField(max_length=255)
+    db_ended = models.DateTimeField()
+    db_won = models.BooleanField(default=False)
+    db_defeated = models.BooleanField(default=False)
+    db_damage_dealt = models.PositiveIntegerField(default=0)
+    db_specials_used = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Fight Participant"
+        index_together = [("db_fighter_id", "db_ended", "id")]
+
+
+class Rating(models.Model):
+    """
+    A fighter's saved rating. The ratings in play, and the leaderboard,
+    are kept in memory by world/ratings.py - this table is only read
+    when the server starts.
+    """
+    db_fighter_id = models.IntegerField(unique=True)
+    db_name = models.CharField(max_length=255)
+    db_rating = models.FloatField()
+    # How many rated fights the fighter has had.
+    db_games = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Rating"
@@ -4,30 +4,34 @@ import rules
 
 def distance_dec(mover, target):
     "Decreases distance between two characters."
-    mover.db.Combat_Range[target] -= 1
-    target.db.Combat_Range[mover] -= 1
+    rules.mark_oob_change(mover, "ranges")
+    rules.mark_oob_change(target, "ranges")
+    mover.combat.Range[target] -= 1
+    target.combat.Range[mover] -= 1
     # If this brings them range 0 (Engaged):
-    if mover.db.Combat_Range[target] <= 0:
+    if mover.combat.Range[target] <= 0:
         # Reset range to each other to 0 and copy target's ranges to mover.
-        target.db.Combat_Range[mover] = 0
-        mover.db.Combat_Range = target.db.Combat_Range
+        target.combat.Range[mover] = 0
+        mover.combat.Range = target.combat.Range
         # Copy mover's new range to all others in combat, just in case.
-        for fighter in mover.db.Combat_TurnHandler.db.fighters:
+        for fighter in mover.combat.TurnHandler.fighters:
             if fighter != mover and fighter != target:
-                fighter.db.Combat_Range[mover] = mover.db.Combat_Range[fighter]
+                fighter.combat.Range[mover] = mover.combat.Range[fighter]
 
 def distance_inc(mover, target):
     "Increases distance between two characters."
-    mover.db.Combat_Range[target] += 1
-    target.db.Combat_Range[mover] += 1
+    rules.mark_oob_change(mover, "ranges")
+    rules.mark_oob_change(target, "ranges")
+    mover.combat.Range[target] += 1
+    target.combat.Range[mover] += 1
     # Set a cap of the room size:
-    if mover.db.Combat_Range[target] > mover.location.db.RoomSize:
-        target.db.Combat_Range[mover] = mover.location.db.RoomSize
-        mover.db.Combat_Range[target] = mover.location.db.RoomSize
+    if mover.combat.Range[target] > mover.location.db.RoomSize:
+        target.combat.Range[mover] = mover.location.db.RoomSize
+        mover.combat.Range[target] = mover.location.db.RoomSize
     # Copy mover's new range to all others in combat, just in case.
-        for fighter in mover.db.Combat_TurnHandler.db.fighters:
+        for fighter in mover.combat.TurnHandler.fighters:
             if fighter != mover and fighter != target:
-                fighter.db.Combat_Range[mover] = mover.db.Combat_Range[fighter]
+                fighter.combat.Range[mover] = mover.combat.Range[fighter]
 
 def ms_approach(mover, target, distance, mode):
     # Performs multiple approach steps and spits out the result.
@@ -55,19 +59,19 @@ def ms_approach(mover, target, distance, mode):
         pluralblock = "step"
     else:
         pluralblock = "steps"
-    newrange = mover.db.Combat_Range[target]
+    newrange = mover.combat.Range[target]
     stringofblockers = utils.list_to_string(blockers, endsep="and", addquote=False)
     if mode == "normal":
         if moves > 0 and blocks == 0:
-            mover.location.msg_contents("%s approaches to %s range with %s! |552[|554%i|552 %s]|n" % (mover, rules.range_name(newrange).lower(), target, moves, pluralmove))
+            rules.room_msg(mover.location, "%s approaches to %s range with %s! |552[|554%i|552 %s]|n" % (mover, rules.range_name(newrange).lower(), target, moves, pluralmove))
         elif moves > 0 and blocks > 0:
-            mover.location.msg_contents("%s has some movement blocked by %s, but approaches to %s range with %s! |552[|554%i|552 %s, |554%i|552 blocked]|n" % (mover, stringofblockers, rules.range_name(newrange).lower(), target, moves, pluralmove, blocks))
+            rules.room_msg(mover.location, "%s has some movement blocked by %s, but approaches to %s range with %s! |552[|554%i|552 %s, |554%i|552 blocked]|n" % (mover, stringofblockers, rules.range_name(newrange).lower(), target, moves, pluralmove, blocks))
         elif moves == 0 and blocks > 0:
-            mover.location.msg_contents("%s tries to approach %s, but is blocked by %s! |552[|554%i|552 %s blocked]|n" % (mover, target, stringofblockers, blocks, pluralblock))
+            rules.room_msg(mover.location, "%s tries to approach %s, but is blocked by %s! |552[|554%i|552 %s blocked]|n" % (mover, target, stringofblockers, blocks, pluralblock))
     elif mode == "forced":
-        mover.location.msg_contents("%s is pulled in to %s range with %s! |552[Forced |554%i|552 %s]|n" % (mover, rules.range_name(newrange).lower(), target, moves, pluralmove))
+        rules.room_msg(mover.location, "%s is pulled in to %s range with %s! |552[Forced |554%i|552 %s]|n" % (mover, rules.range_name(newrange).lower(), target, moves, pluralmove))
     elif mode == "free":
-        mover.location.msg_contents("%s approaches to %s range with %s! |552[Free |554%i|552 %s]|n" % (mover, rules.range_name(newrange).lower(), target, moves, pluralmove))
+        rules.room_msg(mover.location, "%s approaches to %s range with %s! |552[Free |554%i|552 %s]|n" % (mover, rules.range_name(newrange).lower(), target, moves, pluralmove))
 
 def ms_withdraw(mover, target, distance, mode):
     # Performs multiple withdraw steps and spits out the result.
@@ -95,84 +99,84 @@ def ms_withdraw(mover, target, distance, mode):
         pluralblock = "step"
     else:
         pluralblock = "steps"
-    newrange = mover.db.Combat_Range[target]
+    newrange = mover.combat.Range[target]
     stringofblockers = utils.list_to_string(blockers, endsep="and", addquote=False)
     if mode == "normal":
         if moves > 0 and blocks == 0:
-            mover.location.msg_contents("%s withdraws to %s range with %s! |552[|554%i|552 %s]|n" % (mover, rules.range_name(newrange).lower(), target, moves, pluralmove))
+            rules.room_msg(mover.location, "%s withdraws to %s range with %s! |552[|554%i|552 %s]|n" % (mover, rules.range_name(newrange).lower(), target, moves, pluralmove))
         elif moves > 0 and blocks > 0:
-            mover.location.msg_contents("%s has some movement blocked by %s, but withdraws to %s range with %s! |552[|554%i|552 %s, |554%i|552 blocked]|n" % (mover, stringofblockers, rules.range_name(newrange).lower(), target, moves, pluralmove, blocks))
+            rules.room_msg(mover.location, "%s has some movement blocked by %s, but withdraws to %s range with %s! |552[|554%i|552 %s, |554%i|552 blocked]|n" % (mover, stringofblockers, rules.range_name(newrange).lower(), target, moves, pluralmove, blocks))
         elif moves == 0 and blocks > 0:
-            mover.location.msg_contents("%s tries to withdraw from %s, but is blocked by %s! |552[|554%i|552 %s blocked]|n" % (mover, target, stringofblockers, blocks, pluralblock))
+            rules.room_msg(mover.location, "%s tries to withdraw from %s, but is blocked by %s! |552[|554%i|552 %s blocked]|n" % (mover, target, stringofblockers, blocks, pluralblock))
     elif mode == "forced":
-        mover.location.msg_contents("%s is pushed back to %s range with %s! |552[Forced |554%i|552 %s]|n" % (mover, rules.range_name(newrange).lower(), target, moves, pluralmove))
+        rules.room_msg(mover.location, "%s is pushed back to %s range with %s! |552[Forced |554%i|552 %s]|n" % (mover, rules.range_name(newrange).lower(), target, moves, pluralmove))
     elif mode == "free":
-        mover.location.msg_contents("%s withdraws to %s range with %s! |552[Free |554%i|552 %s]|n" % (mover, rules.range_name(newrange).lower(), target, moves, pluralmove))
+        rules.room_msg(mover.location, "%s withdraws to %s range with %s! |552[Free |554%i|552 %s]|n" % (mover, rules.range_name(newrange).lower(), target, moves, pluralmove))
 
 def approach(mover, target, mode):
     "Manages a character's whole approach, including changes in ranges to other characters."
-    fighters = mover.db.Combat_TurnHandler.db.fighters
+    fighters = mover.combat.TurnHandler.fighters
     # Before anything happens, 'stop' when reaching range 0 or when running out of moves.
-    if mover.db.Combat_Range[target] == 0 or mover.db.Combat_Moves <= 0:
+    if mover.combat.Range[target] == 0 or mover.combat.Moves <= 0:
         if mode == "normal":
             return ["stop"]
     # Then test for other characters blocking movement.
     for character in fighters:
-        if character != mover and character != target and mover.db.Combat_Range[character] == 0 and mode == "normal":
+        if character != mover and character != target and mover.combat.Range[character] == 0 and mode == "normal":
             if move_block_test(mover, character):
-                mover.db.Combat_Moves -= 1
+                mover.combat.Moves -= 1
                 return ["block", character]
     # First, move closer to each character closer to the target than you.
     for character in fighters:
         if character != mover and character != target:
-            if mover.db.Combat_Range[character] > target.db.Combat_Range[character]:
+            if mover.combat.Range[character] > target.combat.Range[character]:
                 distance_dec(mover, character)
     # Then, move further from each character further from you than the target.
     for character in fighters:
         if character != mover and character != target:
-            if mover.db.Combat_Range[character] < target.db.Combat_Range[character]:
+            if mover.combat.Range[character] < target.combat.Range[character]:
                 distance_inc(mover, character)
     # Lastly, move closer to your target and give the combat message.
     distance_dec(mover, target)
-    newrange = mover.db.Combat_Range[target]
+    newrange = mover.combat.Range[target]
     if mode == "normal":
-        mover.db.Combat_Moves -= 1
+        mover.combat.Moves -= 1
     return ["move"]
 
 def withdraw(mover, target, mode):
     "Manages a character's whole withdrawal, including changes in ranges to other characters."
-    fighters = mover.db.Combat_TurnHandler.db.fighters
+    fighters = mover.combat.TurnHandler.fighters
     # Before anything happens, 'stop' when reaching the room's max range.
-    if mover.db.Combat_Range[target] >= mover.location.db.RoomSize:
+    if mover.combat.Range[target] >= mover.location.db.RoomSize:
         return ["stop"]
     # If the movement mode is normal, return 'stop' when running out of moves.
-    if mover.db.Combat_Moves <= 0 and mode == "normal":
+    if mover.combat.Moves <= 0 and mode == "normal":
         return ["stop"]
     # Then, test for other characters blocking movement.
     for character in fighters:
-        if character != mover and mover.db.Combat_Range[character] == 0 and mode == "normal":
+        if character != mover and mover.combat.Range[character] == 0 and mode == "normal":
             if move_block_test(mover, character):
-                mover.db.Combat_Moves -= 1
+                mover.combat.Moves -= 1
                 return ["block", character]
     # Move away from each character closer to the target than you, if they're also closer to you than you are to the target.
     for character in fighters:
         if character != mover and character != target:
-            if mover.db.Combat_Range[character] >= target.db.Combat_Range[character] and mover.db.Combat_Range[character] < mover.db.Combat_Range[target]:
+            if mover.combat.Range[character] >= target.combat.Range[character] and mover.combat.Range[character] < mover.combat.Range[target]:
                 distance_inc(mover, character)
             # Make sure you always move away from other character's your engaged with when you retreat.
-            if mover.db.Combat_Range[character] == 0:
+            if mover.combat.Range[character] == 0:
                 distance_inc(mover, character)
     # Then, move away from your target and give the combat message.
     distance_inc(mover, target)
-    newrange = mover.db.Combat_Range[target]
+    newrange = mover.combat.Range[target]
     if mode == "normal":
-        mover.db.Combat_Moves -= 1
+        mover.combat.Moves -= 1
     return ["move"]
 
 def move_block_test(mover, blocker):
     "If a character tries to move away from someone they're engaged with, the other tries to block them automatically."
-    blockstat = max(blocker.db.ATM, blocker.db.DEF)
-    moveroll = randint(1, mover.db.MOB)
+    blockstat = max(blocker.sheet.ATM, blocker.sheet.DEF)
+    moveroll = randint(1, mover.sheet.MOB)
     # Let the mover go if they're an ally of the blocker.
     if mover in blocker.db.Allies:
         return False
@@ -194,12 +198,12 @@ def init_range(character, fighterlist):
             rangelist.update({fighter:0})
         else:
             rangelist.update({fighter:fighter.location.starting_range()})
-    character.db.Combat_Range = rangelist
+    character.combat.Range = rangelist
     
 def get_engage_group(character):
     "Returns a list of the other characters this character is engaged with, including themself."
     engagegroup = [character]
-    for key in character.db.Combat_Range:
-        if character.db.Combat_Range[key] == 0 and not character.db.Combat_Range[key] in engagegroup and key != character:
+    for key in character.combat.Range:
+        if character.combat.Range[key] == 0 and not character.combat.Range[key] in engagegroup and key != character:
             engagegroup.append(key)
     return engagegroup
\ No newline at end of file
@@ -0,0 +1,98 @@
+"""
+Combat OOB
+
+Structured combat updates for clients with OOB support - the webclient,
+or MUD clients using GMCP. Rather than picking apart the text readouts,
+these clients get small 'combat_delta' messages holding only what has
+changed, and can ask for the whole state at any time with the
+'combat_state' input function (see server/conf/inputfuncs.py).
+
+Changes are noted with mark_oob_change() as they happen and sent once
+per reactor iteration, so one command sends each fighter a single delta
+no matter how many things it touched.
+
+"""
+
+from evennia import utils
+
+def mark_oob_change(character, kind):
+    "Notes that part of a fighter's combat state changed. Kind is one of 'stats', 'conditions', 'incoming', 'ranges' or 'turn'."
+    handler = character.combat.TurnHandler
+    if not handler:
+        return
+    changes = handler.ndb.oob_changes
+    if changes is None:
+        changes = {}
+        handler.ndb.oob_changes = changes
+        utils.delay(0, callback=lambda: flush_oob_changes(handler))
+    changes.setdefault(kind, set()).add(character)
+
+def flush_oob_changes(handler):
+    "Sends everyone in a fight a single delta with everything marked as changed since the last one."
+    changes = handler.ndb.oob_changes
+    handler.ndb.oob_changes = None
+    # The fight may have ended since the changes were marked.
+    if not changes or not handler.id:
+        return
+    delta = {"fight":handler.db.fight_id}
+    fighterchanges = {}
+    for character in changes.get("stats", ()):
+        fighterchanges.setdefault(character.id, {}).update(stat_state(character))
+    for character in changes.get("conditions", ()):
+        fighterchanges.setdefault(character.id, {})["conditions"] = condition_state(character)
+    for character in changes.get("incoming", ()):
+        fighterchanges.setdefault(character.id, {})["incoming"] = attack_state(character.combat.IncomingAttack)
+    if fighterchanges:
+        delta["fighters"] = fighterchanges
+    if "ranges" in changes:
+        delta["ranges"] = dict((character.id, range_state(character)) for character in changes["ranges"])
+    if "turn" in changes:
+        delta["turn"] = handler.fighters[handler.db.turn].id
+    for fighter in handler.fighters:
+        fighter.msg(combat_delta=((), delta))
+
+def combat_snapshot(character):
+    "Returns the whole state of the fight the character is in, or an empty fight if they're not in one."
+    handler = character.combat.TurnHandler
+    if not handler:
+        return {"fight":None}
+    return fight_snapshot(handler)
+
+def fight_snapshot(handler):
+    "Returns the whole state of a fight."
+    fighters = handler.fighters
+    fighterstates = []
+    for fighter in fighters:
+        state = {"id":fighter.id, "name":str(fighter),
+                 "conditions":condition_state(fighter),
+                 "incoming":attack_state(fighter.combat.IncomingAttack)}
+        state.update(stat_state(fighter))
+        fighterstates.append(state)
+    return {"fight":handler.db.fight_id,
+            "turn":fighters[handler.db.turn].id,
+            "fighters":fighterstates,
+            "ranges":dict((fighter.id, range_state(fighter)) for fighter in fighters)}
+
+def stat_state(character):
+    "Returns a fighter's current and maximum HP and SP."
+    derived = character.derived_stats()
+    return {"hp":character.db.HP, "maxhp":derived["MaxHP"], "sp":character.db.SP, "maxsp":derived["MaxSP"]}
+
+def condition_state(character):
+    "Returns a fighter's conditions and the turns left on each."
+    conditions = character.combat.Conditions or {}
+    return dict((condition, conditions[condition][0]) for condition in conditions)
+
+def attack_state(attack):
+    "Returns a pending attack as a dictionary, or None if there isn't one."
+    if not attack:
+        return None
+    state = {"roll":attack[0], "attacker":attack[1].id, "effects":list(attack[2]), "type":attack[3]}
+    if len(attack) > 5:
+        state["deadline"] = attack[5]
+    return state
+
+def range_state(character):
+    "Returns a fighter's range to every other fighter, keyed by their ids."
+    ranges = character.combat.Range or {}
+    return dict((fighter.id, ranges[fighter]) for fighter in ranges)
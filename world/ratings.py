@@ -0,0 +1,201 @@
+"""
+Ratings
+
+Every fighter who has won or lost a fight has an Elo rating, updated as
+soon as each fight ends. In a fight with more than two fighters, the
+winner is scored as having beaten each of the others, with the K factor
+split between them, so a big brawl moves a rating no more than a duel.
+Fights that end in everyone disengaging, or that are stopped by staff,
+don't change anyone's rating.
+
+All the ratings are kept in memory, along with a leaderboard - a list
+of (-rating, fighter id) kept sorted as ratings change - so a fighter's
+rank is a binary search and a page of the leaderboard is a slice,
+without ever sorting every player in the database. Changed ratings are
+saved in bulk by the background writer. The leaderboard is loaded from
+the Rating table when the server starts, and can be rebuilt from the
+match history with '@rerank'. Without the world app installed (see
+world/history.py), ratings still work but only last until the server
+restarts.
+
+"""
+
+import metrics
+import writer
+import history
+from bisect import bisect_left, insort
+from django.conf import settings
+from django.db import DatabaseError
+from evennia.utils import logger
+if history.HISTORY_INSTALLED:
+    from world.models import Rating, FightParticipant
+
+# Rating a fighter starts with before their first rated fight.
+RATING_START = getattr(settings, "RATING_START", 1500)
+# Most a rating can change in one fight.
+RATING_K = getattr(settings, "RATING_K", 32)
+# How many rows are saved or deleted per query, to stay under the database's limit on query parameters.
+RATING_CHUNK_SIZE = 500
+
+# Fighter id to [rating, rated fights, name].
+_ratings = {}
+# (-rating, fighter id) for every rated fighter, kept sorted, best first.
+_board = []
+# Ratings changed since the last save was sent to the worker thread, and which save they're queued under.
+_unsaved = {"rows":None, "generation":0}
+
+def rating(fighter_id):
+    "Returns a fighter's current rating, or the starting rating if they have none."
+    entry = _ratings.get(fighter_id)
+    return entry[0] if entry else RATING_START
+
+def rating_entry(fighter_id):
+    "Returns a fighter's [rating, rated fights, name], or None if they've never had a rated fight."
+    return _ratings.get(fighter_id)
+
+def rank(fighter_id):
+    "Returns a fighter's place on the leaderboard, counting from 1, or None if they aren't on it."
+    entry = _ratings.get(fighter_id)
+    if not entry:
+        return None
+    return bisect_left(_board, (-entry[0], fighter_id)) + 1
+
+def board_size():
+    "Returns how many fighters are on the leaderboard."
+    return len(_board)
+
+def top(count, start=0):
+    "Returns a slice of the leaderboard as (rank, fighter id, name, rating, rated fights) tuples."
+    results = []
+    for place, (negative, fighter_id) in enumerate(_board[start:start + count]):
+        entry = _ratings[fighter_id]
+        results.append((start + place + 1, fighter_id, entry[2], entry[0], entry[1]))
+    return results
+
+def set_rating(fighter_id, name, new_rating, games):
+    "Sets a fighter's rating, moving them to their new place on the leaderboard."
+    entry = _ratings.get(fighter_id)
+    if entry:
+        del _board[bisect_left(_board, (-entry[0], fighter_id))]
+    _ratings[fighter_id] = [new_rating, games, name]
+    insort(_board, (-new_rating, fighter_id))
+
+def expected_score(own, other):
+    "Returns the Elo expected score of a fighter rated own against one rated other."
+    return 1 / (1 + 10 ** ((other - own) / 400.0))
+
+def apply_result(fighters, winner_id):
+    """
+    Updates ratings for a fight's result. Fighters is a list of (fighter id,
+    name) for everyone in the fight. Returns a dictionary of fighter id to
+    (old rating, new rating) for everyone whose rating changed.
+    """
+    losers = [fighter for fighter in fighters if fighter[0] != winner_id]
+    if winner_id is None or len(losers) == len(fighters) or not losers:
+        return {}
+    old = dict((fighter_id, rating(fighter_id)) for fighter_id, name in fighters)
+    # Every loser is scored against the winner alone, all from the ratings as they were before the fight.
+    k = RATING_K / float(len(losers))
+    deltas = dict((fighter_id, 0.0) for fighter_id, name in fighters)
+    for fighter_id, name in losers:
+        delta = k * (1 - expected_score(old[winner_id], old[fighter_id]))
+        deltas[winner_id] += delta
+        deltas[fighter_id] -= delta
+    changes = {}
+    for fighter_id, name in fighters:
+        entry = _ratings.get(fighter_id)
+        games = entry[1] + 1 if entry else 1
+        set_rating(fighter_id, name, old[fighter_id] + deltas[fighter_id], games)
+        changes[fighter_id] = (old[fighter_id], old[fighter_id] + deltas[fighter_id])
+    return changes
+
+def rate_fight(handler):
+    "Updates the ratings of everyone in a fight that's just ended, tells them how they changed, and queues the new ratings to be saved."
+    outcome, winner = handler.ndb.outcome or ("stopped", None)
+    if outcome != "victory":
+        return
+    fighters = handler.fighters
+    changes = apply_result([(fighter.id, fighter.key) for fighter in fighters], winner.id)
+    for fighter in fighters:
+        if fighter.id in changes:
+            before, after = changes[fighter.id]
+            fighter.msg("Your rating goes from |455%i|n to |455%i|n. You're now ranked #%i." % (before, after, rank(fighter.id)))
+    queue_save(changes.keys())
+    metrics.incr("ratings.fights_rated")
+
+def queue_save(fighter_ids):
+    """
+    Queues the current ratings of these fighters to be saved. While a save
+    is still waiting on the background writer, more ratings are added to
+    it, so however many fights end in the meantime it's one bulk write.
+    """
+    if not history.HISTORY_INSTALLED:
+        return
+    key = ("ratings", _unsaved["generation"])
+    if _unsaved["rows"] is None or not writer.is_queued(key):
+        _unsaved["rows"] = {}
+    rows = _unsaved["rows"]
+    for fighter_id in fighter_ids:
+        new_rating, games, name = _ratings[fighter_id]
+        rows[fighter_id] = (name, new_rating, games)
+    writer.enqueue(save_ratings, (rows,), key=key)
+
+def save_ratings(rows, replace=False):
+    "Saves a dictionary of fighter id to (name, rating, rated fights) in bulk. With replace, every other rating is deleted. Runs on the background writer's thread."
+    fighter_ids = list(rows)
+    if replace:
+        Rating.objects.all().delete()
+    for start in range(0, len(fighter_ids), RATING_CHUNK_SIZE):
+        chunk = fighter_ids[start:start + RATING_CHUNK_SIZE]
+        if not replace:
+            Rating.objects.filter(db_fighter_id__in=chunk).delete()
+        Rating.objects.bulk_create([Rating(db_fighter_id=fighter_id, db_name=rows[fighter_id][0],
+                                           db_rating=rows[fighter_id][1], db_games=rows[fighter_id][2]) for fighter_id in chunk])
+
+def load_ratings():
+    "Loads every rating and builds the leaderboard. Called when the server starts. If no ratings have been saved yet, they're rebuilt from the match history instead."
+    _ratings.clear()
+    if not history.HISTORY_INSTALLED:
+        return
+    try:
+        saved = list(Rating.objects.values_list("db_fighter_id", "db_name", "db_rating", "db_games"))
+    except DatabaseError:
+        logger.log_err("Ratings couldn't be loaded. Run 'evennia migrate' to create the match history and rating tables.")
+        return
+    for fighter_id, name, saved_rating, games in saved:
+        _ratings[fighter_id] = [saved_rating, games, name]
+    if not _ratings:
+        rebuild_ratings()
+        return
+    # Sorted once here rather than inserted one at a time.
+    _board[:] = sorted((-entry[0], fighter_id) for fighter_id, entry in _ratings.items())
+    metrics.gauge("ratings.rated_fighters", len(_board))
+
+def rebuild_ratings():
+    "Throws out every rating and replays the whole match history, oldest fight first, to work them out again. Returns how many fights were replayed."
+    _ratings.clear()
+    del _board[:]
+    if not history.HISTORY_INSTALLED:
+        return 0
+    rows = (FightParticipant.objects.filter(db_record__db_outcome="victory")
+            .order_by("db_ended", "db_record_id")
+            .values_list("db_record_id", "db_fighter_id", "db_name", "db_record__db_winner_id"))
+    replayed = 0
+    current, fighters, winner_id = None, [], None
+    for record_id, fighter_id, name, record_winner in rows.iterator():
+        if record_id != current:
+            if fighters:
+                apply_result(fighters, winner_id)
+                replayed += 1
+            current, fighters, winner_id = record_id, [], record_winner
+        fighters.append((fighter_id, name))
+    if fighters:
+        apply_result(fighters, winner_id)
+        replayed += 1
+    # Start a new save, so changes queued before the rebuild can't be written over it.
+    _unsaved["generation"] += 1
+    _unsaved["rows"] = None
+    saved = dict((fighter_id, (entry[2], entry[0], entry[1])) for fighter_id, entry in _ratings.items())
+    writer.enqueue(save_ratings, (saved, True))
+    metrics.gauge("ratings.rated_fighters", len(_board))
+    return replayed
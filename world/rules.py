@@ -1,20 +1,33 @@
 from random import randint
+from django.conf import settings
 from evennia import utils
 import math
+import time
+
+# How far away a 'Burst' area attack reaches.
+AREA_BURST_RANGE = 3
+# How many seconds a fighter has to respond to an attack before defending automatically.
+DEFENSE_TIMEOUT = getattr(settings, "DEFENSE_TIMEOUT", 30)
+# How many reflects and counterattacks can follow on from a single attack.
+REACTION_CHAIN_LIMIT = getattr(settings, "REACTION_CHAIN_LIMIT", 4)
 
 # Import all movement / range related functions.
 from movement import distance_dec, distance_inc, approach, withdraw, ms_approach, ms_withdraw, move_block_test, init_range, get_engage_group
 # Import all value-to-text, display, and prompt functions.
-from display import range_name, size_name, turn_prompt, health_bar, combat_status_line, prompt_update, pretty_special
+from display import room_msg, begin_broadcast, flush_broadcast, end_broadcast, range_name, size_name, turn_prompt, health_bar, combat_status_line, prompt_update, flush_prompt, pretty_special
+# Import all OOB (structured client data) functions.
+from oob import mark_oob_change, combat_snapshot, fight_snapshot
+# Import all spectator feed functions.
+from spectate import find_fight, add_spectator, remove_spectator, feed_spectators, feed_room_spectators, end_spectator_turn, end_spectating
 # Import all special move / condition related functions.
-from special import special_cost, special_support, special_hinder, special_drawback, add_condition, condition_tickdown, check_stat_requirements, verify_special_move, special_dictionary
+from special import special_cost, spend_special, special_support, special_hinder, special_drawback, add_condition, condition_tickdown, check_stat_requirements, verify_special_move, special_dictionary
 
 def roll_atk(character, attack_type, effects):
     "Makes an attack roll based on a character's ATM or ATR stat."
     if attack_type == "melee":
-        attack = character.db.ATM
+        attack = character.sheet.ATM
     else:
-        attack = character.db.ATR
+        attack = character.sheet.ATR
     if attack == 0:
         return 0
     else:
@@ -29,16 +42,16 @@ def roll_atk(character, attack_type, effects):
         if 'Boosted Attack' in effects:
             attack_roll += 2
         # If attacker has the 'Debuffed ATK' condition, reduce the roll by 1.
-        if 'Debuffed ATK' in character.db.Combat_Conditions:
+        if 'Debuffed ATK' in character.combat.Conditions:
             attack_roll -= 1
         # If attacker has the 'Buffed ATK' condition, increase the roll by 1.
-        if 'Buffed ATK' in character.db.Combat_Conditions:
+        if 'Buffed ATK' in character.combat.Conditions:
             attack_roll += 1
         return attack_roll
 
 def roll_def(character, def_effects, effects):
     "Makes a defense roll based on a character's DEF stat."
-    defense = character.db.DEF
+    defense = character.sheet.DEF
     if defense == 0:
         return 0
     else:
@@ -53,10 +66,10 @@ def roll_def(character, def_effects, effects):
         if 'Boosted Defense' in def_effects:
             defense_roll += 2
         # If defender has the 'Debuffed DEF' condition, reduce defense roll by 1.
-        if 'Debuffed DEF' in character.db.Combat_Conditions:
+        if 'Debuffed DEF' in character.combat.Conditions:
             defense_roll -= 1
         # If defender has the 'Buffed DEF' condition, increase defense roll by 1.
-        if 'Buffed DEF' in character.db.Combat_Conditions:
+        if 'Buffed DEF' in character.combat.Conditions:
             defense_roll += 1
         # If there's a bypass defense effect, halve the defense roll.
         if 'Bypass Defense' in effects:
@@ -65,7 +78,7 @@ def roll_def(character, def_effects, effects):
 
 def roll_init(character):
     "Rolls Mobility to determine initiative."
-    mobility = character.db.MOB
+    mobility = character.sheet.MOB
     if mobility == 0:
         return 0
     else:
@@ -77,14 +90,14 @@ def damage_target(target, damage):
     "Subtracts HP from a target, to a minimum of 0"
     if damage >= target.db.HP:
         target.db.HP = 0
-        target.location.msg_contents("%s is defeated!" % target)
+        room_msg(target.location, "%s is defeated!" % target)
     else:
         target.db.HP -= damage
     prompt_update(target)
     target.msg(effect="Damage")
 
-def queue_attack(character, target, attack_message, effects, attack_type):
-    "Queues an attack against a target, who can choose how to defend"
+def queue_attack(character, target, attack_message, effects, attack_type, chain=0):
+    "Queues an attack against a target, who can choose how to defend. Chain counts the reactions leading up to it."
     target = character.search(target)
     # Check for existing pre-set attack messages
     if attack_message == "default" and attack_type == "melee":
@@ -104,8 +117,9 @@ def queue_attack(character, target, attack_message, effects, attack_type):
     attack_message = attack_message.replace("<target>", str(target))
     # Get the attack roll. Special move effects affecting the attack roll are processed there.
     attack = roll_atk(character, attack_type, effects)
-    # The attack is stored on the target as a tuple.
-    target.db.Combat_IncomingAttack = (attack, character, effects, attack_type)
+    # The attack is stored on the target as a tuple, along with how far into a chain of reactions it is and when it times out.
+    target.combat.IncomingAttack = (attack, character, effects, attack_type, chain, time.time() + DEFENSE_TIMEOUT)
+    mark_oob_change(target, "incoming")
     # Give the compiled attack message to the room.
     if attack_type == "melee":
         output = ("%s |522[Melee attack roll vs. %s: |544%i|522]|n" % (attack_message, target, attack))
@@ -114,29 +128,96 @@ def queue_attack(character, target, attack_message, effects, attack_type):
     if effects:
         effectstring = utils.list_to_string(effects, endsep="|255and|455", addquote=False)
         output += " |255[|455%s|255]|n" % effectstring
-    character.location.msg_contents(output)
-    # Puts a script on the target that will time them out and auto-defend if they don't respond to the attack quick enough.
-    target.scripts.add("scripts.DefenseTimeout")
+    room_msg(character.location, output)
+    # Lets the fight give the target a chance to respond - normally a script that auto-defends if they don't respond quick enough.
+    target.combat.TurnHandler.await_defense(target)
     # If there's a double attack effect, give the attacker a second attack.
     if 'Double Attack' in effects:
         effectlist = []
         for effect in effects:
             if effect != 'Double Attack':
                 effectlist.append(effect)
-        character.db.Combat_Second = (attack_type, effectlist)
+        character.combat.Second = (attack_type, effectlist)
         character.msg("|255Use the '|455second|255' command to use your second attack!")
 
+def is_area_special(effects):
+    "Returns True if a special move's effects make it an area attack."
+    return 'Sweep' in effects or 'Burst' in effects
+
+def area_targets(character, effects):
+    "Returns every enemy an area attack would hit, picked out of the character's ranges in one pass."
+    allies = character.db.Allies or []
+    if 'Sweep' in effects:
+        nearest, farthest = 0, 0
+    else:
+        nearest, farthest = 1, AREA_BURST_RANGE
+    return [fighter for fighter, distance in character.combat.Range.items()
+            if nearest <= distance <= farthest and fighter != character and fighter not in allies and fighter.db.HP]
+
+def queue_area_attack(character, targets, attack_message, effects, attack_type):
+    "Queues one attack against many targets, who all defend against the same roll."
+    targetstring = utils.list_to_string([str(target) for target in targets], endsep="and", addquote=False)
+    if not "<self>" in attack_message:
+        attack_message = str(character) + " " + attack_message
+    attack_message = attack_message.replace("<self>", str(character))
+    attack_message = attack_message.replace("<target>", targetstring)
+    # One roll and one deadline for everyone.
+    attack = roll_atk(character, attack_type, effects)
+    deadline = time.time() + DEFENSE_TIMEOUT
+    for target in targets:
+        target.combat.IncomingAttack = (attack, character, effects, attack_type, 0, deadline)
+        mark_oob_change(target, "incoming")
+    # Remember everyone's HP going in, for the summary once they've all defended.
+    character.combat.AreaTargets = dict((target, target.db.HP) for target in targets)
+    if attack_type == "melee":
+        output = ("%s |522[Melee attack roll vs. %s: |544%i|522]|n" % (attack_message, targetstring, attack))
+    else:
+        output = ("%s |525[Ranged attack roll vs. %s: |545%i|525]|n" % (attack_message, targetstring, attack))
+    effectstring = utils.list_to_string(effects, endsep="|255and|455", addquote=False)
+    output += " |255[|455%s|255]|n" % effectstring
+    room_msg(character.location, output)
+    # Everyone defends under one shared deadline, rather than a timeout each.
+    character.combat.TurnHandler.await_area_defense(character, targets)
+
+def area_attack_summary(character):
+    "Sums up how an area attack went for everyone it hit, once they've all defended."
+    targets = character.combat.AreaTargets
+    if not targets:
+        return
+    # Wait until the last of them has defended.
+    for target in targets:
+        incoming = target.combat.IncomingAttack
+        if incoming and incoming[1] == character:
+            return
+    results = []
+    for target in targets:
+        lost = targets[target] - target.db.HP
+        if lost > 0:
+            results.append("%s |555-%i HP|n" % (target, lost))
+        else:
+            results.append("%s unhurt" % target)
+    del character.combat.AreaTargets
+    room_msg(character.location, "|255[%s's area attack]|n %s" % (character, ", ".join(results)))
+
 def defend_queue(character, action, def_effects):
     "Attempts a defense roll against a queued attack."
-    if not character.db.Combat_IncomingAttack:
+    if not character.combat.IncomingAttack:
         character.msg("|413There are no attacks aimed at you!")
         return
         
     # Retrieve all the information from the incoming attack.
-    attack = character.db.Combat_IncomingAttack[0]
-    offender = character.db.Combat_IncomingAttack[1]
-    effects = character.db.Combat_IncomingAttack[2]
-    attack_type = character.db.Combat_IncomingAttack[3]
+    attack = character.combat.IncomingAttack[0]
+    offender = character.combat.IncomingAttack[1]
+    effects = character.combat.IncomingAttack[2]
+    attack_type = character.combat.IncomingAttack[3]
+    # Attacks saved before reaction chains were counted don't have a chain count.
+    chain = 0
+    if len(character.combat.IncomingAttack) > 4:
+        chain = character.combat.IncomingAttack[4]
+    # Reflects and counterattacks stop once the chain gets too long, so two fighters can't bounce attacks forever.
+    if chain >= REACTION_CHAIN_LIMIT and ('Reflect' in def_effects or 'Counterattack' in def_effects):
+        room_msg(character.location, "|413The exchange has gone on too long - %s can't react!|n" % character)
+        def_effects = [effect for effect in def_effects if effect not in ('Reflect', 'Counterattack')]
     
     if action == "defend":
         # Make a defense roll. Effects that affect the roll are processed in the roll_def function.
@@ -147,7 +228,7 @@ def defend_queue(character, action, def_effects):
         rollmessage = "|225[Endure]|n"
     if defense >= attack:
         # If the defense roll is equal or higher to the attack roll, there's no damage.
-        character.location.msg_contents("%s defends against %s's attack! %s" % (character, offender, rollmessage))
+        room_msg(character.location, "%s defends against %s's attack! %s" % (character, offender, rollmessage))
         # If there's an absorb effect and DEF roll is higher than ATK roll, recover HP equal to difference.
         if 'Absorb' in def_effects and defense > attack:
             recover_hp(character, min(attack, defense - attack))
@@ -158,18 +239,21 @@ def defend_queue(character, action, def_effects):
             if effects:
                 effectstring = utils.list_to_string(effects, endsep="and", addquote=False)
                 output += " |255[|455%s|255]|n" % effectstring
-            character.location.msg_contents(output)
-            offender.db.Combat_IncomingAttack = (attack, character, effects, attack_type)
-            offender.scripts.add("scripts.DefenseTimeout")
+            room_msg(character.location, output)
+            offender.combat.IncomingAttack = (attack, character, effects, attack_type, chain + 1, time.time() + DEFENSE_TIMEOUT)
+            mark_oob_change(offender, "incoming")
+            offender.combat.TurnHandler.await_defense(offender)
         # If there's a counterattack effect, attack the target with a regular attack.
         if 'Counterattack' in def_effects:
             countermessage = "<self> counterattacks <target>!"
             counterattack_type = "ranged"
-            if character.db.Combat_Range[character.db.Combat_IncomingAttack[1]] == 0:
+            if character.combat.Range[character.combat.IncomingAttack[1]] == 0:
                 counterattack_type = "melee"
-            queue_attack(character, offender, "<self> counterattacks <target>!", [], counterattack_type)
+            queue_attack(character, offender, "<self> counterattacks <target>!", [], counterattack_type, chain + 1)
         # Get rid of the incoming attack at the end.
-        del character.db.Combat_IncomingAttack
+        del character.combat.IncomingAttack
+        mark_oob_change(character, "incoming")
+        area_attack_summary(offender)
     else:
         # Otherwise, the difference is given as damage.
         damage = attack - defense
@@ -189,8 +273,10 @@ def defend_queue(character, action, def_effects):
         # If there's a no damage or negate damage effect, set damage to 0.
         if 'No Damage' in effects or 'Negate Damage' in def_effects:
             damage = 0
-        character.location.msg_contents("%s takes |555%i damage|n from %s's attack! %s" % (character, damage, offender, rollmessage))
+        room_msg(character.location, "%s takes |555%i damage|n from %s's attack! %s" % (character, damage, offender, rollmessage))
         damage_target(character, damage)
+        # Keep count for the match history.
+        offender.combat.DamageDealt = (offender.combat.DamageDealt or 0) + damage
         # If there's a recoil effect, give half damage back to the attacker.
         if 'Recoil' in effects:
             reduce_hp(offender, max(1, damage/2))
@@ -199,27 +285,30 @@ def defend_queue(character, action, def_effects):
             recover_hp(offender, damage)
         # Pass the rest of the effects onto 'special_hinder' instead of defining them all twice.
         special_hinder(character, offender, effects)
-        del character.db.Combat_IncomingAttack
+        del character.combat.IncomingAttack
+        mark_oob_change(character, "incoming")
+        area_attack_summary(offender)
 
 def recover(character):
     "Heals a character to full HP and SP."
-    character.db.HP = max(1, (character.db.VIT * 3))
-    character.db.SP = character.db.SPE * 2
+    derived = character.derived_stats()
+    character.db.HP = derived["MaxHP"]
+    character.db.SP = derived["MaxSP"]
     character.msg("|252HP and SP restored!|n")
     prompt_update(character)
 
 def start_turn(character):
     "Makes actions available to a character at the start of their turn."
     # Give the character their action and movement for the round.
-    character.db.Combat_Actions = 1
-    character.db.Combat_Moves = int(math.floor(character.db.MOB / 2))
+    character.combat.Actions = 1
+    character.combat.Moves = character.derived_stats()["Moves"]
     # Clear out special-related stuff.
-    if character.db.Combat_UsedSpecial:
-        character.db.Combat_UsedSpecial = False
-    if character.db.Combat_Second:
-        del character.db.Combat_Second
+    if character.combat.UsedSpecial:
+        character.combat.UsedSpecial = False
+    if character.combat.Second:
+        del character.combat.Second
     # Check status effects and conditions here.
-    for status in character.db.Combat_Conditions:
+    for status in character.combat.Conditions:
         if status == 'Debuffed ATK':
             character.msg("Your attack rolls are reduced by 1. |255[|455Debuffed ATK|255]|n")
         if status == 'Debuffed DEF':
@@ -227,100 +316,99 @@ def start_turn(character):
         if status == 'Debuffed RNG':
             character.msg("Your range is reduced by 2. |255[|455Debuffed RNG|255]|n")
         if status == 'Debuffed MOB':
-            character.db.Combat_Moves -= 1
+            character.combat.Moves -= 1
             character.msg("You have 1 less move available this turn. |255[|455Debuffed MOB|255]|n")
         if status == 'Immobilization':
-            character.db.Combat_Moves = 0
+            character.combat.Moves = 0
             character.msg("You can't move this turn. |255[|455Immobilization|255]|n")
         if status == 'Disabled Action':
-            character.db.Combat_Actions = 0
+            character.combat.Actions = 0
             character.msg("You can't take an action this turn. |255[|455Disabled Action|255]|n")
         if status == 'Buffed ATK':
             character.msg("Your attack rolls are increased by 1. |255[|455Buffed ATK|255]|n")
         if status == 'Buffed DEF':
             character.msg("Your defense rolls are increased by 1. |255[|455Buffed DEF|255]|n")
         if status == 'Buffed MOB':
-            character.db.Combat_Moves += 1
+            character.combat.Moves += 1
             character.msg("You have 1 more move available this turn. |255[|455Buffed MOB|255]|n")
     prompt_update(character)
     
 
 def pass_turn(character):
     "Pass on a turn. Can be initiated by command, timeout, or having no actions available."
-    character.db.Combat_Actions = 0
-    character.db.Combat_Moves = 0
-    if character.db.Combat_Second:
-        del character.db.Combat_Second
+    character.combat.Actions = 0
+    character.combat.Moves = 0
+    if character.combat.Second:
+        del character.combat.Second
     prompt_update(character)
 
-def combat_cleanup(character):
-    "Cleans up all the combat-related attributes on a character."
-    # Goes through every attribute - if it starts with "combat_", delete it.
-    for attr in character.attributes.all():
-        if attr.key[:7] == "combat_":
-            character.attributes.remove(key=attr.key)
+def combat_cleanup(fighters):
+    "Cleans up all the combat-related state on a list of fighters."
+    # Combat state is only kept in memory, so there's nothing to delete from the database.
+    for fighter in fighters:
+        fighter.combat.clear()
 
 def is_fighter(character):
     "Determines whether the given object is a fighter (has stats, etc.)"
-    for stat in ("ATM", "DEF", "VIT", "MOB", "ATR", "SPE"):
-        if character.attributes.has(stat):
-            return True
-    return False
+    return getattr(character, "fighter", False)
 
 def recover_hp(character, amount):
     "Recovers HP as part of a special move."
-    character.db.HP += amount
-    if character.db.HP > (max(character.db.VIT * 3, 1)):
-        character.db.HP = max(character.db.VIT * 3, 1)
-    character.location.msg_contents("%s recovers from some damage! |252[|454+%i|252 HP]" % (character, amount))
+    character.db.HP = min(character.db.HP + amount, character.derived_stats()["MaxHP"])
+    room_msg(character.location, "%s recovers from some damage! |252[|454+%i|252 HP]" % (character, amount))
     prompt_update(character)
     
 def recover_sp(character, amount):
     "Recovers HP as part of a special move."
-    character.db.SP += amount
-    if character.db.SP > character.db.SPE * 2:
-        character.db.SP = character.db.SPE * 2
-    character.location.msg_contents("%s recovers some SP! |255[|455+%i|255 SP]" % (character, amount))
+    character.db.SP = min(character.db.SP + amount, character.derived_stats()["MaxSP"])
+    room_msg(character.location, "%s recovers some SP! |255[|455+%i|255 SP]" % (character, amount))
     prompt_update(character)
 
 def reduce_hp(character, amount):
     "Reduces HP as part of a special move or harmful condition."
-    character.location.msg_contents("%s takes damage! |252[|454-%i|252 HP]" % (character, amount))
+    room_msg(character.location, "%s takes damage! |252[|454-%i|252 HP]" % (character, amount))
     damage_target(character, amount)
     prompt_update(character)
     
 def is_turn(character):
     "Checks to see if it's a character's turn."
-    turnhandler = character.db.Combat_TurnHandler
-    currentchar = turnhandler.db.fighters[turnhandler.db.turn]
-    if character == currentchar:
-        return True
-    return False
+    return character.combat.TurnHandler.is_turn(character)
     
 def attack_type_check(character, target, attack_type, effects):
     "Checks to see if the target can make a melee or ranged attack."
     target = character.search(target)
+    return attacker_type_check(character, attack_type, effects) or target_type_check(character, target, attack_type, effects)
+
+def attacker_type_check(character, attack_type, effects):
+    "Checks the parts of attack_type_check that don't depend on the target - whether the character can make this type of attack at all right now."
     if attack_type == "melee":
         # If the character has ATM 0 and no special effects that grant them a roll, they can't make melee attacks.
-        if character.db.ATM == 0 and 'Boosted Attack' not in effects and 'Perfect Attack' not in effects and 'Precise Attack' not in effects:
+        if character.sheet.ATM == 0 and 'Boosted Attack' not in effects and 'Perfect Attack' not in effects and 'Precise Attack' not in effects:
             return "|413You can't make melee attacks!|n"
+        return False
+    if attack_type == "ranged":
+        # If the character has ATR 0 and no special effects that grant them a roll, they can't make ranged attacks.
+        if character.sheet.ATR == 0 and 'Boosted Attack' not in effects and 'Perfect Attack' not in effects and 'Precise Attack' not in effects:
+            return "|413You can't make ranged attacks!|n"
+        # If there are other fighters engaged with the character who don't consider the character an ally, no ranged attacks.
+        for fighter in character.combat.Range:
+            if character.combat.Range[fighter] == 0 and fighter != character and 'Point-Blank' not in effects and character not in fighter.db.Allies:
+                return "|423You can't use ranged attacks when there are enemies engaged (range 0) with you!|n"
+        return False
+
+def target_type_check(character, target, attack_type, effects):
+    "Checks the parts of attack_type_check that depend on the target - whether they're at a range this type of attack can reach."
+    if attack_type == "melee":
         # If the target is more than 0 spaces away, and they don't have an effect that closes the distance, they can't make the attack.
-        if character.db.Combat_Range[target] > 0 and 'Lunge' not in effects and 'Projected Strike' not in effects:
+        if character.combat.Range[target] > 0 and 'Lunge' not in effects and 'Projected Strike' not in effects:
             return "|413You can only use melee attacks on engaged (range 0) targets!|n"
-        if character.db.Combat_Range[target] > 2 and 'Lunge' in effects:
+        if character.combat.Range[target] > 2 and 'Lunge' in effects:
             return "|413Your target is more than 2 spaces away - can't lunge!|n"
         return False
     if attack_type == "ranged":
-        # If the character has ATR 0 and no special effects that grant them a roll, they can't make ranged attacks.
-        if character.db.ATR == 0 and 'Boosted Attack' not in effects and 'Perfect Attack' not in effects and 'Precise Attack' not in effects:
-            return "|413You can't make ranged attacks!|n"
         # If the target is at range 0 and there's no effect that lets the character hit melee targets with ranged attacks, they can't attack.
-        if character.db.Combat_Range[target] == 0 and 'Point-Blank' not in effects:
+        if character.combat.Range[target] == 0 and 'Point-Blank' not in effects:
             return "|423You can't use ranged attacks on engaged (range 0) targets!|n"
-        # If there are other fighters engaged with the character who don't consider the character an ally, no ranged attacks.
-        for fighter in character.db.Combat_Range:
-            if character.db.Combat_Range[fighter] == 0 and fighter != character and 'Point-Blank' not in effects and character not in fighter.db.Allies:
-                return "|423You can't use ranged attacks when there are enemies engaged (range 0) with you!|n"
         return False
 
 def cmd_check(caller, args, action, conditions):
@@ -329,7 +417,7 @@ def cmd_check(caller, args, action, conditions):
     arglist = args.split(None)
     nargs = len(arglist)
     if 'InCombat' in conditions:
-        if not caller.db.Combat_TurnHandler:
+        if not caller.combat.TurnHandler:
             return ("|413You can only do that if you're in a fight!|n")
     if 'HasHP' in conditions:
         if not caller.db.HP:
@@ -338,14 +426,14 @@ def cmd_check(caller, args, action, conditions):
         if not is_turn(caller):
             return ("|413You can't %s when it's not your turn!|n" % action)
     if 'HasAction' in conditions:
-        if not caller.db.Combat_Actions:
+        if not caller.combat.Actions:
             return ("|413You've already used your action this turn!|n")
     if 'HasMove' in conditions or 'HasMoves' in conditions: # Check for both 'HasMove' and 'HasMoves' in case I screw up
-        if not caller.db.Combat_Moves:
+        if not caller.combat.Moves:
             return ("|413You've already used all your movement this turn!|n")
     if 'AttacksResolved' in conditions:
-        for fighter in caller.db.Combat_TurnHandler.db.fighters:
-            if fighter.db.Combat_IncomingAttack:
+        for fighter in caller.combat.TurnHandler.fighters:
+            if fighter.combat.IncomingAttack:
                 return ("|413Please wait for outstanding attacks to resolve!|n")
     # Conditions requiring a target start here.
     if 'NeedsTarget' in conditions:
@@ -365,10 +453,10 @@ def cmd_check(caller, args, action, conditions):
                     action = "withdraw from"
                 return ("|413You can't %s yourself!|n" % action)
         if 'TargetInFight' in conditions:
-            if not target.db.Combat_TurnHandler:
+            if not target.combat.TurnHandler:
                 return ("|413%s isn't in the fight!|n" % target)
         if 'TargetNotEngaged' in conditions:
-            if caller.db.Combat_Range[target] == 0:
+            if caller.combat.Range[target] == 0:
                 return ("|413%s is too close to you for you to do that!|n" % target)
         if 'TargetHasHP' in conditions:
             if target.db.HP <= 0:
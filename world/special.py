@@ -12,22 +12,27 @@ def special_cost(effects):
         cost = 0
     return cost
 
+def spend_special(character, effects):
+    "Spends the SP for a special move, and counts it towards the character's record for the fight."
+    character.db.SP -= special_cost(effects)
+    character.combat.SpecialsUsed = (character.combat.SpecialsUsed or 0) + 1
+
 def special_support(target, user, effects):
     "Performs special support effects."
     # If there's a Heal effect, recover random target's VIT in HP.
     if "Heal" in effects:
-        rules.recover_hp(target, target.db.VIT)
+        rules.recover_hp(target, target.sheet.VIT)
     # If there's a Heal effect, recover 3 SP.
     if "SP Recover" in effects:
         rules.recover_sp(target, 3)
     # If there's a Super Dash effect, gain a dash's worth of movement +2.
     if "Super Dash" in effects:
         # But not if you're immobilized.
-        if 'Immobilization' in target.db.Combat_Conditions:
+        if 'Immobilization' in target.combat.Conditions:
             target.msg("You're immobilized! You can't move!")
             return
-        target.db.Combat_Moves += int(math.ceil(float(target.db.MOB) / 2) + 2)
-        target.location.msg_contents("%s gains a huge burst of movement! |552[|554+%i|552 Movement]|n" % (target, int(math.ceil(float(target.db.MOB) / 2) + 2)))
+        target.combat.Moves += int(math.ceil(float(target.sheet.MOB) / 2) + 2)
+        rules.room_msg(target.location, "%s gains a huge burst of movement! |552[|554+%i|552 Movement]|n" % (target, int(math.ceil(float(target.sheet.MOB) / 2) + 2)))
     # If there's a Grant Buffed ATK effect, give the Buffed ATK condition to the target for 3 turns.
     if 'Grant Buffed ATK' in effects:
         add_condition(target, user, 'Buffed ATK', 3 + 1)
@@ -78,29 +83,32 @@ def special_drawback(target, user, effects):
 def add_condition(character, turnchar, condition, duration):
     "Adds a condition to a fighter."
     # The first value is the remaining turns - the second value is whose turn to count down on.
-    character.db.Combat_Conditions.update({condition:[duration, turnchar]})
+    character.combat.Conditions.update({condition:[duration, turnchar]})
+    rules.mark_oob_change(character, "conditions")
     # Tell everyone!
-    character.location.msg_contents("%s gains the |255[|455%s|255]|n condition." % (character, condition))
+    rules.room_msg(character.location, "%s gains the |255[|455%s|255]|n condition." % (character, condition))
 
 def condition_tickdown(character, turnchar):
     "Ticks down the duration of conditions on a character at the end of a given character's turn."
-    for key in character.db.Combat_Conditions:
+    rules.mark_oob_change(character, "conditions")
+    # Go over a copy of the keys, since conditions that run out are deleted as we go.
+    for key in list(character.combat.Conditions):
         # The first value is the remaining turns - the second value is whose turn to count down on.
-        condition_duration = character.db.Combat_Conditions[key][0]
-        condition_turnchar = character.db.Combat_Conditions[key][1]
+        condition_duration = character.combat.Conditions[key][0]
+        condition_turnchar = character.combat.Conditions[key][1]
         # Count down if the given turn character matches the condition's turn character.
         if condition_turnchar == turnchar:
-            character.db.Combat_Conditions[key][0] -= 1
-        if character.db.Combat_Conditions[key][0] <= 0:
+            character.combat.Conditions[key][0] -= 1
+        if character.combat.Conditions[key][0] <= 0:
             # If the duration is brought down to 0, remove the condition and inform everyone.
-            character.location.msg_contents("%s no longer has the |255[|455%s|255]|n condition." % (str(character), str(key)))
-            del character.db.Combat_Conditions[key]
+            rules.room_msg(character.location, "%s no longer has the |255[|455%s|255]|n condition." % (str(character), str(key)))
+            del character.combat.Conditions[key]
     
 def check_stat_requirements(character, effect):
     "Verifies if a character meets the stat requirements to take a special effect. Returns false if fail, true if pass."
     specialdict = special_dictionary()
     # Get the character's stats.
-    char_stats = [character.db.ATM, character.db.DEF, character.db.VIT, character.db.ATR, character.db.MOB, character.db.SPE]
+    char_stats = character.derived_stats()["Stats"]
     # Get the prerequisite stats from the special dictionary.
     special_req = [specialdict[effect][3][0], specialdict[effect][3][1], specialdict[effect][3][2], specialdict[effect][3][3], specialdict[effect][3][4], specialdict[effect][3][5]]
     current_loop = 0
@@ -132,6 +140,7 @@ def special_dictionary():
         'Bonus Action':(2, ['Support Other', 'Support Self', 'Hinder Other'], ['Second Only'], [0,0,0,0,0,0], 'Take another non-special action after using your special move'),
         'Boosted Attack':(2, ['Special Melee Attack', 'Special Ranged Attack'], ['Reduced Attack'], [0,0,0,0,0,0], 'Adds 2 to your attack roll'),
         'Boosted Defense':(2, ['Special Defense'], [], [0,0,0,0,0,0], 'Adds 2 to your defense roll'),
+        'Burst':(4, ['Special Ranged Attack'], ['Sweep', 'Double Attack', 'Parting Attack', 'Point-Blank'], [0,0,0,0,0,0], 'Attack every enemy 1 to 3 steps away at once - no target needed'),
         'Bypass Defense':(2, ['Special Melee Attack', 'Special Ranged Attack'], [], [0,0,0,0,0,0], 'Target\'s defense roll is halved against your attack'),
         'Charge Move':(-2, ['Special Melee Attack', 'Special Ranged Attack', 'Special Defense', 'Support Other', 'Support Self', 'Hinder Other'], [''], [0,0,0,0,0,0], 'Move must be prepared with \'charge\' command'),
         'Counterattack':(2, ['Special Defense'], ['Reflect'], [0,0,0,0,0,0], 'On successful defense, attack your opponent'),
@@ -173,6 +182,7 @@ def special_dictionary():
         'Recoil':(-1, ['Special Melee Attack', 'Special Ranged Attack'], ['No Damage'], [0,0,0,0,0,0], 'If your attack hits, take half damage given'),
         'SP Recover':(2, ['Support Self'], ['First Only'], [0,0,0,0,0,0], 'Regain 3 SP (1 without drawbacks)'),
         'Super Dash':(2, ['Support Self'], [], [0,0,0,0,0,0], 'Dash with +2 extra movement'),
+        'Sweep':(3, ['Special Melee Attack'], ['Burst', 'Double Attack', 'Lunge Attack', 'Parting Attack', 'Projected Strike'], [0,0,0,0,0,0], 'Attack every engaged enemy at once - no target needed'),
         'Take Disabled Action':(-2, ['Special Melee Attack', 'Special Ranged Attack', 'Special Defense', 'Support Other', 'Support Self', 'Hinder Other'], [''], [0,0,0,0,0,0], 'You can\'t take an action on your next turn'),
         'Take Immobilization':(-1, ['Special Melee Attack', 'Special Ranged Attack', 'Special Defense', 'Support Other', 'Support Self', 'Hinder Other'], [''], [0,0,0,0,6,0], 'You can\'t move on your next turn'),
         'Touch Effect':(-1, ['Support Other', 'Hinder Other'], [''], [0,0,0,0,0,0], 'Can only use this move on engaged targets'),
@@ -0,0 +1,166 @@
+"""
+Spectating
+
+Lets anyone follow a fight from anywhere with the 'spectate' command.
+Spectators don't get each combat message as it happens - messages are
+gathered up over a turn and sent as one block when the turn ends, and
+each spectator gets at most one block every SPECTATE_INTERVAL seconds.
+If turns go by faster than that, the blocks pile up and go out together.
+Someone who starts watching partway through a fight gets a readout of
+where it stands first.
+
+Web visitors watch from the website's spectate page (see web/views.py),
+which asks for the fight's state and any new turn blocks every
+SPECTATE_INTERVAL seconds. The website runs in its own threads, so it
+reads fights only through the web_ functions below, run on the reactor
+thread, and gets back copies that nothing else touches. A fight only keeps blocks for the web while
+it's been asked for them in the last SPECTATE_WEB_IDLE seconds, and only
+the last SPECTATE_WEB_BLOCKS of them.
+
+Spectators are kept on the turn handler's ndb, so they have to start
+watching again after a reload.
+
+"""
+
+import time
+import rules
+import fights
+from collections import deque
+from django.conf import settings
+from evennia import utils
+
+# Least number of seconds between two feed messages to the same spectator.
+SPECTATE_INTERVAL = getattr(settings, "SPECTATE_FEED_INTERVAL", 5)
+# Seconds a fight keeps its feed for the web after the last time it was asked for it.
+SPECTATE_WEB_IDLE = getattr(settings, "SPECTATE_WEB_IDLE", 30)
+# How many turn blocks a fight keeps for the web.
+SPECTATE_WEB_BLOCKS = getattr(settings, "SPECTATE_WEB_BLOCKS", 20)
+
+def find_fight(obj):
+    "Returns the turn handler of the fight a fighter is in, or that's going on in a room, or None."
+    if rules.is_fighter(obj):
+        return fights.fighter_fight(obj)
+    return fights.room_fight(obj)
+
+def add_spectator(handler, spectator):
+    "Starts a spectator watching a fight and sends them where the fight stands so far."
+    remove_spectator(spectator)
+    spectators = handler.ndb.spectators
+    if spectators is None:
+        spectators = {}
+        handler.ndb.spectators = spectators
+    spectators[spectator] = {"last":0, "pending":[], "scheduled":False}
+    spectator.ndb.spectating = handler
+    spectator.msg(text=spectate_snapshot(handler), combat_state=((), rules.fight_snapshot(handler)))
+
+def remove_spectator(spectator):
+    "Stops a spectator watching whatever fight they're watching. Returns the fight's turn handler, or None."
+    handler = spectator.ndb.spectating
+    spectator.ndb.spectating = None
+    if handler and handler.ndb.spectators:
+        watch = handler.ndb.spectators.pop(spectator, None)
+        if watch:
+            # Anything held back is dropped, so a send that's already scheduled has nothing to send.
+            del watch["pending"][:]
+    return handler
+
+def web_watched(handler):
+    "Returns whether a fight's been watched from the web recently enough to keep its feed for the web."
+    return (handler.ndb.web_watched_until or 0) > time.time()
+
+def web_fight_list():
+    "Returns (fight id, location, fighter names) for every fight going on, for the website. Run on the reactor thread."
+    return [(handler.db.fight_id, handler.obj.key, ", ".join(fighter.key for fighter in handler.fighters))
+            for handler in fights.all_fights()]
+
+def web_fight(fight_id):
+    "Returns where the fight with the given id is going on, for the website, or None if there's no such fight. Run on the reactor thread."
+    handler = fights.get_fight(fight_id)
+    return handler.obj.key if handler else None
+
+def web_feed(fight_id, since):
+    """
+    Called by the website's spectate page, on the reactor thread. Returns
+    the fight's current state, the turn blocks after number 'since' that
+    the fight still has, and the number of the latest block, and keeps
+    the fight's feed going for the web a while longer. Returns None once
+    the fight is over.
+    """
+    handler = fights.get_fight(fight_id)
+    if not handler:
+        return None
+    handler.ndb.web_watched_until = time.time() + SPECTATE_WEB_IDLE
+    blocks = [block for number, block in handler.ndb.web_blocks or () if number > since]
+    return rules.fight_snapshot(handler), blocks, handler.ndb.web_block_count or 0
+
+def spectate_snapshot(handler):
+    "Returns a readout of every fighter's status and whose turn it is, for someone who just started watching."
+    fighters = handler.fighters
+    lines = ["|530%s|n" % '{:-^88}'.format(" |540Now spectating|530 ")]
+    for fighter in fighters:
+        lines.append(rules.combat_status_line(fighter))
+    lines.append("|530%s|n" % '{:-^80}'.format(" It's %s's turn " % fighters[handler.db.turn]))
+    return "\n".join(lines)
+
+def feed_spectators(handler, message):
+    "Adds a combat message to the fight's feed for the current turn, if anyone is watching."
+    if not handler.ndb.spectators and not web_watched(handler):
+        return
+    feed = handler.ndb.spectator_feed
+    if feed is None:
+        feed = []
+        handler.ndb.spectator_feed = feed
+    feed.append(message)
+
+def feed_room_spectators(location, message):
+    "Adds a message sent to a room to the feed of the fight going on there, if there is one."
+    handler = fights.room_fight(location)
+    if handler:
+        feed_spectators(handler, message)
+
+def end_spectator_turn(handler):
+    "Sends the turn's feed to every spectator as one block, or holds it for those who got one too recently."
+    feed = handler.ndb.spectator_feed
+    handler.ndb.spectator_feed = None
+    if not feed:
+        return
+    block = "\n".join(feed)
+    if web_watched(handler):
+        if handler.ndb.web_blocks is None:
+            handler.ndb.web_blocks = deque(maxlen=SPECTATE_WEB_BLOCKS)
+        handler.ndb.web_block_count = (handler.ndb.web_block_count or 0) + 1
+        handler.ndb.web_blocks.append((handler.ndb.web_block_count, block))
+    if not handler.ndb.spectators:
+        return
+    now = time.time()
+    for spectator, watch in handler.ndb.spectators.items():
+        watch["pending"].append(block)
+        wait = watch["last"] + SPECTATE_INTERVAL - now
+        if wait <= 0:
+            send_feed(spectator, watch)
+        elif not watch["scheduled"]:
+            watch["scheduled"] = True
+            utils.delay(wait, callback=lambda spectator=spectator, watch=watch: send_feed(spectator, watch))
+
+def send_feed(spectator, watch):
+    "Sends a spectator everything waiting in their feed."
+    watch["scheduled"] = False
+    if watch["pending"]:
+        spectator.msg("\n".join(watch["pending"]))
+        del watch["pending"][:]
+        watch["last"] = time.time()
+
+def end_spectating(handler):
+    "Sends spectators the rest of the feed right away when a fight ends, and stops them watching."
+    spectators = handler.ndb.spectators
+    if not spectators:
+        return
+    feed = handler.ndb.spectator_feed
+    handler.ndb.spectator_feed = None
+    handler.ndb.spectators = None
+    for spectator, watch in spectators.items():
+        if feed:
+            watch["pending"].append("\n".join(feed))
+        send_feed(spectator, watch)
+        spectator.ndb.spectating = None
+        spectator.msg("|445The fight you were watching is over.|n")
@@ -0,0 +1,435 @@
+"""
+Tests for the tournament pairing rules in world/brackets.py, the
+matchmaking queue in world/matchmaking.py, and the parts of the
+background writer, fight snapshots and ratings that don't need the
+database.
+
+Each tournament is played out the way the Tournament script does it -
+pair whoever's ready, play some of the waiting matches, record the
+results, and pair again - until it's finished.
+
+The matchmaking and writer tests swap out the parts of those modules
+that reach the database, start fights or wait on timers, so only their
+own bookkeeping is tested.
+
+"""
+
+import random
+import unittest
+from bisect import insort
+
+from world import brackets
+from world import fights
+from world import matchmaking
+from world import ratings
+from world import writer
+
+# Most times next_pairings() can be asked for pairs in a single pair_ready() before it counts as looping forever.
+MAX_PAIRING_CALLS = 100
+
+def new_tournament(tournament_format, count, rounds=0):
+    "Returns the state of a new tournament with the given number of entrants, whose ids are their seeds."
+    return brackets.new_state(tournament_format, [(pid, "Entrant %i" % pid) for pid in range(count)], rounds)
+
+class BracketsTest(unittest.TestCase):
+    def setUp(self):
+        # Counts calls to next_pairings() so a pair_ready() that never stops fails instead of hanging.
+        self.next_pairings = brackets.next_pairings
+        self.calls = 0
+        def counted(state):
+            self.calls += 1
+            if self.calls > MAX_PAIRING_CALLS:
+                raise AssertionError("pair_ready() keeps finding pairs")
+            return self.next_pairings(state)
+        brackets.next_pairings = counted
+    def tearDown(self):
+        brackets.next_pairings = self.next_pairings
+    def play(self, state, pick_winner, pick_match=lambda waiting: waiting[0]):
+        "Plays a tournament out one match at a time. Returns the number of matches played."
+        players = state["players"]
+        played, now = 0, 0
+        # Every entrant can play at most one match per other entrant per loss, plus a round's worth more.
+        limit = len(players) * len(players) * 2 + len(players) * max(state["rounds"], 1)
+        while True:
+            self.calls = 0
+            brackets.pair_ready(state, now)
+            now += 1
+            if brackets.is_finished(state):
+                return played
+            self.assertTrue(state["waiting"], "No matches waiting, but the tournament isn't finished")
+            match = pick_match(state["waiting"])
+            state["waiting"].remove(match)
+            first, second = match[:2]
+            self.assertNotEqual(first, second)
+            self.assertIn(first, brackets.alive(state))
+            self.assertIn(second, brackets.alive(state))
+            brackets.record_result(state, first, second, pick_winner(first, second))
+            played += 1
+            self.assertLessEqual(played, limit, "The tournament never ends")
+    def check_elimination(self, tournament_format, count):
+        "Plays out an elimination tournament several ways, checking each ends with one winner."
+        max_losses = brackets.MAX_LOSSES[tournament_format]
+        winners = {"favourites": lambda first, second: min(first, second),
+                   "upsets": lambda first, second: max(first, second)}
+        for name, pick_winner in winners.items():
+            for pick_match in (lambda waiting: waiting[0], lambda waiting: waiting[-1]):
+                state = new_tournament(tournament_format, count)
+                played = self.play(state, pick_winner, pick_match)
+                remaining = brackets.alive(state)
+                self.assertEqual(len(remaining), 1, "%s %s with %i entrants" % (name, tournament_format, count))
+                self.assertEqual(brackets.standings(state)[0], remaining[0])
+                # Everyone else is out, and each loss is one match.
+                for pid, entrant in state["players"].items():
+                    if pid != remaining[0]:
+                        self.assertEqual(entrant["losses"], max_losses)
+                self.assertEqual(played, sum(entrant["losses"] for entrant in state["players"].values()))
+        rng = random.Random(count)
+        for attempt in range(20):
+            state = new_tournament(tournament_format, count)
+            self.play(state, lambda first, second: rng.choice((first, second)),
+                      lambda waiting: rng.choice(waiting))
+            self.assertEqual(len(brackets.alive(state)), 1)
+    def test_single_elimination(self):
+        for count in (2, 3, 5, 8):
+            self.check_elimination("single", count)
+    def test_double_elimination(self):
+        for count in (2, 3, 5, 8):
+            self.check_elimination("double", count)
+    def test_single_elimination_matches(self):
+        # With eight entrants, that's seven matches, and the top seed plays the bottom seed first.
+        state = new_tournament("single", 8)
+        brackets.pair_ready(state, 0)
+        self.assertEqual(len(state["waiting"]), 4)
+        self.assertEqual(state["waiting"][0][:2], [0, 7])
+        self.assertEqual(self.play(state, min), 7)
+        self.assertEqual(brackets.alive(state), [0])
+    def test_no_winner(self):
+        # Matches with no winner count as a loss for both, so everyone can be out.
+        state = new_tournament("single", 2)
+        self.play(state, lambda first, second: None)
+        self.assertEqual(brackets.alive(state), [])
+        self.assertTrue(brackets.is_finished(state))
+    def test_swiss(self):
+        for count in (3, 5, 7):
+            for rounds in (1, 2, 3):
+                rng = random.Random(count * 10 + rounds)
+                state = new_tournament("swiss", count, rounds)
+                played = self.play(state, lambda first, second: rng.choice((first, second)),
+                                   lambda waiting: rng.choice(waiting))
+                players = state["players"]
+                # Everyone plays every round, one bye each round, and nobody gets two.
+                for entrant in players.values():
+                    self.assertEqual(entrant["played"], rounds)
+                byes = [pid for pid in players if players[pid]["bye"]]
+                self.assertEqual(len(byes), rounds)
+                self.assertEqual(played, rounds * (count - 1) // 2)
+                self.assertEqual(sum(entrant["score"] for entrant in players.values()), played + rounds)
+                ranked = brackets.standings(state)
+                self.assertEqual(sorted(ranked), sorted(players))
+                self.assertEqual(players[ranked[0]]["score"], max(entrant["score"] for entrant in players.values()))
+    def test_standings_lines(self):
+        state = new_tournament("single", 3)
+        self.play(state, min)
+        lines = brackets.standings_lines(state)
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith("1. Entrant 0 - 2-0"))
+
+class FakeSheet(object):
+    "Just the stats stat_tier() looks at."
+    def __init__(self, ATM, DEF, VIT, ATR):
+        self.ATM, self.DEF, self.VIT, self.ATR = ATM, DEF, VIT, ATR
+
+class FakeCombat(object):
+    TurnHandler = None
+
+class FakeFighter(object):
+    "Stands in for a Character in the queue."
+    has_player = True
+    location = None
+    def __init__(self, fighter_id, rating, sheet=None):
+        self.id = fighter_id
+        self.rating = rating
+        self.sheet = sheet or FakeSheet(9, 9, 9, 9)
+        self.combat = FakeCombat()
+        self.messages = []
+    def msg(self, text):
+        self.messages.append(text)
+
+class FakeManager(object):
+    def __init__(self, fighters):
+        self.fighters = fighters
+    def get_id(self, fighter_id):
+        return self.fighters.get(fighter_id)
+
+class FakeObjectDB(object):
+    def __init__(self, fighters):
+        self.objects = FakeManager(fighters)
+
+class FakeRatings(object):
+    def __init__(self, fighters):
+        self.fighters = fighters
+    def rating(self, fighter_id):
+        return self.fighters[fighter_id].rating
+
+class FakeTournaments(object):
+    def entrant_tournament(self, character):
+        return None
+
+class MatchmakingTest(unittest.TestCase):
+    def setUp(self):
+        self.fighters = {}
+        self.saved = dict((name, getattr(matchmaking, name)) for name in
+                          ("ObjectDB", "ratings", "tournaments", "schedule_sweep", "start_pending"))
+        matchmaking.ObjectDB = FakeObjectDB(self.fighters)
+        matchmaking.ratings = FakeRatings(self.fighters)
+        matchmaking.tournaments = FakeTournaments()
+        # Nothing's swept on a timer or started in an arena - the pairs are left in _pending to look at.
+        matchmaking.schedule_sweep = lambda: None
+        matchmaking.start_pending = lambda: None
+        self.clear_queue()
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(matchmaking, name, value)
+        self.clear_queue()
+    def clear_queue(self):
+        matchmaking._queued.clear()
+        matchmaking._buckets.clear()
+        matchmaking._pending.clear()
+        matchmaking._matched.clear()
+    def fighter(self, fighter_id, rating, sheet=None):
+        self.fighters[fighter_id] = FakeFighter(fighter_id, rating, sheet)
+        return self.fighters[fighter_id]
+    def queue_at(self, fighter, joined):
+        "Puts a fighter straight in the queue as if they'd joined at the given time, without matching them."
+        tier = matchmaking.stat_tier(fighter)
+        matchmaking._queued[fighter.id] = (tier, fighter.rating, joined)
+        insort(matchmaking._buckets.setdefault(tier, []), (fighter.rating, fighter.id))
+        return tier
+    def pairs(self):
+        return [set(pair[:2]) for pair in matchmaking._pending]
+    def check_buckets(self):
+        "Checks every bucket is sorted and holds exactly the fighters in _queued."
+        seen = []
+        for tier, bucket in matchmaking._buckets.items():
+            self.assertTrue(bucket)
+            self.assertEqual(bucket, sorted(bucket))
+            for rating, fighter_id in bucket:
+                self.assertEqual(matchmaking._queued[fighter_id][:2], (tier, rating))
+                seen.append(fighter_id)
+        self.assertEqual(sorted(seen), sorted(matchmaking._queued))
+    def test_stat_tier(self):
+        # Builds with the same stat total land in different tiers if they lean different ways.
+        attacker = self.fighter(1, 1500, FakeSheet(12, 6, 6, 12))
+        defender = self.fighter(2, 1500, FakeSheet(6, 12, 12, 6))
+        balanced = self.fighter(3, 1500, FakeSheet(9, 9, 9, 9))
+        tiers = [matchmaking.stat_tier(fighter) for fighter in (attacker, balanced, defender)]
+        self.assertEqual(len(set(tiers)), 3)
+        self.assertEqual(tiers, sorted(tiers, reverse=True))
+    def test_nearest_opponent(self):
+        for fighter_id, rating in ((1, 1500), (2, 1520), (3, 1540), (4, 1700)):
+            tier = self.queue_at(self.fighter(fighter_id, rating), 0)
+        self.check_buckets()
+        # Just joined, only ratings inside the starting window will do, and the closest is picked.
+        self.assertEqual(matchmaking.nearest_opponent(3, tier, 0), 2)
+        self.assertEqual(matchmaking.nearest_opponent(1, tier, 0), 2)
+        self.assertEqual(matchmaking.nearest_opponent(4, tier, 0), None)
+        # Nobody in a tier that's empty.
+        self.assertEqual(matchmaking.nearest_opponent(1, tier + 1, 0), None)
+        # Once the window has grown all the way, anyone in the tier will do.
+        self.assertEqual(matchmaking.nearest_opponent(4, tier, 10 ** 6), 3)
+    def test_join_queue(self):
+        matchmaking.join_queue(self.fighter(1, 1500))
+        matchmaking.join_queue(self.fighter(2, 1800))
+        self.assertEqual(self.pairs(), [])
+        self.check_buckets()
+        matchmaking.join_queue(self.fighter(3, 1510))
+        self.assertEqual(self.pairs(), [set((1, 3))])
+        self.assertEqual(matchmaking._matched, set((1, 3)))
+        self.assertEqual(list(matchmaking._queued), [2])
+        self.check_buckets()
+    def test_sweep(self):
+        # Queued a long time ago, so the windows have all grown as far as they go.
+        for fighter_id, rating in enumerate((1500, 1510, 1700, 1715, 2100)):
+            self.queue_at(self.fighter(fighter_id, rating), 0)
+        matchmaking.sweep()
+        # Neighbours are paired in rating order, and whoever's left over stays in the queue.
+        self.assertEqual(self.pairs(), [set((0, 1)), set((2, 3))])
+        self.assertEqual(list(matchmaking._queued), [4])
+        self.check_buckets()
+    def test_sweep_neighbouring_tiers(self):
+        lone = self.fighter(1, 1500, FakeSheet(12, 6, 6, 12))
+        other = self.fighter(2, 1500, FakeSheet(12, 6, 6, 9))
+        self.assertEqual(matchmaking.stat_tier(lone) - matchmaking.stat_tier(other), 1)
+        self.queue_at(lone, 0)
+        self.queue_at(other, 0)
+        matchmaking.sweep()
+        self.assertEqual(self.pairs(), [set((1, 2))])
+        self.assertEqual(matchmaking._queued, {})
+        self.assertEqual(matchmaking._buckets, {})
+    def test_cancel_match(self):
+        matchmaking.join_queue(self.fighter(1, 1500))
+        matchmaking.join_queue(self.fighter(2, 1500))
+        self.assertEqual(self.pairs(), [set((1, 2))])
+        self.assertTrue(matchmaking.leave_queue(1))
+        # The opponent goes back in the queue, and is told so.
+        self.assertEqual(self.pairs(), [])
+        self.assertEqual(matchmaking._matched, set())
+        self.assertEqual(list(matchmaking._queued), [2])
+        self.assertEqual(len(self.fighters[2].messages), 1)
+        self.check_buckets()
+        self.assertTrue(matchmaking.leave_queue(2))
+        self.assertFalse(matchmaking.leave_queue(2))
+        self.assertEqual(matchmaking._buckets, {})
+    def test_cancel_match_partner_gone(self):
+        matchmaking.join_queue(self.fighter(1, 1500))
+        matchmaking.join_queue(self.fighter(2, 1500))
+        self.fighters[2].has_player = False
+        matchmaking.cancel_match(1)
+        # An opponent who's logged off isn't put back in the queue.
+        self.assertEqual(self.pairs(), [])
+        self.assertEqual(matchmaking._queued, {})
+        self.assertEqual(self.fighters[2].messages, [])
+
+class WriterTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = dict((name, getattr(writer, name)) for name in
+                          ("schedule_flush", "write_batch", "WRITER_QUEUE_LIMIT"))
+        self.flushes = []
+        self.written = []
+        # Nothing's sent to the worker thread, and writing a batch just runs it here.
+        writer.schedule_flush = lambda: self.flushes.append(len(writer._queue))
+        def write_batch(batch):
+            for key, func, args in batch:
+                func(*args)
+            return 0
+        writer.write_batch = write_batch
+        writer._queue.clear()
+        writer._keyed.clear()
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(writer, name, value)
+        writer._queue.clear()
+        writer._keyed.clear()
+    def save(self, name, value):
+        self.written.append((name, value))
+    def test_dedup(self):
+        writer.enqueue(self.save, ("first", 1), key="first")
+        writer.enqueue(self.save, ("other", 1))
+        writer.enqueue(self.save, ("first", 2), key="first")
+        writer.enqueue(self.save, ("first", 3), key="first")
+        self.assertTrue(writer.is_queued("first"))
+        self.assertEqual(len(writer._queue), 2)
+        # A replaced write keeps its place in the queue, but saves the latest value.
+        writer.flush_now()
+        self.assertEqual(self.written, [("first", 3), ("other", 1)])
+        self.assertFalse(writer.is_queued("first"))
+        self.assertEqual(writer._keyed, {})
+        # Once sent, the same key queues a new write behind anything newer.
+        writer.enqueue(self.save, ("other", 2))
+        writer.enqueue(self.save, ("first", 4), key="first")
+        batch = writer.take_batch(10)
+        self.assertEqual([entry[2] for entry in batch], [("other", 2), ("first", 4)])
+    def test_batches(self):
+        for value in range(5):
+            writer.enqueue(self.save, ("value", value), key=value % 3)
+        self.assertEqual([entry[2] for entry in writer.take_batch(2)], [("value", 3), ("value", 4)])
+        self.assertEqual([entry[2] for entry in writer.take_batch(2)], [("value", 2)])
+        self.assertEqual(writer._keyed, {})
+    def test_backpressure(self):
+        writer.WRITER_QUEUE_LIMIT = 3
+        writer.enqueue(self.save, ("value", 1))
+        writer.enqueue(self.save, ("value", 2))
+        self.assertEqual(self.written, [])
+        # The write that fills the queue writes everything, in order, without waiting for a flush.
+        writer.enqueue(self.save, ("value", 3))
+        self.assertEqual(self.written, [("value", 1), ("value", 2), ("value", 3)])
+        self.assertEqual(len(writer._queue), 0)
+        self.assertEqual(self.flushes, [1, 2])
+        # Nothing's left holding the lock.
+        self.assertTrue(writer._write_lock.acquire(False))
+        writer._write_lock.release()
+
+class SnapshotTest(unittest.TestCase):
+    def test_pack_state(self):
+        fighters = [FakeFighter(fighter_id, 1500) for fighter_id in (10, 20, 30)]
+        slots = dict((fighter, slot) for slot, fighter in enumerate(fighters))
+        first, second, third = fighters
+        state = {"Conditions": {"Stunned": [2, second], "Bleeding": [1, third]},
+                 "IncomingAttack": ("Melee", third, 5, ["Boosted Attack"]),
+                 "AreaTargets": {first: 1, second: 2},
+                 "SP": 4}
+        packed = dict((key, fights.pack_state(key, value, slots)) for key, value in state.items())
+        # No fighters left in it, only their places.
+        self.assertEqual(packed["Conditions"], {"Stunned": [2, 1], "Bleeding": [1, 2]})
+        self.assertEqual(packed["IncomingAttack"], ("Melee", 2, 5, ["Boosted Attack"]))
+        self.assertEqual(packed["AreaTargets"], {0: 1, 1: 2})
+        unpacked = dict((key, fights.unpack_state(key, value, fighters)) for key, value in packed.items())
+        self.assertEqual(unpacked, state)
+    def test_plain(self):
+        value = fights.plain({"a": ({"b": [1, 2]},), "c": "text"})
+        self.assertEqual(value, {"a": ({"b": [1, 2]},), "c": "text"})
+
+class RatingsTest(unittest.TestCase):
+    def setUp(self):
+        ratings._ratings.clear()
+        del ratings._board[:]
+    def tearDown(self):
+        ratings._ratings.clear()
+        del ratings._board[:]
+    def check_board(self):
+        "Checks the leaderboard is sorted, best first, and has everyone rated exactly once."
+        self.assertEqual(ratings._board, sorted(ratings._board))
+        self.assertEqual(sorted(fighter_id for negative, fighter_id in ratings._board), sorted(ratings._ratings))
+        for negative, fighter_id in ratings._board:
+            self.assertEqual(-negative, ratings._ratings[fighter_id][0])
+    def total(self, fighter_ids):
+        return sum(ratings.rating(fighter_id) for fighter_id in fighter_ids)
+    def test_duel(self):
+        changes = ratings.apply_result([(1, "One"), (2, "Two")], 1)
+        self.assertEqual(changes[1], (ratings.RATING_START, ratings.RATING_START + ratings.RATING_K / 2.0))
+        self.assertEqual(changes[2], (ratings.RATING_START, ratings.RATING_START - ratings.RATING_K / 2.0))
+        self.assertEqual(ratings.rank(1), 1)
+        self.assertEqual(ratings.rank(2), 2)
+        self.assertEqual(ratings.rating_entry(1), [ratings.RATING_START + ratings.RATING_K / 2.0, 1, "One"])
+        self.check_board()
+    def test_no_change(self):
+        # No winner, or a winner who isn't in the fight, or nobody to beat.
+        self.assertEqual(ratings.apply_result([(1, "One"), (2, "Two")], None), {})
+        self.assertEqual(ratings.apply_result([(1, "One"), (2, "Two")], 3), {})
+        self.assertEqual(ratings.apply_result([(1, "One")], 1), {})
+        self.assertEqual(ratings.board_size(), 0)
+    def test_many_fights(self):
+        rng = random.Random(0)
+        fighter_ids = range(1, 21)
+        played = 0
+        for fight in range(300):
+            fighters = [(fighter_id, "Fighter %i" % fighter_id) for fighter_id in rng.sample(fighter_ids, rng.choice((2, 2, 3, 4)))]
+            before = self.total(fighter_id for fighter_id, name in fighters)
+            winner = rng.choice(fighters)[0]
+            changes = ratings.apply_result(fighters, winner)
+            played += len(fighters)
+            # Points only move between the fighters, and the winner never loses any.
+            self.assertAlmostEqual(self.total(fighter_id for fighter_id, name in fighters), before)
+            self.assertGreater(changes[winner][1], changes[winner][0])
+            # Nobody gains or loses more than K.
+            for old, new in changes.values():
+                self.assertLessEqual(abs(new - old), ratings.RATING_K)
+            self.check_board()
+        rated = list(ratings._ratings)
+        self.assertAlmostEqual(self.total(rated), ratings.RATING_START * len(rated))
+        self.assertEqual(sum(entry[1] for entry in ratings._ratings.values()), played)
+        # A page of the leaderboard is in rank order.
+        page = ratings.top(5, 3)
+        self.assertEqual([entry[0] for entry in page], [4, 5, 6, 7, 8])
+        self.assertEqual([entry[3] for entry in page], sorted([entry[3] for entry in page], reverse=True))
+        for place, fighter_id, name, rating, games in page:
+            self.assertEqual(ratings.rank(fighter_id), place)
+    def test_set_rating(self):
+        for fighter_id in range(10):
+            ratings.set_rating(fighter_id, "Fighter %i" % fighter_id, 1500 + fighter_id * 10, 1)
+        ratings.set_rating(0, "Fighter 0", 2000, 2)
+        ratings.set_rating(9, "Fighter 9", 1000, 2)
+        self.check_board()
+        self.assertEqual(ratings.board_size(), 10)
+        self.assertEqual(ratings.rank(0), 1)
+        self.assertEqual(ratings.rank(9), 10)
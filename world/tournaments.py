@@ -0,0 +1,88 @@
+"""
+Tournaments
+
+Organized events, run by a Tournament script (see typeclasses/scripts.py)
+without staff having to move anyone around. Three formats are supported:
+
+single - Single elimination. One loss and you're out.
+double - Double elimination. Two losses and you're out.
+swiss  - A set number of rounds. Everyone plays every round, against
+         someone with the same score they haven't fought yet, and the
+         best score at the end wins.
+
+There's no fixed bracket that waits for a whole round to finish before
+the next begins. Instead, whenever a fight ends, the fights registry
+calls fight_ended() right away, the result is recorded, and any two
+entrants who are now due to fight each other are paired and started in
+a free arena on the spot. So a fast match never waits on a slow one it
+has nothing to do with, and as many matches run at once as there are
+arenas for them.
+
+The formats and pairing rules themselves are in world/brackets.py.
+
+"""
+
+import fights
+from django.conf import settings
+from evennia import ScriptDB
+
+# Tournaments can't be started with more entrants than this.
+TOURNAMENT_MAX_ENTRANTS = getattr(settings, "TOURNAMENT_MAX_ENTRANTS", 256)
+
+# Tournament script id to the script.
+_tournaments = {}
+# Fight id to the tournament whose match it is.
+_match_fights = {}
+
+def register_tournament(tournament):
+    "Adds a tournament, and every match it has running, to the registry."
+    _tournaments[tournament.id] = tournament
+    for fight_id in tournament.ndb.state["matches"]:
+        _match_fights[fight_id] = tournament
+
+def register_match(tournament, fight_id):
+    "Notes that a fight is one of a tournament's matches."
+    _match_fights[fight_id] = tournament
+
+def unregister_tournament(tournament):
+    "Removes a tournament that's over from the registry."
+    _tournaments.pop(tournament.id, None)
+    for fight_id, owner in list(_match_fights.items()):
+        if owner == tournament:
+            del _match_fights[fight_id]
+
+def get_tournament(tournament_id):
+    "Returns the tournament with the given id, or None."
+    return _tournaments.get(tournament_id)
+
+def all_tournaments():
+    "Returns every tournament going on, oldest first."
+    return [_tournaments[tournament_id] for tournament_id in sorted(_tournaments)]
+
+def entrant_tournament(character):
+    "Returns the tournament a character is still in, or None."
+    for tournament in _tournaments.values():
+        if tournament.is_entrant(character):
+            return tournament
+    return None
+
+def start_tournaments():
+    "Hooks tournaments up to the end of every fight, and picks each one up where it left off. Called every time the server starts or reloads, after fights are restored."
+    fights.add_end_callback(fight_ended)
+    for tournament in ScriptDB.objects.filter(db_typeclass_path__endswith="Tournament"):
+        tournament.load_state()
+    for tournament in all_tournaments():
+        tournament.resume()
+
+def fight_ended(handler):
+    """
+    Called by the fights registry as soon as any fight ends. Tournament
+    matches are recorded and their tournament pairs whoever's next, and
+    every tournament gets a chance to start matches that were waiting on
+    an arena or on an entrant who was busy in another fight.
+    """
+    tournament = _match_fights.pop(handler.db.fight_id, None)
+    if tournament:
+        tournament.match_ended(handler)
+    for tournament in all_tournaments():
+        tournament.start_waiting()
@@ -0,0 +1,138 @@
+"""
+Background writer
+
+Saves things gameplay doesn't have to wait on - fight snapshots, match
+history and the like - on a worker thread, instead of on the reactor
+thread that runs commands, so a slow database doesn't hold commands up.
+
+Gameplay code only ever calls enqueue(). Queued writes go to the worker
+thread in batches, one batch at a time, each in a single transaction.
+Writes queued with the same key replace each other, so only the latest
+of them is saved. If the queue grows past WRITER_QUEUE_LIMIT, enqueue()
+writes the whole backlog right away instead - slowing the game down
+rather than letting unsaved writes pile up without limit. Anything still
+queued is written out before the server stops or reloads.
+
+Writes are always saved in the order they were queued, so a newer write
+with a key is never overwritten by an older one. Only one batch is ever
+being written at a time: the worker thread holds a lock while it writes,
+and flush_now() waits on the same lock before writing anything itself.
+
+"""
+
+import time
+import threading
+import metrics
+from collections import deque
+from django.conf import settings
+from django.db import transaction
+from twisted.internet import threads
+from evennia import utils
+from evennia.utils import logger
+
+# How many writes can be waiting before enqueue() writes them itself.
+WRITER_QUEUE_LIMIT = getattr(settings, "WRITER_QUEUE_LIMIT", 1000)
+# Most writes sent to the worker thread at once.
+WRITER_BATCH_SIZE = getattr(settings, "WRITER_BATCH_SIZE", 100)
+# Seconds to wait after a write is queued before sending a batch, so more can join it.
+WRITER_FLUSH_INTERVAL = getattr(settings, "WRITER_FLUSH_INTERVAL", 1)
+
+# Queued writes, as [key, function, args] lists, oldest first.
+_queue = deque()
+# Key to queued write, for the writes that have a key.
+_keyed = {}
+# Whether a batch is scheduled to be sent, and whether one is being written.
+_state = {"scheduled":False, "writing":False}
+# Held while a batch is being written, on either thread.
+_write_lock = threading.Lock()
+
+def enqueue(func, args=(), key=None):
+    "Queues func(*args) to be run on the worker thread. A write with the same key as one still queued replaces it."
+    if key is not None and key in _keyed:
+        _keyed[key][1:] = [func, args]
+        return
+    entry = [key, func, args]
+    _queue.append(entry)
+    if key is not None:
+        _keyed[key] = entry
+    metrics.gauge("writer.queue_depth", len(_queue))
+    if len(_queue) >= WRITER_QUEUE_LIMIT:
+        # Too far behind - write everything here and now.
+        metrics.incr("writer.backpressure")
+        flush_now()
+        return
+    schedule_flush()
+
+def is_queued(key):
+    "Returns whether a write with this key is still waiting to be sent to the worker thread."
+    return key in _keyed
+
+def schedule_flush():
+    "Sends a batch to the worker thread shortly, unless one's already on its way."
+    if _state["scheduled"] or _state["writing"]:
+        return
+    _state["scheduled"] = True
+    utils.delay(WRITER_FLUSH_INTERVAL, callback=flush)
+
+def take_batch(size):
+    "Takes up to size writes off the front of the queue."
+    batch = []
+    while _queue and len(batch) < size:
+        entry = _queue.popleft()
+        if entry[0] is not None:
+            del _keyed[entry[0]]
+        batch.append(entry)
+    metrics.gauge("writer.queue_depth", len(_queue))
+    return batch
+
+def flush():
+    "Sends the next batch of queued writes to the worker thread."
+    _state["scheduled"] = False
+    if _state["writing"] or not _queue:
+        return
+    batch = take_batch(WRITER_BATCH_SIZE)
+    _state["writing"] = True
+    # Taken here rather than on the worker thread, so flush_now() can't write anything before this batch.
+    _write_lock.acquire()
+    deferred = threads.deferToThread(write_in_background, batch)
+    deferred.addCallbacks(batch_written, batch_failed, callbackArgs=(batch,), errbackArgs=(batch,))
+
+def write_batch(batch):
+    "Runs a batch of writes in one transaction and returns how long it took. Runs on the worker thread."
+    start = time.time()
+    with transaction.atomic():
+        for key, func, args in batch:
+            func(*args)
+    return time.time() - start
+
+def write_in_background(batch):
+    "Writes a batch on the worker thread, then lets the next writer go."
+    try:
+        return write_batch(batch)
+    finally:
+        _write_lock.release()
+
+def batch_written(elapsed, batch):
+    "Called back on the reactor thread once a batch is saved."
+    _state["writing"] = False
+    metrics.timing("writer.flush_latency", elapsed)
+    metrics.incr("writer.written", len(batch))
+    if _queue:
+        schedule_flush()
+
+def batch_failed(failure, batch):
+    "Called back on the reactor thread if a batch couldn't be saved. The batch is dropped rather than retried forever."
+    _state["writing"] = False
+    metrics.incr("writer.failed", len(batch))
+    logger.log_err("Background writer failed to save %i writes: %s" % (len(batch), failure.getErrorMessage()))
+    if _queue:
+        schedule_flush()
+
+def flush_now():
+    "Writes everything queued right away, on this thread. Used when the queue is full and when the server stops."
+    # Wait for any batch still being written on the worker thread, since everything queued is newer.
+    with _write_lock:
+        while _queue:
+            batch = take_batch(WRITER_BATCH_SIZE)
+            metrics.timing("writer.flush_latency", write_batch(batch))
+            metrics.incr("writer.written", len(batch))